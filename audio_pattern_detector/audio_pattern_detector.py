@@ -1,8 +1,8 @@
 import sys
 from collections import defaultdict
-import json
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 from operator import itemgetter
 
@@ -10,7 +10,6 @@ import numpy as np
 
 from scipy.signal import correlate
 import math
-import matplotlib.pyplot as plt
 
 import pyloudnorm as pyln
 
@@ -18,30 +17,75 @@ import warnings
 from andrew_utils import seconds_to_time
 
 from scipy.signal import find_peaks
-from sklearn.metrics import mean_squared_error
 
-import soundfile as sf
-
-from audio_pattern_detector.audio_clip import AudioClip, AudioStream
-from audio_pattern_detector.numpy_encoder import NumpyEncoder
-from audio_pattern_detector.audio_utils import slicing_with_zero_padding, convert_audio_arr_to_float, \
-    downsample_preserve_maxima, TARGET_SAMPLE_RATE
-from audio_pattern_detector.detection_utils import area_of_overlap_ratio, is_pure_tone
+from audio_pattern_detector.audio_clip import AudioClip, AudioStream, MemmapAudioSource
+from audio_pattern_detector.audio_section_buffer import AudioSectionBuffer
+from audio_pattern_detector.audio_utils import get_zero_bordered_array, get_windows_with_zero_padding, \
+    convert_audio_arr_to_float, convert_audio_arr_to_float_into, downsample_preserve_maxima, \
+    downsample_preserve_maxima_batch, TARGET_SAMPLE_RATE
+from audio_pattern_detector.detection_utils import area_of_overlap_ratio_batch, partitioned_mean_squared_error, \
+    is_pure_tone
+from audio_pattern_detector.correlation_utils import get_fft_size, get_clip_spectrum, correlate_with_clip_spectra, \
+    get_energy_sums, get_normalized_correlation
+from audio_pattern_detector.detection_stats import DetectionStats, time_stage
+from audio_pattern_detector.tone_tracker import ToneTracker
+from audio_pattern_detector.cascade_search import decimate, get_candidate_ranges, merge_ranges, extend_ranges, \
+    get_ranges_length, is_in_ranges, correlate_in_ranges
+from audio_pattern_detector.fingerprint_index import OFFSET_TOLERANCE
 
 logger = logging.getLogger(__name__)
 
 #ignore possible clipping
 warnings.filterwarnings('ignore', module='pyloudnorm')
 
+# parts of a section quieter than -80 dBFS per sample are silence for the normalized cross-correlation
+MIN_SAMPLE_ENERGY = 1e-8
+
 
 class AudioPatternDetector:
 
-    def __init__(self, audio_clips: [AudioClip], debug_mode=False, seconds_per_chunk=60):
+    # collect_stats: also return DetectionStats with time per stage and verification counters
+    # clip_artifact_cache: ClipArtifactCache to reuse prepared clips from previous runs
+    # max_matches_per_clip: keep only the first n matches of each clip, reading stops once every clip has them,
+    #   1 finds only the first match, find_clip_in_pcm_file with multiple jobs stops starting new segments instead
+    # max_seconds: only matches starting within the first max_seconds of the searched audio (from start_seconds
+    #   if it is set), reading stops after that
+    # cascade: CascadeSettings to find candidates on decimated audio first and only correlate around them
+    #   at full rate, pure tone clips and very short clips are always correlated at full rate
+    # track_tones: find pure tone clips like beeps with ToneTracker in one pass over the stream instead of
+    #   cross-correlation, the other clips are not affected
+    # fingerprint_index: FingerprintIndex of the clips, every section is hashed once and looked up, and clips
+    #   are only correlated around the starts it finds, clips that are not in it with the same audio
+    #   and pure tone clips are correlated as usual
+    # dtype: float32 or float64 for the audio sections, clips, spectra and correlations, float32 halves the memory
+    #   and the fft cost, float64 gives the same results as before it was added
+    # normalized_correlation: find and score candidate peaks with the normalized cross-correlation, which divides
+    #   by the energy of the section under the clip at every lag, instead of normalizing the loudness of every
+    #   section, scores are then comparable across sections and the loudness stage is skipped
+    def __init__(self, audio_clips: [AudioClip], debug_mode=False, seconds_per_chunk=60, collect_stats=False,
+                 clip_artifact_cache=None, max_matches_per_clip=None, max_seconds=None, cascade=None,
+                 track_tones=False, fingerprint_index=None, dtype=np.float32, normalized_correlation=False):
         self.audio_clips = audio_clips
         self.debug_mode = debug_mode
+        self.collect_stats = collect_stats
+        self.clip_artifact_cache = clip_artifact_cache
+        if max_matches_per_clip is not None and max_matches_per_clip < 1:
+            raise ValueError(f"max_matches_per_clip {max_matches_per_clip} needs to be at least 1")
+        if max_seconds is not None and max_seconds <= 0:
+            raise ValueError(f"max_seconds {max_seconds} needs to be greater than 0")
+        self.max_matches_per_clip = max_matches_per_clip
+        self.max_seconds = max_seconds
+        self.cascade = cascade
+        self.track_tones = track_tones
+        self.fingerprint_index = fingerprint_index
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError(f"dtype {self.dtype} needs to be float32 or float64")
+        self.normalized_correlation = normalized_correlation
         #self.correlation_cache_correlation_method = {}
         self.normalize = True
         self.target_sample_rate = TARGET_SAMPLE_RATE
+        self.beep_target_num_sample_after_resample = 101
 
         clips_already = set()
         max_clip_length = 0
@@ -62,6 +106,8 @@ class AudioPatternDetector:
 
         self.seconds_per_chunk = seconds_per_chunk
 
+        self._prepared_clips = None
+
         if seconds_per_chunk != 60:
             logger.warning(f"seconds_per_chunk {seconds_per_chunk} is not 60 seconds, turning off debug mode because it was made for 60 seconds only")
             self.debug_mode = False
@@ -71,85 +117,523 @@ class AudioPatternDetector:
         #         raise ValueError(f"Clip {clip_path} does not exist")
 
     # could cause issues with small overlap when intro is followed right by news report
-    def find_clip_in_audio(self, audio_stream: AudioStream):
+    # audio_stream can also be a MemmapAudioSource for audio that is already decoded
+    # start_seconds, end_seconds: only search this part of the audio, peak times are still from the beginning
+    #   of the audio. An AudioStream needs to start at start_seconds already, e.g. from ffmpeg_get_16bit_pcm
+    #   with the same start_seconds, so that the audio before it is never decoded
+    def find_clip_in_audio(self, audio_stream: AudioStream | MemmapAudioSource, start_seconds=None,
+                           end_seconds=None):
         # clip_paths = self.clip_paths
         #
         # if not os.path.exists(full_audio_path):
         #     raise ValueError(f"Full audio {full_audio_path} does not exist")
 
+        full_audio_name = audio_stream.name
+
+        clip_cache = self._new_clip_cache()
+
+        start_sample, end_sample = self._get_sample_range(start_seconds, end_seconds)
+        chunks = self._get_chunks(audio_stream, clip_cache, start_sample, end_sample)
+
+        all_peak_times, total_time = self._find_clip_in_chunks(chunks,
+                                                               start_index=0,
+                                                               previous_chunk=None,
+                                                               clip_cache=clip_cache,
+                                                               time_offset=start_sample / self.target_sample_rate)
+
+        if self.debug_mode:
+            import matplotlib.pyplot as plt
+
+            suffix = full_audio_name
+
+            for audio_clip in self.audio_clips:
+                #clip_name, _ = os.path.splitext(os.path.basename(clip_path))
+                clip_name = audio_clip.name
+
+                # similarity debug
+                graph_dir = f"./tmp/graph/mean_squared_error_similarity/{clip_name}"
+                os.makedirs(graph_dir, exist_ok=True)
+
+                x_coords = []
+                y_coords = []
+
+                for index,similarity in clip_cache['similarity_debug'][clip_name]:
+                    x_coords.append(index)
+                    y_coords.append(similarity)
+
+                plt.figure(figsize=(10, 4))
+                # Create scatter plot
+                plt.scatter(x_coords, y_coords)
+
+
+                ylimit = max(0.01, np.median(y_coords))
+                # Set the y limits
+                plt.ylim(0, ylimit)
+
+                # Adding titles and labels
+                plt.title('Scatter Plot for Similarity')
+                plt.xlabel('Value')
+                plt.ylabel('Sublist Index')
+                plt.savefig(
+                    f'{graph_dir}/{suffix}.png')
+                plt.close()
+
+        if self.collect_stats:
+            return all_peak_times, total_time, clip_cache["stats"]
+        return all_peak_times, total_time
+
+    def iter_detections(self, audio_stream: AudioStream | MemmapAudioSource, start_seconds=None, end_seconds=None):
+        """
+        Find clips in audio like find_clip_in_audio, yielding the detections of each chunk as soon as it is verified.
+
+        Nothing is accumulated across chunks, only the previous chunk is kept for the sliding window,
+        so memory stays bounded for audio of any length, and the caller can stop early by not iterating further.
+
+        Yields:
+            tuple: (clip_name, peak_time, score), peak_time in seconds from the beginning of the audio,
+                in order of time within a chunk. score is the normalized correlation at the peak,
+                from 0.25 to 1, higher is a closer match, or the share of the energy at the tone frequency
+                for clips found with track_tones.
+        """
+        clip_cache = self._new_clip_cache()
+        start_sample, end_sample = self._get_sample_range(start_seconds, end_seconds)
+        chunks = self._get_chunks(audio_stream, clip_cache, start_sample, end_sample)
+        chunk_state = self._new_chunk_state(0, None, clip_cache, time_offset=start_sample / self.target_sample_rate)
+
+        for chunk in chunks:
+            peak_times, peak_scores = self._process_next_chunk(chunk_state, chunk)
+            yield from self._get_chunk_detections(peak_times, peak_scores)
+            if chunk_state["done"]:
+                break
+
+        yield from self._get_chunk_detections(*self._finish_chunks(chunk_state))
+
+    # start and end sample of the part to search, end_sample None is until the end of the audio
+    def _get_sample_range(self, start_seconds, end_seconds):
+        if start_seconds is not None and start_seconds < 0:
+            raise ValueError(f"start_seconds {start_seconds} needs to be at least 0")
+        if end_seconds is not None and end_seconds <= (start_seconds or 0):
+            raise ValueError(f"end_seconds {end_seconds} needs to be greater than start_seconds {start_seconds}")
+        start_sample = round((start_seconds or 0) * self.target_sample_rate)
+        end_sample = None if end_seconds is None else round(end_seconds * self.target_sample_rate)
+        return start_sample, end_sample
+
+    # validates the audio and returns the chunks to process between start_sample and end_sample
+    def _get_chunks(self, audio_stream, clip_cache, start_sample=0, end_sample=None):
         if audio_stream.sample_rate != self.target_sample_rate:
             raise ValueError(f"full_streaming_audio_clip {audio_stream.name} needs to be {self.target_sample_rate} sample rate")
 
         seconds_per_chunk = self.seconds_per_chunk
 
+        if isinstance(audio_stream, MemmapAudioSource):
+            # only a view, the audio outside of it is never read
+            audio = audio_stream.memmap()[start_sample:end_sample]
+            num_chunks = math.ceil(len(audio) / (seconds_per_chunk * self.target_sample_rate))
+            return self._read_pcm_chunks(audio, 0, num_chunks, clip_cache["stats"])
+
         # 2 bytes per channel on every sample for 16 bits (int16)
         # times two because it is (int16, mono)
         chunk_size = (seconds_per_chunk * self.target_sample_rate) * 2
+        # the stream already starts at start_sample
+        max_bytes = None if end_sample is None else (end_sample - start_sample) * 2
+        return self._read_chunks(audio_stream.audio_stream, chunk_size, clip_cache["stats"], max_bytes=max_bytes)
+
+    # (clip_name, peak_time, score) of one chunk sorted by time
+    @staticmethod
+    def _get_chunk_detections(peak_times, peak_scores):
+        detections = [(clip_name, peak_time, score) for clip_name, clip_peak_times in peak_times.items()
+                      for peak_time, score in zip(clip_peak_times, peak_scores[clip_name])]
+        detections.sort(key=lambda detection: detection[1])
+        return detections
+
+    def _new_clip_cache(self):
+        return {
+            "similarity_debug": defaultdict(list),
+            # None unless collect_stats, so that timing stages is a no-op
+            "stats": DetectionStats() if self.collect_stats else None,
+        }
+
+    def find_clip_in_pcm_file(self, pcm_path, jobs=None, start_seconds=None, end_seconds=None):
+        """
+        Find clips in an already decoded raw pcm file with multiple processes.
+
+        The file needs to be 16 bit mono pcm at target_sample_rate, like the output of
+        write_16bit_pcm_file. It is memory mapped and split into segments of whole chunks,
+        each chunk belongs to exactly one segment and gets the previous chunk for the sliding window,
+        so the results are the same as find_clip_in_audio on the same audio. With max_matches_per_clip,
+        segments that haven't started are cancelled once the ones before them have the first matches of every clip.
+
+        Parameters:
+            pcm_path (str): Path of the raw pcm file.
+            jobs (int): Number of worker processes, defaults to the number of cpus.
+            start_seconds (float): Only search from here, peak times are still from the beginning of the file.
+            end_seconds (float): Only search until here, defaults to the end of the file.
+
+        Returns:
+            tuple: peak times for each clip name and the total seconds processed, same as find_clip_in_audio,
+                with DetectionStats added up from all segments as the third item if collect_stats is set.
+        """
+        samples_per_chunk = self.seconds_per_chunk * self.target_sample_rate
+        start_sample, end_sample = self._get_sample_range(start_seconds, end_seconds)
+        # 2 bytes per sample for int16 mono
+        file_samples = os.path.getsize(pcm_path) // 2
+        if end_sample is None or end_sample > file_samples:
+            end_sample = file_samples
+        num_samples = max(0, end_sample - start_sample)
+        num_chunks = math.ceil(num_samples / samples_per_chunk)
+        max_chunks = self._get_max_chunks()
+        if max_chunks is not None:
+            # the rest is never mapped or split into segments
+            num_chunks = min(num_chunks, max_chunks)
+
+        if jobs is None:
+            jobs = os.cpu_count()
+
+        if jobs <= 1 or num_chunks <= 1:
+            clip_cache = self._new_clip_cache()
+            all_peak_times, total_time = self._find_clip_in_pcm_segment(pcm_path, 0, num_chunks, clip_cache,
+                                                                        start_sample, end_sample)
+            if self.collect_stats:
+                return all_peak_times, total_time, clip_cache["stats"]
+            return all_peak_times, total_time
+
+        # more segments than workers so that a slow segment doesn't hold up the others
+        segment_count = min(num_chunks, jobs * 4)
+        boundaries = [round(num_chunks * segment / segment_count) for segment in range(segment_count + 1)]
+
+        all_peak_times = {audio_clip.name: [] for audio_clip in self.audio_clips}
+        total_time = 0.0
+        stats = DetectionStats() if self.collect_stats else None
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_segment_worker, initargs=(self,)) as executor:
+            futures = [executor.submit(_find_clip_in_pcm_segment_in_worker, pcm_path, segment_start, segment_end,
+                                       start_sample, end_sample)
+                       for segment_start, segment_end in zip(boundaries[:-1], boundaries[1:])]
+            # merged in segment order, so peak times are in the same order as sequential mode
+            for future in futures:
+                peak_times, segment_time, segment_stats = future.result()
+                for clip_name, clip_peak_times in peak_times.items():
+                    all_peak_times[clip_name].extend(clip_peak_times)
+                total_time += segment_time
+                if stats is not None:
+                    stats.merge(segment_stats)
+                if self.max_matches_per_clip is not None and all(
+                        len(clip_peak_times) >= self.max_matches_per_clip
+                        for clip_peak_times in all_peak_times.values()):
+                    # the segments so far have the first matches of every clip, the ones that haven't started
+                    # are cancelled, only the ones already running are finished
+                    executor.shutdown(cancel_futures=True)
+                    break
+
+        if self.max_matches_per_clip is not None:
+            # every segment keeps its own first matches, only the first ones of the whole file are kept
+            for clip_name in all_peak_times:
+                del all_peak_times[clip_name][self.max_matches_per_clip:]
+
+        if self.collect_stats:
+            return all_peak_times, total_time, stats
+        return all_peak_times, total_time
+
+    # start_chunk and end_chunk are chunk indexes from start_sample, end_chunk is exclusive
+    def _find_clip_in_pcm_segment(self, pcm_path, start_chunk, end_chunk, clip_cache, start_sample=0,
+                                  end_sample=None):
+        if start_chunk >= end_chunk:
+            return {audio_clip.name: [] for audio_clip in self.audio_clips}, 0.0
+
+        samples_per_chunk = self.seconds_per_chunk * self.target_sample_rate
+        audio = np.memmap(pcm_path, dtype="<i2", mode="r")[start_sample:end_sample]
+
+        previous_chunk = None
+        if start_chunk > 0:
+            previous_chunk = convert_audio_arr_to_float(
+                audio[(start_chunk - 1) * samples_per_chunk:start_chunk * samples_per_chunk])
+
+        chunks = self._read_pcm_chunks(audio, start_chunk, end_chunk, clip_cache["stats"])
+
+        # a tone across the end of the segment is found by the next one
+        return self._find_clip_in_chunks(chunks, start_index=start_chunk, previous_chunk=previous_chunk,
+                                         clip_cache=clip_cache, time_offset=start_sample / self.target_sample_rate,
+                                         end_of_audio=end_chunk * samples_per_chunk >= len(audio))
+
+    # audio: int16 memory map, chunks are converted from views of it into the same float buffer,
+    # so every chunk is only valid until the next one is read
+    def _read_pcm_chunks(self, audio, start_chunk, end_chunk, stats):
+        samples_per_chunk = self.seconds_per_chunk * self.target_sample_rate
+        float_buffer = np.empty(samples_per_chunk, dtype=np.float32)
+        for index in range(start_chunk, end_chunk):
+            # reading from the memory map happens during the conversion
+            with time_stage(stats, "convert"):
+                chunk = convert_audio_arr_to_float_into(
+                    audio[index * samples_per_chunk:(index + 1) * samples_per_chunk], float_buffer)
+            yield chunk
+
+    # stats: time waiting for the stream is counted as read, which includes decoding by ffmpeg
+    # max_bytes: stop reading after it, None reads until the end of the stream
+    def _read_chunks(self, stdout, chunk_size, stats=None, max_bytes=None):
+        while True:
+            if max_bytes is not None:
+                if max_bytes <= 0:
+                    break
+                chunk_size = min(chunk_size, max_bytes)
+                max_bytes -= chunk_size
+            with time_stage(stats, "read"):
+                in_bytes = stdout.read(chunk_size)
+            if not in_bytes:
+                break
+            with time_stage(stats, "convert"):
+                # Convert bytes to numpy array
+                chunk = np.frombuffer(in_bytes, dtype="int16")
+                # convert to float, don't output float from the previous step otherwise will be very loud
+                chunk = convert_audio_arr_to_float(chunk)
+            yield chunk
+
+    async def detect_stream(self, reader, executor=None):
+        """
+        Find clips in a live stream with asyncio, yielding each detection as soon as its chunk is verified.
+
+        The stream needs to be raw 16 bit mono pcm at target_sample_rate, e.g. from ffmpeg_get_16bit_pcm_async.
+        Reading waits on the event loop and the correlation and verification run in executor,
+        so one event loop can monitor many streams. Each stream keeps its own state, so one detector
+        can be shared by all of them.
+
+        Parameters:
+            reader: asyncio.StreamReader, or an asyncio subprocess whose stdout is read.
+            executor (concurrent.futures.Executor): Executor for the processing, defaults to the loop's
+                default thread pool. Needs to be a thread pool because the state stays in this process.
+
+        Yields:
+            tuple: (clip_name, peak_time, score) like iter_detections, peak_time in seconds from the beginning
+                of the stream.
+        """
+        import asyncio
+
+        if isinstance(reader, asyncio.subprocess.Process):
+            reader = reader.stdout
+
+        loop = asyncio.get_running_loop()
+
+        # 2 bytes per sample for int16 mono
+        chunk_size = self.seconds_per_chunk * self.target_sample_rate * 2
+
+        clip_cache = self._new_clip_cache()
+        # preparing the clips the first time is also too slow for the event loop
+        await loop.run_in_executor(executor, self._prepare_clips)
+        chunk_state = self._new_chunk_state(0, None, clip_cache)
+
+        while True:
+            try:
+                in_bytes = await reader.readexactly(chunk_size)
+            except asyncio.IncompleteReadError as e:
+                # end of stream, process what is left as the last chunk,
+                # without a sample split by the end of the stream
+                in_bytes = e.partial[:len(e.partial) - len(e.partial) % 2]
+            if not in_bytes:
+                break
+
+            peak_times, peak_scores = await loop.run_in_executor(executor, self._process_stream_bytes,
+                                                                 chunk_state, in_bytes)
 
-        # Initialize parameters
+            for detection in self._get_chunk_detections(peak_times, peak_scores):
+                yield detection
+
+            if len(in_bytes) < chunk_size or chunk_state["done"]:
+                break
 
-        previous_chunk = None  # Buffer to maintain continuity between chunks
+        for detection in self._get_chunk_detections(*self._finish_chunks(chunk_state)):
+            yield detection
 
+    def _process_stream_bytes(self, chunk_state, in_bytes):
+        chunk = convert_audio_arr_to_float(np.frombuffer(in_bytes, dtype="int16"))
+        return self._process_next_chunk(chunk_state, chunk)
+
+    # start_index: index of the first chunk from the beginning of the audio
+    # previous_chunk: chunk before the first one, only used for the sliding window, None if it is the beginning
+    # time_offset: seconds added to the peak times, for chunks that don't start at the beginning of the audio
+    # end_of_audio: the last chunk is the end of the audio, False for segments followed by another one
+    def _find_clip_in_chunks(self, chunks, start_index, previous_chunk, clip_cache, time_offset=0.0,
+                             end_of_audio=True):
         all_peak_times = {audio_clip.name: [] for audio_clip in self.audio_clips}
 
-        #print("all_peak_times",all_peak_times,file=sys.stderr)
-        #exit(1)
+        chunk_state = self._new_chunk_state(start_index, previous_chunk, clip_cache, time_offset)
 
+        # Process audio in chunks
+        for chunk in chunks:
+            peak_times, _ = self._process_next_chunk(chunk_state, chunk)
 
-        full_audio_name = audio_stream.name
-        stdout = audio_stream.audio_stream
+            for clip_name, clip_peak_times in peak_times.items():
+                all_peak_times[clip_name].extend(clip_peak_times)
 
-        i = 0
+            # stop reading, so that the rest of the audio is not decoded either
+            if chunk_state["done"]:
+                break
 
-        clip_datas={}
-        clip_cache={
-            "downsampled_correlation_clips":{},
-            "is_pure_tone_pattern":{},
-            "similarity_debug":defaultdict(list),
-        }
+        if end_of_audio:
+            peak_times, _ = self._finish_chunks(chunk_state)
+            for clip_name, clip_peak_times in peak_times.items():
+                all_peak_times[clip_name].extend(clip_peak_times)
 
-        #clips_already = set()
+        return all_peak_times, chunk_state["total_time"]
 
-        for audio_clip in self.audio_clips:
-            # # Load the audio clip
-            # clip = load_audio_file(clip_path, sr=self.target_sample_rate)
-            # # convert to float
-            # clip = convert_audio_arr_to_float(clip)
+    # state carried from one chunk to the next, so that chunks can also be pushed one at a time
+    def _new_chunk_state(self, start_index, previous_chunk, clip_cache, time_offset=0.0):
+        seconds_per_chunk = self.seconds_per_chunk
 
-            clip = audio_clip.audio
+        clip_datas, clip_groups = self._prepare_clips()
 
-            #clip_name, _ = os.path.splitext(os.path.basename(clip_path))
+        # holds the previous chunk plus the current one, enough for the longest sliding window
+        # and for the last chunk that is filled up from the previous chunk
+        # no clip groups if all of the clips are tracked as tones
+        max_sliding_window = max((clip_group["sliding_window"] for clip_group in clip_groups), default=0)
+        section_buffer = AudioSectionBuffer((seconds_per_chunk + max_sliding_window) * self.target_sample_rate,
+                                            dtype=self.dtype)
 
-            # if clip_name in clips_already:
-            #     raise ValueError(f"clip {clip_name} needs to be unique")
-            #
-            # clips_already.add(clip_name)
+        if previous_chunk is not None:
+            section_buffer.append(previous_chunk)
+
+        tone_tracker = None
+        tone_clips = [(clip_name, clip_data["clip"]) for clip_name, clip_data in clip_datas.items()
+                      if self._is_tracked_tone(clip_data)]
+        if tone_clips:
+            start_sample = start_index * seconds_per_chunk * self.target_sample_rate
+            if previous_chunk is not None:
+                start_sample -= len(previous_chunk)
+            tone_tracker = ToneTracker(tone_clips, self.target_sample_rate, start_sample=start_sample)
+            if previous_chunk is not None:
+                # for a tone across the previous chunk, tones that end in it were found with it already
+                tone_tracker.process(previous_chunk, report=False)
+
+        return {"clip_datas":clip_datas,
+                "clip_groups":clip_groups,
+                "clip_cache":clip_cache,
+                "section_buffer":section_buffer,
+                "tone_tracker":tone_tracker,
+                "index":start_index,
+                "time_offset":time_offset,
+                "total_time":0.0,
+                # matches kept so far for max_matches_per_clip
+                "match_counts":{audio_clip.name: 0 for audio_clip in self.audio_clips},
+                # no more chunks need to be read because of max_matches_per_clip or max_seconds
+                "done":False,
+                }
+
+    # number of chunks from the beginning that can have matches starting within max_seconds,
+    # one sliding window more so that a match across max_seconds is complete, None if there is no limit
+    def _get_max_chunks(self):
+        if self.max_seconds is None:
+            return None
+        clip_datas, _ = self._prepare_clips()
+        max_sliding_window = max(clip_data["sliding_window"] for clip_data in clip_datas.values())
+        return math.ceil((self.max_seconds + max_sliding_window) / self.seconds_per_chunk)
+
+    # drops matches beyond max_matches_per_clip and max_seconds, and sets done when no more chunks are needed
+    def _limit_matches(self, chunk_state, peak_times, peak_scores):
+        if self.max_matches_per_clip is None and self.max_seconds is None:
+            return peak_times, peak_scores
+
+        match_counts = chunk_state["match_counts"]
+        for clip_name in peak_times:
+            matches = list(zip(peak_times[clip_name], peak_scores[clip_name]))
+            if self.max_seconds is not None:
+                matches = [match for match in matches if match[0] < self.max_seconds]
+            if self.max_matches_per_clip is not None:
+                matches = matches[:self.max_matches_per_clip - match_counts[clip_name]]
+            match_counts[clip_name] += len(matches)
+            peak_times[clip_name] = [peak_time for peak_time, _ in matches]
+            peak_scores[clip_name] = [score for _, score in matches]
+
+        if self.max_matches_per_clip is not None and all(
+                count >= self.max_matches_per_clip for count in match_counts.values()):
+            chunk_state["done"] = True
+        max_chunks = self._get_max_chunks()
+        if max_chunks is not None and chunk_state["index"] >= max_chunks:
+            chunk_state["done"] = True
+
+        return peak_times, peak_scores
+
+    # returns peak times and scores of the chunk for each clip name, chunk is not used after returning
+    def _process_next_chunk(self, chunk_state, chunk):
+        clip_cache = chunk_state["clip_cache"]
+        section_buffer = chunk_state["section_buffer"]
+
+        chunk_state["total_time"] += len(chunk) / self.target_sample_rate
+
+        stats = clip_cache["stats"]
+        if stats is not None:
+            # 2 bytes per sample for int16 mono
+            stats.bytes_processed += len(chunk) * 2
+            stats.chunks_processed += 1
+
+        section_buffer.append(chunk)
+
+        peak_times, peak_scores = self._process_chunk(chunk=chunk,
+                                                      sr=self.target_sample_rate,
+                                                      section_buffer=section_buffer,
+                                                      index=chunk_state["index"],
+                                                      clip_groups=chunk_state["clip_groups"],
+                                                      clip_datas=chunk_state["clip_datas"],
+                                                      clip_cache=clip_cache,
+                                                      )
+
+        tone_tracker = chunk_state["tone_tracker"]
+        if tone_tracker is not None:
+            with time_stage(stats, "track_tones"):
+                tone_peak_times, tone_peak_scores = tone_tracker.process(chunk, stats=stats)
+            peak_times.update(tone_peak_times)
+            peak_scores.update(tone_peak_scores)
+
+        chunk_state["index"] += 1
+
+        return self._finish_peaks(chunk_state, peak_times, peak_scores)
+
+    # peak times and scores of tones still going on at the end of the audio,
+    # nothing if reading stopped early because of the limits
+    def _finish_chunks(self, chunk_state):
+        tone_tracker = chunk_state["tone_tracker"]
+        if tone_tracker is None or chunk_state["done"]:
+            return {}, {}
+        stats = chunk_state["clip_cache"]["stats"]
+        with time_stage(stats, "track_tones"):
+            peak_times, peak_scores = tone_tracker.flush(stats=stats)
+        return self._finish_peaks(chunk_state, peak_times, peak_scores)
+
+    # applies the limits and time_offset to the peaks found
+    def _finish_peaks(self, chunk_state, peak_times, peak_scores):
+        peak_times, peak_scores = self._limit_matches(chunk_state, peak_times, peak_scores)
+
+        time_offset = chunk_state["time_offset"]
+        if time_offset:
+            peak_times = {clip_name: [peak_time + time_offset for peak_time in clip_peak_times]
+                          for clip_name, clip_peak_times in peak_times.items()}
+
+        return peak_times, peak_scores
+
+    # normalized clips, their autocorrelation and spectra only depend on the clips,
+    # prepare them once and reuse them for every audio stream
+    def _prepare_clips(self):
+        if self._prepared_clips is not None:
+            return self._prepared_clips
+
+        clip_datas={}
+        #clips_already = set()
 
+        for audio_clip in self.audio_clips:
             clip_name = audio_clip.name
 
-            clip_seconds = len(clip) / self.target_sample_rate
+            clip_seconds = len(audio_clip.audio) / self.target_sample_rate
 
             sliding_window = self._get_chunking_timing_info(clip_name,clip_seconds)
 
-            if self.normalize:
-                # max_loudness = np.max(np.abs(clip))
-                # clip = clip / max_loudness
-                sr = self.target_sample_rate
-                #clip_second = clip_length / sr
-
-                # normalize loudness
-                if clip_seconds < 0.5:
-                    meter = pyln.Meter(sr, block_size=clip_seconds)
-                else:
-                    meter = pyln.Meter(sr)  # create BS.1770 meter
-                loudness = meter.integrated_loudness(clip)
+            artifacts = self._get_clip_artifacts(audio_clip)
 
-                # loudness normalize audio to -16 dB LUFS
-                clip = pyln.normalize.loudness(clip, loudness, -16.0)
-
-            correlation_clip,absolute_max = self._get_clip_correlation(clip)
+            # prepared in double precision, only what is correlated with the audio sections is converted
+            clip = artifacts["clip"].astype(self.dtype, copy=False)
+            correlation_clip = artifacts["correlation_clip"]
+            # 0-d arrays when loaded from the cache
+            absolute_max = artifacts["correlation_clip_absolute_max"][()]
+            is_pure_tone_pattern = bool(artifacts["is_pure_tone_pattern"])
+            downsampled_correlation_clip = artifacts.get("downsampled_correlation_clip")
 
             if self.debug_mode:
+                import matplotlib.pyplot as plt
                 print(f"clip_length {clip_name}", len(clip),file=sys.stderr)
                 print(f"clip_length {clip_name} seconds", len(clip)/self.target_sample_rate,file=sys.stderr)
                 print("correlation_clip_length", len(correlation_clip),file=sys.stderr)
@@ -166,84 +650,91 @@ class AudioPatternDetector:
                     f'{graph_dir}/{clip_name}.png')
                 plt.close()
 
+            # pure tones have too few spectral peaks to be found with the index
+            is_fingerprinted = False
+            if self.fingerprint_index is not None and not is_pure_tone_pattern:
+                is_fingerprinted = self.fingerprint_index.is_indexed(audio_clip)
+                if clip_name in self.fingerprint_index and not is_fingerprinted:
+                    logger.warning(f"clip {clip_name} changed since it was added to the fingerprint index or has "
+                                   f"too few hashes, correlating it with every section")
+
             clip_datas[clip_name] = {"clip":clip,
+                                     # for the normalized cross-correlation
+                                     "clip_energy":float(np.dot(artifacts["clip"], artifacts["clip"])),
                                      "clip_name":clip_name,
                                      "sliding_window":sliding_window,
                                      "correlation_clip":correlation_clip,
                                      "correlation_clip_absolute_max":absolute_max,
-                                     #"downsampled_correlation_clip":downsampled_correlation_clip,
+                                     "is_pure_tone_pattern":is_pure_tone_pattern,
+                                     "downsampled_correlation_clip":downsampled_correlation_clip,
+                                     "is_fingerprinted":is_fingerprinted,
                                      }
 
-        total_time = 0.0
+        clip_groups = self._get_clip_groups(clip_datas)
 
-        # Process audio in chunks
-        while True:
-            in_bytes = stdout.read(chunk_size)
-            if not in_bytes:
-                break
-            # Convert bytes to numpy array
-            chunk = np.frombuffer(in_bytes, dtype="int16")
-            # convert to float, don't output float from the previous step otherwise will be very loud
-            chunk = convert_audio_arr_to_float(chunk)
-
-            total_time += len(chunk) / self.target_sample_rate
-
-            for audio_clip in self.audio_clips:
-                clip_data = clip_datas[audio_clip.name]
-
-
-                peak_times = self._process_chunk(chunk=chunk,
-                                                 sr=self.target_sample_rate,
-                                                 previous_chunk=previous_chunk,
-                                                 index=i,
-                                                 clip_data=clip_data,
-                                                 clip_cache=clip_cache,
-                                                 )
+        self._prepared_clips = (clip_datas, clip_groups)
+        return self._prepared_clips
 
-                all_peak_times[audio_clip.name].extend(peak_times)
+    # everything about a clip that doesn't depend on its name or the chunk size,
+    # loaded from clip_artifact_cache if it was prepared before with the same settings
+    def _get_clip_artifacts(self, audio_clip):
+        cache = self.clip_artifact_cache
+        if cache is not None:
+            key = cache.get_key("clip", audio_clip.audio, audio_clip.sample_rate, self.normalize,
+                                self.beep_target_num_sample_after_resample)
+            artifacts = cache.get(key, required=("clip", "correlation_clip", "correlation_clip_absolute_max",
+                                                 "is_pure_tone_pattern"))
+            if artifacts is not None and (not bool(artifacts["is_pure_tone_pattern"])
+                                          or "downsampled_correlation_clip" in artifacts):
+                return artifacts
 
-            # Update previous_chunk to current chunk
-            previous_chunk = chunk
-            i = i + 1
-
-        if self.debug_mode:
-
-            suffix = full_audio_name
-
-            for audio_clip in self.audio_clips:
-                #clip_name, _ = os.path.splitext(os.path.basename(clip_path))
-                clip_name = audio_clip.name
-
-                # similarity debug
-                graph_dir = f"./tmp/graph/mean_squared_error_similarity/{clip_name}"
-                os.makedirs(graph_dir, exist_ok=True)
-
-                x_coords = []
-                y_coords = []
-
-                for index,similarity in clip_cache['similarity_debug'][clip_name]:
-                    x_coords.append(index)
-                    y_coords.append(similarity)
-
-                plt.figure(figsize=(10, 4))
-                # Create scatter plot
-                plt.scatter(x_coords, y_coords)
-
-
-                ylimit = max(0.01, np.median(y_coords))
-                # Set the y limits
-                plt.ylim(0, ylimit)
-
-                # Adding titles and labels
-                plt.title('Scatter Plot for Similarity')
-                plt.xlabel('Value')
-                plt.ylabel('Sublist Index')
-                plt.savefig(
-                    f'{graph_dir}/{suffix}.png')
-                plt.close()
+        clip = audio_clip.audio
 
+        if self.normalize:
+            # max_loudness = np.max(np.abs(clip))
+            # clip = clip / max_loudness
+            sr = self.target_sample_rate
+            clip_seconds = len(clip) / sr
+
+            # normalize loudness
+            if clip_seconds < 0.5:
+                meter = pyln.Meter(sr, block_size=clip_seconds)
+            else:
+                meter = pyln.Meter(sr)  # create BS.1770 meter
+            loudness = meter.integrated_loudness(clip)
 
-        return all_peak_times, total_time
+            # loudness normalize audio to -16 dB LUFS
+            clip = pyln.normalize.loudness(clip, loudness, -16.0)
+
+        correlation_clip,absolute_max = self._get_clip_correlation(clip)
+
+        is_pure_tone_pattern = is_pure_tone(clip, self.target_sample_rate)
+
+        artifacts = {"clip":clip,
+                     "correlation_clip":correlation_clip,
+                     "correlation_clip_absolute_max":np.asarray(absolute_max),
+                     "is_pure_tone_pattern":np.asarray(is_pure_tone_pattern),
+                     }
+        if is_pure_tone_pattern:
+            artifacts["downsampled_correlation_clip"] = downsample_preserve_maxima(correlation_clip, self.beep_target_num_sample_after_resample)
+
+        if cache is not None:
+            cache.put(key, artifacts)
+
+        return artifacts
+
+    # spectrum of the normalized clip for the fft size of its clip group
+    def _get_clip_spectrum(self, clip, fft_size):
+        cache = self.clip_artifact_cache
+        if cache is None:
+            return get_clip_spectrum(clip, fft_size, self.dtype)
+        # the key has the dtype of the clip, so float32 and float64 spectra are cached separately
+        key = cache.get_key("spectrum", clip, fft_size)
+        artifacts = cache.get(key, required=("clip_spectrum",))
+        if artifacts is None:
+            artifacts = {"clip_spectrum": get_clip_spectrum(clip, fft_size, self.dtype)}
+            cache.put(key, artifacts)
+        return artifacts["clip_spectrum"]
 
     def _get_chunking_timing_info(self, clip_name, clip_seconds):
         seconds_per_chunk = self.seconds_per_chunk
@@ -266,6 +757,69 @@ class AudioPatternDetector:
 
         return sliding_window
 
+    def _is_tracked_tone(self, clip_data):
+        return self.track_tones and clip_data["is_pure_tone_pattern"]
+
+    # clips with the same sliding window share the same audio section,
+    # so the section only needs to be transformed once for all of them,
+    # pure tone clips found with ToneTracker are left out
+    def _get_clip_groups(self, clip_datas):
+        clip_names_by_sliding_window = defaultdict(list)
+        for clip_name, clip_data in clip_datas.items():
+            if self._is_tracked_tone(clip_data):
+                continue
+            clip_names_by_sliding_window[clip_data["sliding_window"]].append(clip_name)
+
+        clip_groups = []
+        for sliding_window, clip_names in clip_names_by_sliding_window.items():
+            clips = [clip_datas[clip_name]["clip"] for clip_name in clip_names]
+            clip_lengths = [len(clip) for clip in clips]
+            # longest audio section is the sliding window from previous chunk plus a full chunk,
+            # transform the clips once with a fft size that fits it and reuse them for every chunk
+            max_section_length = (self.seconds_per_chunk + sliding_window) * self.target_sample_rate
+            fft_size = get_fft_size(max_section_length, max(clip_lengths))
+            clip_group = {"sliding_window":sliding_window,
+                          "clip_names":clip_names,
+                          "clip_lengths":clip_lengths,
+                          "clip_spectra":np.stack([self._get_clip_spectrum(clip, fft_size) for clip in clips]),
+                          "fft_size":fft_size,
+                          "coarse_clip_names":[],
+                          "fingerprint_clip_names":[clip_name for clip_name in clip_names
+                                                    if clip_datas[clip_name]["is_fingerprinted"]],
+                          }
+            if self.cascade is not None:
+                clip_group.update(self._get_coarse_clip_group(clip_datas, clip_names, max_section_length))
+            clip_groups.append(clip_group)
+        return clip_groups
+
+    # decimated clips of the group for the first stage of the cascade search
+    def _get_coarse_clip_group(self, clip_datas, clip_names, max_section_length):
+        factor = self.cascade.decimation
+        coarse_clip_names = []
+        coarse_clips = []
+        for clip_name in clip_names:
+            clip_data = clip_datas[clip_name]
+            # tones above the decimated nyquist frequency are lost, and very short clips
+            # don't have enough decimated samples to tell them apart from anything else,
+            # clips in the fingerprint index have their candidates already
+            if (clip_data["is_pure_tone_pattern"] or len(clip_data["clip"]) // factor < 64
+                    or clip_data["is_fingerprinted"]):
+                continue
+            coarse_clip_names.append(clip_name)
+            coarse_clips.append(decimate(clip_data["clip"], factor))
+        if len(coarse_clips) == 0:
+            return {}
+        coarse_clip_lengths = [len(coarse_clip) for coarse_clip in coarse_clips]
+        coarse_fft_size = get_fft_size(max_section_length // factor, max(coarse_clip_lengths))
+        return {"coarse_clip_names":coarse_clip_names,
+                "coarse_clip_lengths":coarse_clip_lengths,
+                "coarse_clip_spectra":np.stack([self._get_clip_spectrum(coarse_clip, coarse_fft_size)
+                                                for coarse_clip in coarse_clips]),
+                # highest absolute autocorrelation is at zero lag
+                "coarse_clip_absolute_maxes":[np.dot(coarse_clip, coarse_clip) for coarse_clip in coarse_clips],
+                "coarse_fft_size":coarse_fft_size,
+                }
+
     def _get_clip_correlation(self, clip):
         # Cross-correlate and normalize correlation
         correlation_clip = correlate(clip, clip, mode='full', method='fft')
@@ -278,29 +832,35 @@ class AudioPatternDetector:
         return correlation_clip,absolute_max
 
 
-    # sliding_window: for previous_chunk in seconds from end
+    # section_buffer: holds the end of the previous chunk followed by the current chunk
     # index: for debugging by saving a file for audio_section
     # seconds_per_chunk: default seconds_per_chunk
-    def _process_chunk(self, chunk, clip_data, clip_cache, sr, previous_chunk, index):
-        clip, clip_name, sliding_window = itemgetter("clip","clip_name","sliding_window")(clip_data)
+    def _process_chunk(self, chunk, clip_groups, clip_datas, clip_cache, sr, section_buffer, index):
+        if len(clip_groups) == 0:
+            # all of the clips are tracked as tones, nothing to correlate
+            return {}, {}
         seconds_per_chunk = self.seconds_per_chunk
-        clip_seconds = len(clip) / sr
         chunk_seconds = len(chunk) / sr
-        # Concatenate previous chunk for continuity in processing
-        if previous_chunk is not None:
+        # the audio section with the longest sliding window is normalized once,
+        # clip groups with shorter sliding windows use views from the end of it
+        max_sliding_window = max(clip_group["sliding_window"] for clip_group in clip_groups)
+        # take the section from the buffer for continuity in processing
+        is_sliding = False
+        if section_buffer.num_samples > len(chunk):
             if chunk_seconds < seconds_per_chunk:  # too small
                 # no need for sliding window since it is the last piece
                 subtract_seconds = -(chunk_seconds - seconds_per_chunk)
-                audio_section_temp = np.concatenate((previous_chunk, chunk))[(-seconds_per_chunk * sr):]
-                audio_section = np.concatenate((audio_section_temp, np.array([])))
+                audio_section = section_buffer.latest(seconds_per_chunk * sr)
             else:
-                subtract_seconds = sliding_window
-                audio_section = np.concatenate((previous_chunk[int(-sliding_window * sr):], chunk, np.array([])))
+                is_sliding = True
+                subtract_seconds = max_sliding_window
+                audio_section = section_buffer.latest(len(chunk) + int(max_sliding_window * sr))
         else:
             subtract_seconds = 0
-            audio_section = np.concatenate((chunk, np.array([])))
+            audio_section = section_buffer.latest(len(chunk))
 
-        if self.normalize:
+        # the normalized cross-correlation doesn't depend on the loudness of the section
+        if self.normalize and not self.normalized_correlation:
             #max_loudness = np.max(np.abs(audio_section))
             #audio_section = audio_section / max_loudness
             audio_section_seconds = len(audio_section) / sr
@@ -312,10 +872,13 @@ class AudioPatternDetector:
             else:
                 meter = pyln.Meter(sr)  # create BS.1770 meter
 
-            loudness = meter.integrated_loudness(audio_section)
+            with time_stage(clip_cache["stats"], "loudness"):
+                loudness = meter.integrated_loudness(audio_section)
 
-            # loudness normalize audio to -16 dB LUFS
-            audio_section = pyln.normalize.loudness(audio_section, loudness, -16.0)
+                # loudness normalize audio to -16 dB LUFS, same as pyln.normalize.loudness
+                # but into a reused buffer
+                gain = np.power(10.0, (-16.0 - loudness) / 20.0)
+                audio_section = section_buffer.scale(audio_section, gain)
 
             # keep for debugging
             # if self.debug_mode:
@@ -331,29 +894,194 @@ class AudioPatternDetector:
         #         f"./tmp/audio/section_{clip_name}_{index}_{seconds_to_time(seconds=index * seconds_per_chunk, include_decimals=False)}.wav",
         #         audio_section, sr)
 
-        # samples_skip_end does not skip results from being included yet
-        peak_times = self._correlation_method(clip_data, audio_section=audio_section, sr=sr, index=index,
-                                              clip_cache=clip_cache,
-                                              )
-
-        # subtract sliding window seconds from peak times
-        peak_times = [peak_time - subtract_seconds for peak_time in peak_times]
-
-        # move timestamp to be before the clip
-        if len(peak_times):
-            peak_times_from_beginning = [time + (index * seconds_per_chunk) for time in peak_times]
-            peak_times_from_beginning_new = []
-            for time in peak_times_from_beginning:
-                new_time = time - clip_seconds
-                if new_time >= 0:
-                    peak_times_from_beginning_new.append(new_time)
-                else:
-                    peak_times_from_beginning_new.append(0)
-            peak_times_final = peak_times_from_beginning_new
+        # the section is hashed once for the clips in the fingerprint index of every group
+        fingerprint_clip_names = [clip_name for clip_group in clip_groups
+                                  for clip_name in clip_group["fingerprint_clip_names"]]
+        clip_starts = {}
+        if fingerprint_clip_names:
+            with time_stage(clip_cache["stats"], "fingerprint"):
+                clip_starts = self.fingerprint_index.lookup(audio_section, fingerprint_clip_names)
+
+        peak_times_by_clip = {}
+        peak_scores_by_clip = {}
+
+        for clip_group in clip_groups:
+            sliding_window = clip_group["sliding_window"]
+            if is_sliding:
+                # view without copying, starts sliding_window seconds before the chunk
+                group_start = int((max_sliding_window - sliding_window) * sr)
+                group_audio_section = audio_section[group_start:]
+                group_subtract_seconds = sliding_window
+            else:
+                group_start = 0
+                group_audio_section = audio_section
+                group_subtract_seconds = subtract_seconds
+            group_clip_starts = {clip_name: clip_starts[clip_name] - group_start
+                                 for clip_name in clip_group["fingerprint_clip_names"]}
+
+            group_peak_times, group_peak_scores = self._process_clip_group(audio_section=group_audio_section,
+                                                                           subtract_seconds=group_subtract_seconds,
+                                                                           clip_group=clip_group,
+                                                                           clip_datas=clip_datas,
+                                                                           clip_cache=clip_cache,
+                                                                           sr=sr,
+                                                                           index=index,
+                                                                           clip_starts=group_clip_starts)
+            peak_times_by_clip.update(group_peak_times)
+            peak_scores_by_clip.update(group_peak_scores)
+
+        return peak_times_by_clip, peak_scores_by_clip
+
+    # subtract_seconds: seconds of audio_section before the current chunk
+    # clip_starts: candidate starts in audio_section from the fingerprint index for the clips in it
+    def _process_clip_group(self, audio_section, subtract_seconds, clip_group, clip_datas, clip_cache, sr, index,
+                            clip_starts=None):
+        clip_names, clip_lengths, clip_spectra, fft_size = (
+            itemgetter("clip_names","clip_lengths","clip_spectra","fft_size")(clip_group))
+        seconds_per_chunk = self.seconds_per_chunk
+
+        search_ranges = [None] * len(clip_names)
+        if clip_starts:
+            for i, clip_name in enumerate(clip_names):
+                if clip_name in clip_starts:
+                    search_ranges[i] = self._get_fingerprint_ranges(clip_starts[clip_name], clip_lengths[i],
+                                                                    len(audio_section))
+        if clip_group["coarse_clip_names"]:
+            self._get_coarse_ranges(audio_section, clip_group, clip_cache, sr, search_ranges)
+
+        if any(ranges is not None for ranges in search_ranges):
+            correlations = self._correlate_search_ranges(audio_section, clip_group, clip_datas, clip_cache,
+                                                         search_ranges)
         else:
-            peak_times_final = []
+            # one forward fft of the audio section for all clips in the group
+            with time_stage(clip_cache["stats"], "correlate"):
+                correlations = correlate_with_clip_spectra(audio_section, clip_spectra, clip_lengths, fft_size)
+
+        energy_sums = None
+        if self.normalized_correlation:
+            with time_stage(clip_cache["stats"], "energy"):
+                energy_sums = get_energy_sums(audio_section)
+
+        peak_times_by_clip = {}
+        peak_scores_by_clip = {}
+
+        for clip_name, clip_length, correlation, clip_search_ranges in zip(clip_names, clip_lengths, correlations,
+                                                                           search_ranges):
+            clip_seconds = clip_length / sr
+
+            if correlation is None:
+                # no candidates in the section, nothing was correlated
+                peak_times_by_clip[clip_name] = []
+                peak_scores_by_clip[clip_name] = []
+                continue
 
-        return peak_times_final
+            # samples_skip_end does not skip results from being included yet
+            peak_times, peak_scores = self._correlation_method(clip_datas[clip_name], correlation=correlation,
+                                                               audio_section=audio_section, sr=sr, index=index,
+                                                               clip_cache=clip_cache,
+                                                               search_ranges=clip_search_ranges,
+                                                               energy_sums=energy_sums,
+                                                               )
+
+            # subtract sliding window seconds from peak times
+            peak_times = [peak_time - subtract_seconds for peak_time in peak_times]
+
+            # move timestamp to be before the clip
+            if len(peak_times):
+                peak_times_from_beginning = [time + (index * seconds_per_chunk) for time in peak_times]
+                peak_times_from_beginning_new = []
+                for time in peak_times_from_beginning:
+                    new_time = time - clip_seconds
+                    if new_time >= 0:
+                        peak_times_from_beginning_new.append(new_time)
+                    else:
+                        peak_times_from_beginning_new.append(0)
+                peak_times_final = peak_times_from_beginning_new
+            else:
+                peak_times_final = []
+
+            peak_times_by_clip[clip_name] = peak_times_final
+            peak_scores_by_clip[clip_name] = peak_scores
+
+        return peak_times_by_clip, peak_scores_by_clip
+
+    # ranges of the correlation around the clip starts found by the fingerprint index,
+    # None to correlate the whole section when there are too many of them
+    def _get_fingerprint_ranges(self, clip_starts, clip_length, section_length):
+        correlation_length = section_length + clip_length - 1
+        # full mode index of the clip starting at a sample is the clip ending there
+        ranges = merge_ranges([(max(0, start + clip_length - 1 - OFFSET_TOLERANCE),
+                                min(correlation_length, start + clip_length + OFFSET_TOLERANCE))
+                               for start in clip_starts])
+        if get_ranges_length(extend_ranges(ranges, clip_length, correlation_length)) > (
+                self.fingerprint_index.max_coverage * correlation_length):
+            return None
+        return ranges
+
+    # sets the ranges where the peaks can be for the clips of the cascade search, from the correlation
+    # of the decimated section, clips keep None when their candidates cover too much of the section
+    def _get_coarse_ranges(self, audio_section, clip_group, clip_cache, sr, search_ranges):
+        cascade = self.cascade
+        factor = cascade.decimation
+        clip_names, clip_lengths = itemgetter("clip_names","clip_lengths")(clip_group)
+        # the decimated peak is off by up to a block on each side
+        margin = max(2 * factor, round(cascade.margin_seconds * sr))
+
+        with time_stage(clip_cache["stats"], "coarse_correlate"):
+            coarse_section = decimate(audio_section, factor)
+            coarse_energy_sums = get_energy_sums(coarse_section) if self.normalized_correlation else None
+            coarse_correlations = correlate_with_clip_spectra(coarse_section, clip_group["coarse_clip_spectra"],
+                                                              clip_group["coarse_clip_lengths"],
+                                                              clip_group["coarse_fft_size"])
+            for clip_name, coarse_clip_length, coarse_absolute_max, coarse_correlation in zip(
+                    clip_group["coarse_clip_names"], clip_group["coarse_clip_lengths"],
+                    clip_group["coarse_clip_absolute_maxes"], coarse_correlations):
+                # normalized the same way as the full rate correlation so that the threshold is comparable
+                if self.normalized_correlation:
+                    # highest autocorrelation is the energy of the clip, the section is not loudness normalized
+                    coarse_correlation = get_normalized_correlation(coarse_correlation, coarse_energy_sums,
+                                                                    coarse_absolute_max,
+                                                                    coarse_clip_length * MIN_SAMPLE_ENERGY)
+                else:
+                    coarse_correlation = np.abs(coarse_correlation)
+                    coarse_correlation /= max(coarse_absolute_max, np.max(coarse_correlation))
+                # no minimum distance, when copies of the clip overlap the highest decimated peak can be
+                # the other copy, the full rate find_peaks keeps them a clip length apart
+                coarse_peaks, _ = find_peaks(coarse_correlation, height=cascade.threshold)
+                i = clip_names.index(clip_name)
+                clip_length = clip_lengths[i]
+                correlation_length = len(audio_section) + clip_length - 1
+                ranges = get_candidate_ranges(coarse_peaks, factor, coarse_clip_length, clip_length, margin,
+                                              correlation_length)
+                # otherwise there are too many candidates, correlating around each of them is slower
+                # than the whole section
+                if get_ranges_length(extend_ranges(ranges, clip_length, correlation_length)) <= (
+                        cascade.max_coverage * correlation_length):
+                    search_ranges[i] = ranges
+
+    # correlation of each clip in the group, only computed within its search ranges unless they are None,
+    # and None for clips without any
+    def _correlate_search_ranges(self, audio_section, clip_group, clip_datas, clip_cache, search_ranges):
+        clip_names, clip_lengths, clip_spectra, fft_size = (
+            itemgetter("clip_names","clip_lengths","clip_spectra","fft_size")(clip_group))
+
+        correlations = [None] * len(clip_names)
+        with time_stage(clip_cache["stats"], "correlate"):
+            full_indexes = [i for i, ranges in enumerate(search_ranges) if ranges is None]
+            if full_indexes:
+                full_correlations = correlate_with_clip_spectra(audio_section, clip_spectra[full_indexes],
+                                                                [clip_lengths[i] for i in full_indexes], fft_size)
+                for i, correlation in zip(full_indexes, full_correlations):
+                    correlations[i] = correlation
+            for i, ranges in enumerate(search_ranges):
+                if ranges:
+                    clip_length = clip_lengths[i]
+                    # slices for verification go up to a clip length on each side of the peak
+                    ranges_with_slices = extend_ranges(ranges, clip_length, len(audio_section) + clip_length - 1)
+                    correlations[i] = correlate_in_ranges(audio_section, clip_datas[clip_names[i]]["clip"],
+                                                          ranges_with_slices)
+
+        return correlations
 
     # def _get_max_distance(self, downsampled_correlation_clip, downsampled_correlation_slice,):
     #     distances = np.abs(downsampled_correlation_clip-downsampled_correlation_slice)
@@ -365,19 +1093,22 @@ class AudioPatternDetector:
 
     # won't work well for very short clips like single beep
     # because it is more likely to have false positives or miss good ones
-    def _correlation_method(self, clip_data, clip_cache, audio_section, sr, index):
-        clip, clip_name, sliding_window, correlation_clip, correlation_clip_absolute_max= (
-            itemgetter("clip","clip_name","sliding_window","correlation_clip","correlation_clip_absolute_max")(clip_data))
-
-        if clip_cache["is_pure_tone_pattern"].get(clip_name) is None:
-            clip_cache["is_pure_tone_pattern"][clip_name] = is_pure_tone(clip, sr)
+    # correlation: full cross-correlation of audio_section and the clip before normalization
+    # search_ranges: only look for peaks within these ranges of correlation, for the cascade search
+    #   where correlation is only computed around them
+    # energy_sums: get_energy_sums of audio_section to find peaks with the normalized cross-correlation
+    def _correlation_method(self, clip_data, clip_cache, correlation, audio_section, sr, index, search_ranges=None,
+                            energy_sums=None):
+        clip, clip_name, sliding_window, correlation_clip, correlation_clip_absolute_max, is_pure_tone_pattern = (
+            itemgetter("clip","clip_name","sliding_window","correlation_clip","correlation_clip_absolute_max",
+                       "is_pure_tone_pattern")(clip_data))
 
         seconds_per_chunk = self.seconds_per_chunk
 
-        is_pure_tone_pattern = clip_cache["is_pure_tone_pattern"][clip_name]
-
         debug_mode = self.debug_mode
 
+        stats = clip_cache["stats"]
+
         clip_length = len(clip)
         clip_length_seconds = clip_length / sr
 
@@ -392,17 +1123,30 @@ class AudioPatternDetector:
         #audio = np.concatenate((audio_section, zeroes))
         # samples_skip_end = zeroes_second_pad * sr + clip_length
 
-        # Cross-correlate and normalize correlation
-        correlation = correlate(audio_section, clip, mode='full', method='fft')
-        # abs
-        correlation = np.abs(correlation)
-        absolute_max = np.max(correlation)
-        max_choose = max(correlation_clip_absolute_max,absolute_max)
-        correlation /= max_choose
+        # normalize correlation
+        # abs, into a zero bordered buffer so that slices around the peaks don't need padding
+        correlation_buffer, correlation_abs = get_zero_bordered_array(len(correlation), len(correlation_clip),
+                                                                      dtype=correlation.dtype)
+        correlation = np.abs(correlation, out=correlation_abs)
+        if energy_sums is not None:
+            # peaks and scores from the normalized cross-correlation, slices for verification are taken
+            # from correlation and normalized on their own
+            with time_stage(stats, "energy"):
+                peak_correlation = get_normalized_correlation(correlation, energy_sums, clip_data["clip_energy"],
+                                                              clip_length * MIN_SAMPLE_ENERGY)
+        else:
+            # with search_ranges correlation is zero outside of them, so this is the largest value within them,
+            # scores are higher than in the full search when the section correlates more with the clip elsewhere,
+            # the full max would need the full correlation that the ranges are there to avoid
+            absolute_max = np.max(correlation)
+            max_choose = max(correlation_clip_absolute_max,absolute_max)
+            correlation /= max_choose
+            peak_correlation = correlation
 
         section_ts = seconds_to_time(seconds=index * seconds_per_chunk, include_decimals=False)
 
         if debug_mode:
+            import matplotlib.pyplot as plt
             print(f"---",file=sys.stderr)
             print(f"section_ts: {section_ts}, index {index}",file=sys.stderr)
             graph_dir = f"./tmp/graph/cross_correlation/{clip_name}"
@@ -410,7 +1154,7 @@ class AudioPatternDetector:
 
             #Optional: plot the correlation graph to visualize
             plt.figure(figsize=(10, 4))
-            plt.plot(correlation)
+            plt.plot(peak_correlation)
             plt.title('Cross-correlation between the audio clip and full track before slicing')
             plt.xlabel('Lag')
             plt.ylabel('Correlation coefficient')
@@ -424,7 +1168,11 @@ class AudioPatternDetector:
         # the selected ones are going to be checked for similarity
         # before adding to final peaks
         height_min = 0.25
-        peaks, _ = find_peaks(correlation, height=height_min, distance=distance)
+        with time_stage(stats, "find_peaks"):
+            peaks, _ = find_peaks(peak_correlation, height=height_min, distance=distance)
+            if search_ranges is not None:
+                # outside of them the correlation is zero, the edges of the computed parts are not real peaks
+                peaks = peaks[is_in_ranges(peaks, search_ranges)]
 
         peaks_final = []
 
@@ -434,6 +1182,8 @@ class AudioPatternDetector:
         seconds = []
         #distances = []
 
+        candidate_peaks = []
+
         for peak in peaks:
 
             # make sure it is not out of bounds at the beginning and end after slicing
@@ -451,25 +1201,34 @@ class AudioPatternDetector:
                 logger.warning(f"{section_ts} {clip_name} peak {peak} before is {before} < -5, skipping")
                 continue
 
-            # slice with the center on the peak
-            correlation_slice = slicing_with_zero_padding(correlation, len(correlation_clip), peak)
-            correlation_slice = correlation_slice/np.max(correlation_slice)
+            candidate_peaks.append(peak)
+
+        if stats is not None:
+            stats.add_candidates(clip_name, len(peaks))
+            stats.add_failed(clip_name, "out_of_bounds", len(peaks) - len(candidate_peaks))
 
-            if len(correlation_slice) != len(correlation_clip):
-                raise ValueError(f"correlation_slice length {len(correlation_slice)} not equal to correlation_clip length {len(correlation_clip)}")
+        if len(candidate_peaks) > 0:
+            # slices with the center on the peaks, one row per peak
+            correlation_windows = get_windows_with_zero_padding(correlation_buffer, len(correlation_clip))
+            correlation_slices = correlation_windows[candidate_peaks]
+            correlation_slices /= np.max(correlation_slices, axis=1, keepdims=True)
 
             if is_pure_tone_pattern:
-                self._get_peak_times_beep_v3(correlation_clip=correlation_clip,
-                                          correlation_slice=correlation_slice,
-                                          seconds=seconds,
-                                          peak=peak,
-                                          clip_name=clip_name,
-                                          index=index,
-                                          section_ts=section_ts,
-                                          similarities=similarities,
-                                          peaks_final=peaks_final,
-                                          clip_cache=clip_cache,
-                                          area_props=area_props)
+                with time_stage(stats, "verify_beep"):
+                    # downsample all candidate slices of the chunk at once
+                    correlation_slices = downsample_preserve_maxima_batch(correlation_slices,
+                                                                          self.beep_target_num_sample_after_resample)
+                    self._get_peak_times_beep_v3(correlation_clip=clip_data["downsampled_correlation_clip"],
+                                              correlation_slices=correlation_slices,
+                                              seconds=seconds,
+                                              peaks=candidate_peaks,
+                                              clip_name=clip_name,
+                                              index=index,
+                                              section_ts=section_ts,
+                                              similarities=similarities,
+                                              peaks_final=peaks_final,
+                                              clip_cache=clip_cache,
+                                              area_props=area_props)
                 # self._get_peak_times_beep_v2(
                 #                                  audio=audio[peak - len(clip):peak + len(clip)],
                 #                                  peak=peak,
@@ -480,25 +1239,30 @@ class AudioPatternDetector:
                 #                                  index=index,
                 #                                  section_ts=section_ts,)
             else:
-                self._get_peak_times_normal(correlation_clip=correlation_clip,
-                                                correlation_slice=correlation_slice,
-                                                seconds=seconds,
-                                                peak=peak,
-                                                clip_name=clip_name,
-                                                index=index,
-                                                section_ts=section_ts,
-                                                similarities=similarities,
-                                                peaks_final=peaks_final,
-                                                area_props=area_props,
-                                                clip_cache=clip_cache)
-
-            if debug_mode:
+                with time_stage(stats, "verify_normal"):
+                    self._get_peak_times_normal(correlation_clip=correlation_clip,
+                                                    correlation_slices=correlation_slices,
+                                                    seconds=seconds,
+                                                    peaks=candidate_peaks,
+                                                    clip_name=clip_name,
+                                                    index=index,
+                                                    section_ts=section_ts,
+                                                    similarities=similarities,
+                                                    peaks_final=peaks_final,
+                                                    area_props=area_props,
+                                                    clip_cache=clip_cache)
+
+        if debug_mode:
+            import soundfile as sf
+            for peak in candidate_peaks:
                 audio_test_dir = f"./tmp/audio_section/{clip_name}"
                 os.makedirs(audio_test_dir, exist_ok=True)
                 sf.write(f"{audio_test_dir}/{clip_name}_{index}_{section_ts}_{peak}.wav", audio_section[peak - len(clip):peak + len(clip)],
                          self.target_sample_rate)
 
         if debug_mode and len(peaks) > 0:
+            import json
+            from audio_pattern_detector.numpy_encoder import NumpyEncoder
             peak_dir = f"./tmp/debug/cross_correlation_{clip_name}"
             os.makedirs(peak_dir, exist_ok=True)
 
@@ -512,10 +1276,13 @@ class AudioPatternDetector:
 
         # convert peaks to seconds
         peak_times = [peak / sr for peak in peaks_final]
+        # normalized correlation height of the accepted peaks
+        peak_scores = [float(peak_correlation[peak]) for peak in peaks_final]
 
-        return peak_times
+        return peak_times, peak_scores
 
-    def _get_peak_times_normal(self, correlation_clip, correlation_slice, seconds, peak, clip_name, index,
+    # verifies all candidate peaks of a chunk at once, correlation_slices has one row per peak
+    def _get_peak_times_normal(self, correlation_clip, correlation_slices, seconds, peaks, clip_name, index,
                              section_ts, similarities, peaks_final, clip_cache, area_props):
 
         debug_mode = self.debug_mode
@@ -527,16 +1294,12 @@ class AudioPatternDetector:
         left_bound = 4
         right_bound = 6
 
-        partition_size = len(correlation_clip) // partition_count
+        stats = clip_cache["stats"]
 
-        similarity_partitions = []
-        for i in range(partition_count):
-            similarity_partitions.append(
-                mean_squared_error(correlation_clip[i * partition_size:(i + 1) * partition_size],
-                                   correlation_slice[i * partition_size:(i + 1) * partition_size]))
+        similarity_partitions = partitioned_mean_squared_error(correlation_clip, correlation_slices, partition_count)
 
-        similarity_middle = np.mean(similarity_partitions[left_bound:right_bound])
-        similarity_whole = np.mean(similarity_partitions)
+        similarity_middle = np.mean(similarity_partitions[:, left_bound:right_bound], axis=1)
+        similarity_whole = np.mean(similarity_partitions, axis=1)
         #similarity_whole = 0
         similarity_left = 0
         similarity_right = 0
@@ -544,55 +1307,20 @@ class AudioPatternDetector:
         # similarity_right = np.mean(similarity_partitions[5:10])
 
         #similarity = similarity_middle
-        similarity = min(similarity_whole,similarity_middle)
+        similarity = np.minimum(similarity_whole,similarity_middle)
 
         # similarity = min(similarity_left,similarity_middle,similarity_right)
         # similarity = similarity_whole = (similarity_left + similarity_right)/2
 
         lower_limit = round(len(correlation_clip) * left_bound / partition_count)
         upper_limit = round(len(correlation_clip) * right_bound / partition_count)
-        area_prop = area_of_overlap_ratio(correlation_clip[lower_limit:upper_limit],
-                                                                              correlation_slice[
-                                                                              lower_limit:upper_limit])
+        area_prop = area_of_overlap_ratio_batch(correlation_clip[lower_limit:upper_limit],
+                                                correlation_slices[:, lower_limit:upper_limit])
 
         # ratio of difference between overlapping area and non-overlapping area
         # needed to check when mean_squared_error is high enough
         diff_overlap_ratio = area_prop["diff_overlap_ratio"]
 
-        if debug_mode:
-            similarity_debug = clip_cache["similarity_debug"]
-            print("similarity", similarity,file=sys.stderr)
-            seconds.append(peak / sr)
-            similarity_debug[clip_name].append((index, similarity,))
-
-            correlation_slice_graph = correlation_slice
-            correlation_clip_graph = correlation_clip
-
-            graph_max = 0.1
-            if similarity <= graph_max:
-                graph_dir = f"./tmp/graph/cross_correlation_slice/{clip_name}"
-                os.makedirs(graph_dir, exist_ok=True)
-
-                # Optional: plot the correlation graph to visualize
-                plt.figure(figsize=(10, 4))
-                plt.plot(correlation_slice_graph)
-                plt.plot(correlation_clip_graph, alpha=0.7)
-                plt.title('Cross-correlation between the audio clip and full track before slicing')
-                plt.xlabel('Lag')
-                plt.ylabel('Correlation coefficient')
-                plt.savefig(
-                    f'{graph_dir}/{clip_name}_{index}_{section_ts}_{peak}.png')
-                plt.close()
-
-            area_props.append([diff_overlap_ratio, area_prop])
-
-            similarities.append((similarity, {"whole": similarity_whole,
-                                              "left": similarity_left,
-                                              "middle": similarity_middle,
-                                              "right": similarity_right,
-                                              "left_right_diff": abs(similarity_left - similarity_right),
-                                              }))
-
         similarity_threshold = 0.01
         similarity_threshold_check_area = 0.002
 
@@ -603,16 +1331,61 @@ class AudioPatternDetector:
             raise ValueError(
                 f"similarity_threshold {similarity_threshold} needs to be larger than similarity_threshold_check_area {similarity_threshold_check_area}")
 
-        if similarity > similarity_threshold:
-            if debug_mode:
-                print(f"failed verification for {section_ts} due to similarity {similarity} > {similarity_threshold}",file=sys.stderr)
+        failed_similarity = similarity > similarity_threshold
         # if similarity is between similarity_threshold and similarity_threshold_check_area, check shape ratio
-        elif similarity > similarity_threshold_check_area and diff_overlap_ratio > diff_overlap_ratio_threshold:
-            if debug_mode:
-                print(
-                    f"failed verification for {section_ts} due to diff_overlap_ratio {diff_overlap_ratio} > {diff_overlap_ratio_threshold}",file=sys.stderr)
-        else:  # if similarity is less than similarity_threshold_check_area, no need to check area ratio
-            peaks_final.append(peak)
+        failed_area = (~failed_similarity & (similarity > similarity_threshold_check_area)
+                       & (diff_overlap_ratio > diff_overlap_ratio_threshold))
+        # if similarity is less than similarity_threshold_check_area, no need to check area ratio
+        accepted = ~failed_similarity & ~failed_area
+
+        if stats is not None:
+            stats.add_passed(clip_name, np.count_nonzero(accepted))
+            stats.add_failed(clip_name, "similarity", np.count_nonzero(failed_similarity))
+            stats.add_failed(clip_name, "diff_overlap_ratio", np.count_nonzero(failed_area))
+
+        if debug_mode:
+            import matplotlib.pyplot as plt
+            for i, peak in enumerate(peaks):
+                similarity_debug = clip_cache["similarity_debug"]
+                print("similarity", similarity[i],file=sys.stderr)
+                seconds.append(peak / sr)
+                similarity_debug[clip_name].append((index, similarity[i],))
+
+                correlation_slice_graph = correlation_slices[i]
+                correlation_clip_graph = correlation_clip
+
+                graph_max = 0.1
+                if similarity[i] <= graph_max:
+                    graph_dir = f"./tmp/graph/cross_correlation_slice/{clip_name}"
+                    os.makedirs(graph_dir, exist_ok=True)
+
+                    # Optional: plot the correlation graph to visualize
+                    plt.figure(figsize=(10, 4))
+                    plt.plot(correlation_slice_graph)
+                    plt.plot(correlation_clip_graph, alpha=0.7)
+                    plt.title('Cross-correlation between the audio clip and full track before slicing')
+                    plt.xlabel('Lag')
+                    plt.ylabel('Correlation coefficient')
+                    plt.savefig(
+                        f'{graph_dir}/{clip_name}_{index}_{section_ts}_{peak}.png')
+                    plt.close()
+
+                area_props.append([diff_overlap_ratio[i], _area_prop_at(area_prop, i)])
+
+                similarities.append((similarity[i], {"whole": similarity_whole[i],
+                                                     "left": similarity_left,
+                                                     "middle": similarity_middle[i],
+                                                     "right": similarity_right,
+                                                     "left_right_diff": abs(similarity_left - similarity_right),
+                                                     }))
+
+                if failed_similarity[i]:
+                    print(f"failed verification for {section_ts} due to similarity {similarity[i]} > {similarity_threshold}",file=sys.stderr)
+                elif failed_area[i]:
+                    print(
+                        f"failed verification for {section_ts} due to diff_overlap_ratio {diff_overlap_ratio[i]} > {diff_overlap_ratio_threshold}",file=sys.stderr)
+
+        peaks_final.extend(np.asarray(peaks)[accepted])
 
     # # doesn't work well
     # def _get_peak_times_beep_v2(self,audio,peak,peaks_final,clip_cache,area_props,clip_name,index,section_ts):
@@ -698,87 +1471,110 @@ class AudioPatternDetector:
     #             peaks_final.append(peak)
 
     # matching pattern should overlap almost completely with beep pattern, unless they are too dissimilar
-    def _get_peak_times_beep_v3(self,correlation_clip,correlation_slice,seconds,peak,clip_name,index,section_ts,similarities,peaks_final,clip_cache,area_props):
+    # verifies all candidate peaks of a chunk at once, correlation_slices has one row per peak
+    def _get_peak_times_beep_v3(self,correlation_clip,correlation_slices,seconds,peaks,clip_name,index,section_ts,similarities,peaks_final,clip_cache,area_props):
 
         sr = self.target_sample_rate
         debug_mode = self.debug_mode
 
-        beep_target_num_sample_after_resample = 101
+        # correlation_clip and correlation_slices are already downsampled
 
-        downsampled_correlation_clip = clip_cache["downsampled_correlation_clips"].get(clip_name)
+        stats = clip_cache["stats"]
 
-        if downsampled_correlation_clip is None:
-            downsampled_correlation_clip = downsample_preserve_maxima(correlation_clip, beep_target_num_sample_after_resample)
-            clip_cache["downsampled_correlation_clips"][clip_name] = downsampled_correlation_clip
+        area_prop = area_of_overlap_ratio_batch(correlation_clip,correlation_slices)
 
-        downsampled_correlation_slice = downsample_preserve_maxima(correlation_slice, beep_target_num_sample_after_resample)
+        overlap_ratio = area_prop["overlapping_area"]/area_prop["area_control"]
 
-        correlation_clip = downsampled_correlation_clip
-        correlation_slice = downsampled_correlation_slice
+        similarity = np.mean((correlation_slices - correlation_clip) ** 2, axis=1)
 
-        area_prop = area_of_overlap_ratio(correlation_clip,correlation_slice)
+        similarity_whole = similarity
 
-        overlap_ratio = area_prop["overlapping_area"]/area_prop["area_control"]
+        similarity_threshold = 0.01
 
-        similarity = mean_squared_error(correlation_clip, correlation_slice)
+        similarity_threshold_check_area_upper = 0.003
 
-        similarity_whole = similarity
+        similarity_threshold_check_area = 0.002
+
+        failed_similarity = similarity > similarity_threshold
+        # if similarity is between similarity_threshold and similarity_threshold_check_area, check shape ratio
+        failed_area_upper = ~failed_similarity & (similarity > similarity_threshold_check_area_upper) & (overlap_ratio < 0.99)
+        # similar enough, lower area ratio threshold
+        failed_area = (~failed_similarity & ~failed_area_upper
+                       & (similarity > similarity_threshold_check_area) & (overlap_ratio < 0.98))
+        accepted = ~failed_similarity & ~failed_area_upper & ~failed_area
+
+        if stats is not None:
+            stats.add_passed(clip_name, np.count_nonzero(accepted))
+            stats.add_failed(clip_name, "similarity", np.count_nonzero(failed_similarity))
+            stats.add_failed(clip_name, "overlap_ratio_0.99", np.count_nonzero(failed_area_upper))
+            stats.add_failed(clip_name, "overlap_ratio_0.98", np.count_nonzero(failed_area))
 
         if debug_mode:
-            print("similarity", similarity,file=sys.stderr)
-            seconds.append(peak / sr)
-            similarity_debug = clip_cache["similarity_debug"]
-            similarity_debug[clip_name].append((index, similarity,))
+            import matplotlib.pyplot as plt
+            for i, peak in enumerate(peaks):
+                print("similarity", similarity[i],file=sys.stderr)
+                seconds.append(peak / sr)
+                similarity_debug = clip_cache["similarity_debug"]
+                similarity_debug[clip_name].append((index, similarity[i],))
+
+                correlation_slice_graph = correlation_slices[i]
+                correlation_clip_graph = correlation_clip
+
+                graph_max = 0.1
+                if similarity[i] <= graph_max:
+                    graph_dir = f"./tmp/graph/cross_correlation_slice/{clip_name}"
+                    os.makedirs(graph_dir, exist_ok=True)
+
+                    # Optional: plot the correlation graph to visualize
+                    plt.figure(figsize=(10, 4))
+                    plt.plot(correlation_slice_graph)
+                    plt.plot(correlation_clip_graph, alpha=0.7)
+                    plt.title('Cross-correlation between the audio clip and full track before slicing')
+                    plt.xlabel('Lag')
+                    plt.ylabel('Correlation coefficient')
+                    plt.savefig(
+                        f'{graph_dir}/{clip_name}_{index}_{section_ts}_{peak}.png')
+                    plt.close()
+
+                similarities.append((similarity[i], {"whole": similarity_whole[i],
+                                                     "left": 0,
+                                                     "middle": 0,
+                                                     "right": 0,
+                                                     "left_right_diff": 0,
+                                                     }))
+                area_props.append([overlap_ratio[i], _area_prop_at(area_prop, i)])
+
+                if failed_similarity[i]:
+                    print(f"failed verification for {section_ts} due to similarity {similarity[i]} > {similarity_threshold}",file=sys.stderr)
+                elif failed_area_upper[i]:
+                    print(
+                        f"failed verification for {section_ts} due to similarity {similarity[i]} overlap_ratio {overlap_ratio[i]} < 0.99",file=sys.stderr)
+                elif failed_area[i]:
+                    print(
+                        f"failed verification for {section_ts} due to similarity {similarity[i]} overlap_ratio {overlap_ratio[i]} < 0.98",file=sys.stderr)
+                else:
+                    print(
+                        f"accepted {section_ts} with similarity {similarity[i]} and overlap_ratio {overlap_ratio[i]}",file=sys.stderr)
 
-            correlation_slice_graph = correlation_slice
-            correlation_clip_graph = correlation_clip
+        peaks_final.extend(np.asarray(peaks)[accepted])
 
-            graph_max = 0.1
-            if similarity <= graph_max:
-                graph_dir = f"./tmp/graph/cross_correlation_slice/{clip_name}"
-                os.makedirs(graph_dir, exist_ok=True)
 
-                # Optional: plot the correlation graph to visualize
-                plt.figure(figsize=(10, 4))
-                plt.plot(correlation_slice_graph)
-                plt.plot(correlation_clip_graph, alpha=0.7)
-                plt.title('Cross-correlation between the audio clip and full track before slicing')
-                plt.xlabel('Lag')
-                plt.ylabel('Correlation coefficient')
-                plt.savefig(
-                    f'{graph_dir}/{clip_name}_{index}_{section_ts}_{peak}.png')
-                plt.close()
+# area_of_overlap_ratio_batch result for a single candidate, for debugging
+def _area_prop_at(area_prop, i):
+    return {key: value[i] if np.ndim(value) > 0 else value for key, value in area_prop.items()}
 
-            similarities.append((similarity, {"whole": similarity_whole,
-                                              "left": 0,
-                                              "middle": 0,
-                                              "right": 0,
-                                              "left_right_diff": 0,
-                                              }))
-            area_props.append([overlap_ratio, area_prop])
 
+# one detector per worker process for find_clip_in_pcm_file, clips are prepared once per worker
+_segment_worker_detector = None
 
-        similarity_threshold = 0.01
 
-        similarity_threshold_check_area_upper = 0.003
+def _init_segment_worker(detector):
+    global _segment_worker_detector
+    _segment_worker_detector = detector
 
-        similarity_threshold_check_area = 0.002
 
-        if similarity > similarity_threshold:
-            if debug_mode:
-                print(f"failed verification for {section_ts} due to similarity {similarity} > {similarity_threshold}",file=sys.stderr)
-        # if similarity is between similarity_threshold and similarity_threshold_check_area, check shape ratio
-        elif similarity > similarity_threshold_check_area_upper and overlap_ratio < 0.99:
-            if debug_mode:
-                print(
-                    f"failed verification for {section_ts} due to similarity {similarity} overlap_ratio {overlap_ratio} < 0.99",file=sys.stderr)
-        # similar enough, lower area ratio threshold
-        elif similarity > similarity_threshold_check_area and overlap_ratio < 0.98:
-            if debug_mode:
-                print(
-                    f"failed verification for {section_ts} due to similarity {similarity} overlap_ratio {overlap_ratio} < 0.98",file=sys.stderr)
-        else:
-            if debug_mode:
-                print(
-                    f"accepted {section_ts} with similarity {similarity} and overlap_ratio {overlap_ratio}",file=sys.stderr)
-            peaks_final.append(peak)
\ No newline at end of file
+def _find_clip_in_pcm_segment_in_worker(pcm_path, start_chunk, end_chunk, start_sample, end_sample):
+    clip_cache = _segment_worker_detector._new_clip_cache()
+    peak_times, total_time = _segment_worker_detector._find_clip_in_pcm_segment(pcm_path, start_chunk, end_chunk,
+                                                                                clip_cache, start_sample, end_sample)
+    return peak_times, total_time, clip_cache["stats"]
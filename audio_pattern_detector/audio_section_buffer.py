@@ -0,0 +1,39 @@
+import numpy as np
+
+
+class AudioSectionBuffer:
+    """
+    Fixed size buffer holding the most recent samples of an audio stream.
+
+    Audio sections (end of the previous chunk plus the current chunk) are returned as views,
+    so no new array is allocated per chunk and memory stays constant regardless of input length.
+    """
+
+    def __init__(self, max_samples, dtype=np.float64):
+        self.max_samples = max_samples
+        self.buffer = np.zeros(max_samples, dtype=dtype)
+        # normalized copy of the section, the original samples are still needed for the next chunk
+        self.scaled_buffer = np.zeros(max_samples, dtype=dtype)
+        self.num_samples = 0
+
+    def append(self, chunk):
+        chunk_length = len(chunk)
+        if chunk_length > self.max_samples:
+            raise ValueError(f"chunk length {chunk_length} is larger than buffer size {self.max_samples}")
+        keep = self.max_samples - chunk_length
+        # only move the samples that are still valid, which is just the sliding window for full chunks
+        valid = min(self.num_samples, keep)
+        if valid > 0:
+            self.buffer[keep - valid:keep] = self.buffer[self.max_samples - valid:]
+        self.buffer[keep:] = chunk
+        self.num_samples = min(self.num_samples + chunk_length, self.max_samples)
+
+    def latest(self, num_samples):
+        if num_samples > self.num_samples:
+            raise ValueError(f"requested {num_samples} samples but only {self.num_samples} available")
+        return self.buffer[self.max_samples - num_samples:]
+
+    def scale(self, audio_section, gain):
+        output = self.scaled_buffer[:len(audio_section)]
+        np.multiply(audio_section, gain, out=output)
+        return output
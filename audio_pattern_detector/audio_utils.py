@@ -1,7 +1,7 @@
 import math
+import shutil
 import subprocess
-from contextlib import contextmanager
-from tabnanny import check
+from contextlib import contextmanager, asynccontextmanager
 
 import numpy as np
 from numpy._typing import DTypeLike
@@ -26,6 +26,20 @@ def slicing_with_zero_padding(array,width,middle_index):
     return np.array(array[beg:end])
 
 
+# buffer with zeros around an array of length, enough for windows of width centered on any index of it
+# returns the buffer and the view of the array inside it
+def get_zero_bordered_array(length, width, dtype=np.float64):
+    buffer = np.zeros(length + width, dtype=dtype)
+    pad_left = math.floor(width / 2)
+    return buffer, buffer[pad_left:pad_left + length]
+
+
+# row i is the window of width centered on index i of the array inside the buffer from get_zero_bordered_array,
+# same as slicing_with_zero_padding(array, width, i) without padding or copying for every index
+def get_windows_with_zero_padding(buffer, width):
+    return np.lib.stride_tricks.sliding_window_view(buffer, width)
+
+
 def convert_audio_file(file_path, sr=None):
     # Create ffmpeg process
     with ffmpeg_get_16bit_pcm(file_path, target_sample_rate=sr, ac=1) as stdout:
@@ -33,6 +47,54 @@ def convert_audio_file(file_path, sr=None):
     return np.frombuffer(data, dtype="int16")
     #return librosa.load(file_path, sr=sr, mono=True)  # mono=True ensures a single channel audio
 
+# decode to a raw 16 bit pcm file, which can be memory mapped later
+def write_16bit_pcm_file(file_path, output_path, sr=None, start_seconds=None, end_seconds=None):
+    with ffmpeg_get_16bit_pcm(file_path, target_sample_rate=sr, ac=1, start_seconds=start_seconds,
+                              end_seconds=end_seconds) as stdout:
+        with open(output_path, 'wb') as f:
+            shutil.copyfileobj(stdout, f)
+
+# byte offset and length of the samples in a 16 bit mono pcm wave file, so that they can be memory mapped,
+# raises ValueError for anything else
+def get_wav_data_range(file_path, expected_sample_rate):
+    with open(file_path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[0:4] != b'RIFF' or header[8:12] != b'WAVE':
+            raise ValueError(f"{file_path} is not a wave file")
+        fmt = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError(f"{file_path} has no data chunk")
+            chunk_id = chunk_header[0:4]
+            chunk_size = int.from_bytes(chunk_header[4:8], 'little')
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size)
+                if chunk_size % 2:
+                    f.seek(1, 1)
+            elif chunk_id == b'data':
+                if fmt is None or len(fmt) < 16:
+                    raise ValueError(f"{file_path} has no fmt chunk before the data chunk")
+                format_tag = int.from_bytes(fmt[0:2], 'little')
+                channels = int.from_bytes(fmt[2:4], 'little')
+                sample_rate = int.from_bytes(fmt[4:8], 'little')
+                bits_per_sample = int.from_bytes(fmt[14:16], 'little')
+                # 1 is pcm, 0xFFFE is extensible which ffmpeg also uses for pcm
+                if format_tag not in (1, 0xFFFE) or bits_per_sample != 16:
+                    raise ValueError(f"The file is not 16-bit pcm. Format: {format_tag}, bits: {bits_per_sample}")
+                if channels != 1:
+                    raise ValueError(f"The file is not mono. Channels: {channels}")
+                if sample_rate != expected_sample_rate:
+                    raise ValueError(f"The sample rate is not {expected_sample_rate} Hz. Sample rate: {sample_rate}")
+                offset = f.tell()
+                file_size = f.seek(0, 2)
+                # streamed wave files can have a placeholder size, only use what is actually there
+                length = min(chunk_size, file_size - offset)
+                return offset, length - length % 2
+            else:
+                # chunks are padded to even sizes
+                f.seek(chunk_size + chunk_size % 2, 1)
+
 # load wave file with soundfile into float32
 def load_wave_file(file_path, expected_sample_rate):
     import soundfile as sf
@@ -91,54 +153,66 @@ def convert_audio_arr_to_float(audio):
     return buf_to_float(audio, n_bytes=2, dtype='float32')
 
 
+# same as convert_audio_arr_to_float for int16 audio, but into out so that a buffer can be reused for every chunk,
+# returns the part of out that was filled
+def convert_audio_arr_to_float_into(audio, out):
+    output = out[:len(audio)]
+    # cast first and scale in place, exactly the same values as buf_to_float
+    output[:] = audio
+    output *= 1.0 / float(1 << 15)
+    return output
+
+
 def downsample_preserve_maxima(curve, num_samples):
-    n_points = len(curve)
-    step_size = n_points / num_samples
-    compressed_curve = []
+    return downsample_preserve_maxima_batch(np.asarray(curve)[np.newaxis, :], num_samples)[0]
 
-    for i in range(num_samples):
-        start_index = int(i * step_size)
-        end_index = int((i + 1) * step_size)
 
-        if start_index >= n_points:
-            break
+# same as downsample_preserve_maxima for every row of curves, which all have the same length
+def downsample_preserve_maxima_batch(curves, num_samples):
+    curves = np.asarray(curves)
+    n_points = curves.shape[1]
+    step_size = n_points / num_samples
 
-        window = curve[start_index:end_index]
-        if len(window) == 0:
-            continue
+    # window i is curve[int(i * step_size):int((i + 1) * step_size)], so the windows are next to each other
+    boundaries = (np.arange(num_samples + 1) * step_size).astype(int)
+    starts = boundaries[:-1]
+    ends = np.minimum(boundaries[1:], n_points)
+    # skip empty windows
+    non_empty = ends > starts
+    starts = starts[non_empty]
 
-        local_max_index = np.argmax(window)
-        compressed_curve.append(window[local_max_index])
+    if len(starts) == 0:
+        raise ValueError(f"downsampled curve length 0 not equal to num_samples {num_samples}")
 
-        # # Find peaks within this window
-        # peaks, _ = find_peaks(window)
-        # if len(peaks) == 0:
-        #     # If no peaks, simply downsample by taking the first point in the window
-        #     compressed_curve.append(window[0])
-        # else:
-        #     # Select the local maxima point
-        #     local_max_index = peaks[np.argmax(window[peaks])]
-        #     compressed_curve.append(window[local_max_index])
+    # max of each window, the last window ends at the end of the last non empty window
+    compressed_curves = np.maximum.reduceat(curves[:, :ends[non_empty][-1]], starts, axis=1)
 
     # Adjust the length if necessary by adding the last element of the original curve
-    if len(compressed_curve) < num_samples and len(curve) > 0:
-        compressed_curve.append(curve[-1])
+    if compressed_curves.shape[1] < num_samples:
+        compressed_curves = np.concatenate((compressed_curves, curves[:, -1:]), axis=1)
 
-    if len(compressed_curve) != num_samples:
-        raise ValueError(f"downsampled curve length {len(compressed_curve)} not equal to num_samples {num_samples}")
+    if compressed_curves.shape[1] != num_samples:
+        raise ValueError(f"downsampled curve length {compressed_curves.shape[1]} not equal to num_samples {num_samples}")
 
-    return np.array(compressed_curve)
+    return compressed_curves
 
 # convert audio to 16 bit pcm with streaming output
-@contextmanager
-def ffmpeg_get_16bit_pcm(full_audio_path,target_sample_rate=None,ac=None):
+# start_seconds and end_seconds seek the input, so that ffmpeg doesn't decode the audio outside of them
+def _get_ffmpeg_16bit_pcm_command(full_audio_path,target_sample_rate=None,ac=None,start_seconds=None,end_seconds=None):
     # Construct the ffmpeg command
-    command = [
-        "ffmpeg",
+    command = ["ffmpeg"]
+
+    if start_seconds is not None:
+        command.extend(["-ss", str(start_seconds)])
+
+    if end_seconds is not None:
+        command.extend(["-to", str(end_seconds)])
+
+    command.extend([
         "-i", full_audio_path,
         "-f", "s16le",  # Output format
         "-acodec", "pcm_s16le",  # Audio codec
-    ]
+    ])
 
     if ac is not None:
         command.extend(["-ac", str(ac)])
@@ -150,6 +224,13 @@ def ffmpeg_get_16bit_pcm(full_audio_path,target_sample_rate=None,ac=None):
                 "-loglevel", "error",  # Suppress extra logs
                 "pipe:"  # Output to stdout
                 ])
+    return command
+
+
+@contextmanager
+def ffmpeg_get_16bit_pcm(full_audio_path,target_sample_rate=None,ac=None,start_seconds=None,end_seconds=None):
+    command = _get_ffmpeg_16bit_pcm_command(full_audio_path,target_sample_rate=target_sample_rate,ac=ac,
+                                            start_seconds=start_seconds,end_seconds=end_seconds)
 
     process = None
 
@@ -160,11 +241,38 @@ def ffmpeg_get_16bit_pcm(full_audio_path,target_sample_rate=None,ac=None):
             stdout=subprocess.PIPE  # Pipe stdout
         )
         yield process.stdout
-        if process.wait() != 0:
+        if process.stdout.read(1):
+            # stopped reading before the end, e.g. the detector already found what it needs,
+            # ffmpeg would otherwise block on the full pipe and decode the rest for nothing
+            process.kill()
+            process.wait()
+        elif process.wait() != 0:
             raise ValueError(f"ffmpeg command failed with return code {process.returncode}")
     finally:
         if process is not None:
             process.stdout.close()
 
 
+# same as ffmpeg_get_16bit_pcm for asyncio, yields the asyncio.StreamReader of ffmpeg's stdout,
+# full_audio_path can also be a url of a live stream
+@asynccontextmanager
+async def ffmpeg_get_16bit_pcm_async(full_audio_path,target_sample_rate=None,ac=None,start_seconds=None,
+                                     end_seconds=None):
+    import asyncio
+    command = _get_ffmpeg_16bit_pcm_command(full_audio_path,target_sample_rate=target_sample_rate,ac=ac,
+                                            start_seconds=start_seconds,end_seconds=end_seconds)
+
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE)
+    try:
+        yield process.stdout
+        # stopped reading before the end, the process is killed below instead of waiting for a live stream to end
+        if not await process.stdout.read(1) and await process.wait() != 0:
+            raise ValueError(f"ffmpeg command failed with return code {process.returncode}")
+    finally:
+        # stopped before the end, e.g. the monitoring task was cancelled or the detector found what it needs
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+
 TARGET_SAMPLE_RATE = 8000
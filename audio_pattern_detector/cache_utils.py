@@ -0,0 +1,55 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+def evict_least_recently_used(cache_dir, max_bytes, suffix, keep=None):
+    """
+    Remove the least recently used files in cache_dir until their total size fits in max_bytes.
+
+    Only files ending with suffix are counted and removed, the modification time is used as the last access time.
+    keep is a path that is never removed, like the entry that is about to be used.
+    """
+    entries = []
+    total_bytes = 0
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith(suffix):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_bytes += stat.st_size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total_bytes <= max_bytes:
+            break
+        if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+
+
+@contextmanager
+def atomic_write_path(path):
+    """
+    Temporary path in the same folder to write to, which replaces path when the block finishes.
+
+    Other processes never read a partially written file, and the temporary file is removed
+    if the block raises, including on KeyboardInterrupt.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
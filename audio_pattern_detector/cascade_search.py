@@ -0,0 +1,133 @@
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.signal import correlate
+
+
+@dataclass(frozen=True)
+class CascadeSettings:
+    """
+    Settings for the coarse to fine search of AudioPatternDetector.
+
+    The clips and audio sections are first correlated at sample_rate / decimation to find candidate regions,
+    then the full rate correlation is only computed around them and verified as usual.
+    threshold, margin_seconds and max_coverage are the recall safeguards: candidates only need a lower
+    normalized correlation than the final 0.25, the full rate search extends margin_seconds around each
+    candidate, and a clip falls back to the full correlation of the section when the candidate regions
+    cover more than max_coverage of it, which is what it would cost anyway.
+
+    Peaks are normalized by the largest correlation within the computed regions instead of the whole section,
+    so when the section correlates more with the clip outside of them, e.g. a louder copy that is not a candidate,
+    scores are higher than in the full search and a peak just under 0.25 there can pass. Verification of the
+    peaks is the same, it doesn't depend on the normalization.
+    """
+    decimation: int = 4
+    threshold: float = 0.15
+    margin_seconds: float = 0.01
+    max_coverage: float = 0.25
+
+    def __post_init__(self):
+        if self.decimation < 2:
+            raise ValueError(f"decimation {self.decimation} needs to be at least 2")
+        if not 0 < self.threshold <= 1:
+            raise ValueError(f"threshold {self.threshold} needs to be greater than 0 and at most 1")
+
+
+def decimate(audio, factor):
+    # mean of every factor samples, a cheap low pass that is good enough to find candidates,
+    # samples at the end that don't fill a block are dropped
+    audio = audio[:len(audio) // factor * factor]
+    # adding strided views is a few times faster than reshaping and taking the mean,
+    # in the precision of the audio
+    decimated = np.array(audio[0::factor], dtype=np.result_type(audio.dtype, np.float32))
+    for offset in range(1, factor):
+        decimated += audio[offset::factor]
+    decimated /= factor
+    return decimated
+
+
+def get_candidate_ranges(coarse_peaks, factor, coarse_clip_length, clip_length, margin, correlation_length):
+    """
+    Ranges of the full rate correlation that can have the peaks found in the decimated correlation.
+
+    Parameters:
+        coarse_peaks (numpy array): Peak indexes in the full mode correlation of the decimated section and clip.
+        factor (int): Decimation factor.
+        coarse_clip_length (int): Number of samples in the decimated clip.
+        clip_length (int): Number of samples in the clip.
+        margin (int): Samples to search on each side of the candidate.
+        correlation_length (int): Length of the full mode correlation at full rate.
+
+    Returns:
+        list: Sorted (start, end) index ranges without overlaps, end is exclusive.
+    """
+    ranges = []
+    for coarse_peak in coarse_peaks:
+        # same lag at full rate, full mode index 0 is the clip ending at the first sample
+        peak = (coarse_peak - (coarse_clip_length - 1)) * factor + (clip_length - 1)
+        ranges.append((max(0, peak - margin), min(correlation_length, peak + margin + 1)))
+    return merge_ranges(ranges)
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def extend_ranges(ranges, extension, length):
+    # ranges with extension more on each side within 0 and length, merged again
+    return merge_ranges([(max(0, start - extension), min(length, end + extension)) for start, end in ranges])
+
+
+def get_ranges_length(ranges):
+    return sum(end - start for start, end in ranges)
+
+
+def is_in_ranges(indexes, ranges):
+    # boolean mask of the indexes that are in one of the sorted ranges without overlaps
+    indexes = np.asarray(indexes)
+    if len(ranges) == 0:
+        return np.zeros(len(indexes), dtype=bool)
+    starts = np.array([start for start, _ in ranges])
+    ends = np.array([end for _, end in ranges])
+    range_index = np.searchsorted(starts, indexes, side='right') - 1
+    return (range_index >= 0) & (indexes < ends[np.maximum(range_index, 0)])
+
+
+def correlate_in_ranges(audio_section, clip, ranges):
+    """
+    Full mode cross-correlation of the audio section and the clip, only computed within ranges.
+
+    Values within ranges are the same as the full correlation, the rest are zero, so the result can be
+    used like the full correlation for everything that only looks inside ranges.
+
+    Parameters:
+        audio_section (numpy array): The audio section as a floating-point array.
+        clip (numpy array): The clip as a floating-point array.
+        ranges (list): Sorted (start, end) index ranges of the correlation without overlaps.
+
+    Returns:
+        numpy array: Correlation of length len(audio_section) + len(clip) - 1.
+    """
+    clip_length = len(clip)
+    correlation = np.zeros(len(audio_section) + clip_length - 1,
+                           dtype=np.result_type(audio_section.dtype, clip.dtype))
+    for start, end in ranges:
+        # index i of the full correlation is the clip ending at audio sample i,
+        # the audio before the beginning is zero like in full mode
+        audio_start = start - (clip_length - 1)
+        segment = audio_section[max(0, audio_start):end]
+        if audio_start < 0:
+            segment = np.concatenate((np.zeros(-audio_start, dtype=segment.dtype), segment))
+        if len(segment) < end - audio_start:
+            # and after the end
+            segment = np.concatenate((segment, np.zeros(end - audio_start - len(segment), dtype=segment.dtype)))
+        correlation[start:end] = correlate(segment, clip, mode='valid', method='fft')
+    return correlation
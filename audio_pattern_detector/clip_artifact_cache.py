@@ -0,0 +1,71 @@
+import hashlib
+import os
+import zipfile
+
+import numpy as np
+
+from audio_pattern_detector.cache_utils import evict_least_recently_used, atomic_write_path
+
+# change it when what is stored or how it is computed changes, so that old entries are not used
+CACHE_VERSION = 1
+
+
+class ClipArtifactCache:
+    """
+    On disk cache of prepared clip artifacts, one .npz file per entry.
+
+    Entries are keyed by a hash of the clip content and the settings used to prepare it,
+    so renamed or moved clips still hit the cache and changed clips never do.
+    Reading an entry marks it as recently used, and the least recently used entries
+    are removed when the total size is over max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(*parts):
+        digest = hashlib.sha256(f"v{CACHE_VERSION}".encode())
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                # dtype and shape too, same bytes can be different arrays
+                digest.update(f"{part.dtype.str}{part.shape}".encode())
+                digest.update(np.ascontiguousarray(part).tobytes())
+            else:
+                digest.update(repr(part).encode())
+        return digest.hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    # returns a dict of arrays, or None if it is not cached or doesn't have all of the required names
+    def get(self, key, required=()):
+        path = self._get_path(key)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, zipfile.BadZipFile):
+            # partially written or corrupted, prepare it again
+            return None
+        if any(name not in arrays for name in required):
+            # written by a version that stored less, prepare it again
+            return None
+        try:
+            # modification time is used as the last access time for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another process in between, the arrays are already loaded
+            pass
+        return arrays
+
+    def put(self, key, arrays):
+        # write to a temporary file first so that other processes never read a partial entry
+        with atomic_write_path(self._get_path(key)) as tmp_path:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **arrays)
+        evict_least_recently_used(self.cache_dir, self.max_bytes, ".npz")
+
@@ -0,0 +1,100 @@
+import glob
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from audio_pattern_detector.audio_clip import AudioClip
+
+
+def get_clip_entries_from_folder(pattern_folder):
+    """
+    All wav files in pattern_folder as (name, path) entries, named after the file name like AudioClip.from_audio_file.
+    """
+    if not os.path.isdir(pattern_folder):
+        raise ValueError(f"Pattern folder {pattern_folder} does not exist")
+    return [(Path(clip_path).stem, clip_path) for clip_path in sorted(glob.glob(f'{pattern_folder}/*.wav'))]
+
+
+def get_clip_entries_from_manifest(manifest_path):
+    """
+    Clip (name, path) entries from a json manifest.
+
+    The manifest is a list of clip paths, or objects with path and an optional name
+    when the file name is not a good clip name, e.g.
+    ["intro.wav", {"path": "../shared/beep.wav", "name": "news_beep"}]
+    Relative paths are relative to the folder of the manifest.
+    """
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, list):
+        raise ValueError(f"Manifest {manifest_path} needs to be a list of clips")
+
+    manifest_dir = os.path.dirname(manifest_path)
+    entries = []
+    for item in manifest:
+        if isinstance(item, str):
+            clip_path, name = item, None
+        elif isinstance(item, dict) and isinstance(item.get("path"), str):
+            clip_path, name = item["path"], item.get("name")
+        else:
+            raise ValueError(f"Manifest {manifest_path} has an invalid clip {item}, needs to be a path or an object with path")
+        clip_path = os.path.join(manifest_dir, clip_path)
+        entries.append((name if name is not None else Path(clip_path).stem, clip_path))
+    return entries
+
+
+def _load_clip(name, clip_path):
+    clip = AudioClip.from_audio_file(clip_path)
+    if clip.name != name:
+        clip = AudioClip(name=name, audio=clip.audio, sample_rate=clip.sample_rate)
+    return clip
+
+
+def load_clip_library(entries, jobs=None):
+    """
+    Load the clips of a library with multiple threads, to be used together in one detector.
+
+    Everything is validated before returning, so that a bad clip is found before any audio is processed.
+
+    Parameters:
+        entries (list): (name, path) for each clip, from get_clip_entries_from_folder or get_clip_entries_from_manifest.
+        jobs (int): Number of threads, defaults to ThreadPoolExecutor's default.
+
+    Returns:
+        list: AudioClip for each entry in the same order.
+
+    Raises:
+        ValueError: With every problem found, like missing files, duplicate names or wrong sample rate.
+    """
+    if len(entries) == 0:
+        raise ValueError("clip library is empty")
+
+    errors = []
+
+    names = set()
+    for name, clip_path in entries:
+        if name in names:
+            errors.append(f"clip {name} needs to be unique, {clip_path} has the same name")
+        names.add(name)
+        if not os.path.exists(clip_path):
+            errors.append(f"clip {name} file {clip_path} does not exist")
+
+    if errors:
+        raise ValueError("invalid clip library:\n" + "\n".join(errors))
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_load_clip, name, clip_path) for name, clip_path in entries]
+
+    clips = []
+    for (name, clip_path), future in zip(entries, futures):
+        try:
+            clips.append(future.result())
+        except (ValueError, RuntimeError) as e:
+            # load_wave_file raises ValueError for wrong format, soundfile raises RuntimeError for unreadable files
+            errors.append(f"clip {name} file {clip_path}: {e}")
+
+    if errors:
+        raise ValueError("invalid clip library:\n" + "\n".join(errors))
+
+    return clips
@@ -0,0 +1,116 @@
+import numpy as np
+from scipy import fft
+
+
+def get_fft_size(max_section_length, clip_length):
+    # full cross correlation needs section + clip - 1 points to avoid wrapping around,
+    # round it up to a size that scipy fft handles fast
+    return fft.next_fast_len(max_section_length + clip_length - 1, real=True)
+
+
+def get_clip_spectrum(clip, fft_size, dtype=np.float64):
+    # cross correlation is convolution with the reversed clip,
+    # so the spectrum of the reversed clip can be reused for every audio section,
+    # float32 gives a complex64 spectrum so that the correlation stays in single precision
+    clip_reversed = np.asarray(clip, dtype=dtype)[::-1]
+    return fft.rfft(clip_reversed, n=fft_size)
+
+
+def correlate_with_clip_spectrum(audio_section, clip_spectrum, clip_length, fft_size):
+    """
+    Cross-correlate an audio section with a clip from the precomputed clip spectrum.
+
+    Gives the same result as correlate(audio_section, clip, mode='full', method='fft')
+    without transforming the clip again.
+
+    Parameters:
+        audio_section (numpy array): The audio section as a floating-point array.
+        clip_spectrum (numpy array): The output of get_clip_spectrum for the clip.
+        clip_length (int): The number of samples in the clip.
+        fft_size (int): The fft size used for clip_spectrum.
+
+    Returns:
+        numpy array: The full cross-correlation of length len(audio_section) + clip_length - 1.
+    """
+    correlation_length = len(audio_section) + clip_length - 1
+    if correlation_length > fft_size:
+        raise ValueError(f"correlation length {correlation_length} is larger than fft_size {fft_size}")
+    section_spectrum = fft.rfft(audio_section, n=fft_size)
+    return fft.irfft(section_spectrum * clip_spectrum, n=fft_size)[:correlation_length]
+
+
+def get_clip_spectra(clips, fft_size, dtype=np.float64):
+    # stacked matrix with one row per clip so that all of them can be correlated in one call
+    return np.stack([get_clip_spectrum(clip, fft_size, dtype) for clip in clips])
+
+
+def correlate_with_clip_spectra(audio_section, clip_spectra, clip_lengths, fft_size):
+    """
+    Cross-correlate an audio section with multiple clips at once.
+
+    The audio section is transformed once, multiplied against every row of clip_spectra
+    and all clips are inverse transformed in a single call.
+
+    Parameters:
+        audio_section (numpy array): The audio section as a floating-point array.
+        clip_spectra (numpy array): The output of get_clip_spectra, one row per clip.
+        clip_lengths (list): The number of samples of each clip in the same order as clip_spectra.
+        fft_size (int): The fft size used for clip_spectra.
+
+    Returns:
+        list: The full cross-correlation for each clip, same as correlate_with_clip_spectrum.
+    """
+    correlation_length = len(audio_section) + max(clip_lengths) - 1
+    if correlation_length > fft_size:
+        raise ValueError(f"correlation length {correlation_length} is larger than fft_size {fft_size}")
+    section_spectrum = fft.rfft(audio_section, n=fft_size)
+    correlations = fft.irfft(clip_spectra * section_spectrum, n=fft_size, axis=-1)
+    return [correlations[i, :len(audio_section) + clip_length - 1] for i, clip_length in enumerate(clip_lengths)]
+
+
+def get_energy_sums(audio_section):
+    # running sum of squares with a leading zero, the energy of any part of the section is the difference of two
+    # entries, in double precision because the differences of large sums lose too much in float32
+    energy_sums = np.zeros(len(audio_section) + 1)
+    np.cumsum(np.square(audio_section, dtype=np.float64), out=energy_sums[1:])
+    return energy_sums
+
+
+def get_normalized_correlation(correlation, energy_sums, clip_energy, min_energy):
+    """
+    Normalized cross-correlation from the full cross-correlation of an audio section and a clip.
+
+    Each value is divided by the norm of the clip and the norm of the part of the section under the clip,
+    so it is between 0 and 1 whatever the loudness of the section, and 1 only where the section is the clip
+    at any volume.
+
+    Parameters:
+        correlation (numpy array): Full cross-correlation of length len(audio_section) + clip_length - 1.
+        energy_sums (numpy array): The output of get_energy_sums for the audio section.
+        clip_energy (float): Sum of squares of the clip.
+        min_energy (float): Parts of the section with less energy than this are silence and get 0.
+
+    Returns:
+        numpy array: Absolute normalized cross-correlation in the dtype of correlation, 0 where the clip
+            is not completely within the section.
+    """
+    section_length = len(energy_sums) - 1
+    clip_length = len(correlation) - section_length + 1
+    normalized = np.zeros(len(correlation), dtype=correlation.dtype)
+    if section_length < clip_length:
+        return normalized
+    # full mode index i is the clip ending at sample i, it is completely within the section
+    # from clip_length - 1 to section_length - 1
+    # only the sums need double precision, the rest is in place in the precision of correlation
+    # because it runs for every clip and section
+    energy = np.subtract(energy_sums[clip_length:], energy_sums[:section_length - clip_length + 1],
+                         dtype=correlation.dtype, casting='unsafe')
+    silent = energy < min_energy
+    np.maximum(energy, min_energy, out=energy)
+    energy *= clip_energy
+    np.sqrt(energy, out=energy)
+    full = normalized[clip_length - 1:section_length]
+    np.abs(correlation[clip_length - 1:section_length], out=full)
+    full /= energy
+    full[silent] = 0
+    return normalized
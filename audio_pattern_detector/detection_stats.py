@@ -0,0 +1,76 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+
+
+@dataclass
+class ClipStats:
+    candidates: int = 0
+    passed: int = 0
+    # number of candidates failing verification for each reason
+    failed: dict = field(default_factory=lambda: defaultdict(int))
+
+
+@dataclass
+class DetectionStats:
+    """
+    Cumulative wall time per stage and verification counters for one detection run.
+
+    Stages are read (waiting for the decoder output), convert, loudness, correlate, find_peaks,
+    verify_normal and verify_beep, and the ones of optional search modes: coarse_correlate for the
+    decimated correlation of the cascade search, track_tones for the tone tracker, fingerprint for the
+    lookups of the fingerprint index and energy for the normalized cross-correlation, which replaces loudness.
+    """
+    stage_seconds: dict = field(default_factory=lambda: defaultdict(float))
+    clips: dict = field(default_factory=lambda: defaultdict(ClipStats))
+    bytes_processed: int = 0
+    chunks_processed: int = 0
+
+    @contextmanager
+    def time_stage(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[stage] += time.perf_counter() - start
+
+    def add_candidates(self, clip_name, count):
+        # int to keep numpy counts json serializable
+        self.clips[clip_name].candidates += int(count)
+
+    def add_passed(self, clip_name, count):
+        self.clips[clip_name].passed += int(count)
+
+    def add_failed(self, clip_name, reason, count):
+        if count > 0:
+            self.clips[clip_name].failed[reason] += int(count)
+
+    # for adding up stats from segments processed separately
+    def merge(self, other):
+        for stage, seconds in other.stage_seconds.items():
+            self.stage_seconds[stage] += seconds
+        for clip_name, clip_stats in other.clips.items():
+            self.clips[clip_name].candidates += clip_stats.candidates
+            self.clips[clip_name].passed += clip_stats.passed
+            for reason, count in clip_stats.failed.items():
+                self.clips[clip_name].failed[reason] += int(count)
+        self.bytes_processed += other.bytes_processed
+        self.chunks_processed += other.chunks_processed
+
+    def to_dict(self):
+        return {"stage_seconds": dict(self.stage_seconds),
+                "clips": {clip_name: {"candidates": clip_stats.candidates,
+                                      "passed": clip_stats.passed,
+                                      "failed": dict(clip_stats.failed)}
+                          for clip_name, clip_stats in self.clips.items()},
+                "bytes_processed": self.bytes_processed,
+                "chunks_processed": self.chunks_processed,
+                }
+
+
+# no-op when stats are not collected
+def time_stage(stats, stage):
+    if stats is None:
+        return nullcontext()
+    return stats.time_stage(stage)
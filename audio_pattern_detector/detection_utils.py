@@ -49,6 +49,49 @@ def area_of_overlap_ratio(control, variable):
     return props
 
 
+# same as area_of_overlap_ratio for every row of variables against the same control,
+# each value in the result has one entry per row except those only depending on control
+def area_of_overlap_ratio_batch(control, variables):
+
+    if len(control) != variables.shape[1]:
+        raise ValueError("Both arrays must have the same length")
+
+    total_rect_control = len(control) * max(control)
+
+    x = np.arange(len(control))
+
+    area_control = simpson(control, x=x)
+    area_y2 = simpson(variables, x=x, axis=-1)
+
+    # To find the overlapping area, take the minimum at each point
+    min_curves = np.minimum(control, variables)
+    overlapping_area = simpson(min_curves, x=x, axis=-1)
+
+    # Calculate the sum of area of both curves where the two curves don't overlap
+    diff_area = area_control+area_y2-2*overlapping_area
+
+    props = {
+                "total_rect_control":total_rect_control,
+                "diff_area":diff_area,
+                "overlapping_area":overlapping_area,
+                "area_control":area_control,
+                "area_y2":area_y2,
+                "diff_overlap_ratio":diff_area/overlapping_area,
+                "percent_control_area":area_control/total_rect_control,
+            }
+    return props
+
+
+# mean squared error of each of the partition_count partitions of every row against control,
+# same as calling mean_squared_error on each partition, the remainder after the last partition is ignored
+def partitioned_mean_squared_error(control, variables, partition_count):
+    partition_size = len(control) // partition_count
+    partitions_end = partition_count * partition_size
+    control_partitions = control[:partitions_end].reshape(partition_count, partition_size)
+    variable_partitions = variables[:, :partitions_end].reshape(-1, partition_count, partition_size)
+    return np.mean((control_partitions - variable_partitions) ** 2, axis=-1)
+
+
 def is_pure_tone(audio_data, sample_rate):
     """
     Determine if the given audio data represents a pure tone.
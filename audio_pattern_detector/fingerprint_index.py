@@ -0,0 +1,271 @@
+import hashlib
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.ndimage import maximum_filter
+
+from audio_pattern_detector.audio_clip import AudioClip
+from audio_pattern_detector.audio_utils import TARGET_SAMPLE_RATE
+from audio_pattern_detector.cache_utils import atomic_write_path
+
+# change it when what is stored or how hashes are computed changes, so that old index files are not used
+INDEX_VERSION = 1
+
+# 64 ms frames every 32 ms at 8000 Hz
+FRAME_SIZE = 512
+HOP_SIZE = 256
+# a spectral peak is the highest magnitude within this many frames and frequency bins around it,
+# dense enough that a clip partly covered by other audio still has enough hashes left
+PEAK_NEIGHBORHOOD_FRAMES = 4
+PEAK_NEIGHBORHOOD_BINS = 9
+# peaks quieter than a sine with this amplitude are never used, so that silence has no peaks
+MIN_PEAK_AMPLITUDE = 1e-3
+# every peak is paired with the next FAN_OUT peaks within MAX_PAIR_FRAMES
+FAN_OUT = 5
+MAX_PAIR_FRAMES = 127
+# peaks move when the frames start somewhere else in the audio, so clips are hashed with the frames starting
+# at this many evenly spaced samples within a hop, and offsets are counted in hops / GRID_SHIFTS
+GRID_SHIFTS = 4
+# voted clip starts are within this many samples of the actual start
+OFFSET_TOLERANCE = 2 * HOP_SIZE
+
+WINDOW = np.hanning(FRAME_SIZE)
+MIN_PEAK_MAGNITUDE = MIN_PEAK_AMPLITUDE * np.sum(WINDOW) / 2
+
+
+def get_clip_digest(audio):
+    digest = hashlib.sha256(f"{audio.dtype.str}{audio.shape}".encode())
+    digest.update(np.ascontiguousarray(audio).tobytes())
+    return digest.hexdigest()
+
+
+def get_landmarks(audio):
+    """
+    Hashes of pairs of spectral peaks of the audio, which don't change with the position of the audio or its loudness.
+
+    Parameters:
+        audio (numpy array): Audio as a floating-point array at TARGET_SAMPLE_RATE.
+
+    Returns:
+        tuple: hashes and the frame of the first peak of each pair, as int64 arrays.
+    """
+    if len(audio) < FRAME_SIZE:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    frames = sliding_window_view(audio, FRAME_SIZE)[::HOP_SIZE]
+    spectrogram = np.abs(np.fft.rfft(frames * WINDOW, axis=1))
+    local_max = maximum_filter(spectrogram, size=(PEAK_NEIGHBORHOOD_FRAMES, PEAK_NEIGHBORHOOD_BINS), mode='constant')
+    # sorted by frame and then by bin
+    peak_frames, peak_bins = np.nonzero((spectrogram == local_max) & (spectrogram > MIN_PEAK_MAGNITUDE))
+
+    hashes = []
+    anchor_frames = []
+    for k in range(1, FAN_OUT + 1):
+        frame_deltas = peak_frames[k:] - peak_frames[:-k]
+        valid = frame_deltas <= MAX_PAIR_FRAMES
+        # 9 bits for each bin of the pair and 7 bits for the frames between them
+        hashes.append((peak_bins[:-k][valid].astype(np.int64) << 16) | (peak_bins[k:][valid] << 7)
+                      | frame_deltas[valid])
+        anchor_frames.append(peak_frames[:-k][valid])
+    return np.concatenate(hashes).astype(np.int64), np.concatenate(anchor_frames).astype(np.int64)
+
+
+class FingerprintIndex:
+    """
+    Index of the spectral peak hashes of a clip library, to find which clips can be in the audio and where
+    without correlating every clip.
+
+    Each clip and each audio section are reduced to hashes of pairs of spectral peaks, a clip in the section
+    has many of its hashes at the same time offset, while other clips only have a few scattered ones.
+    lookup returns the clip starts with at least min_votes hashes at the same offset, which are only
+    candidates that still need to be verified, AudioPatternDetector correlates them around those starts.
+    Like the cascade search, peaks there are normalized by the largest correlation around the candidates,
+    so scores can be higher than in the full search when the section correlates more with the clip elsewhere.
+
+    Clips can be added and removed at any time, and the index can be saved to and loaded from a file,
+    so a library of hundreds of clips doesn't need to be hashed again for every run.
+    """
+
+    def __init__(self, min_votes=28, max_coverage=0.25, sample_rate=TARGET_SAMPLE_RATE):
+        """
+        Parameters:
+            min_votes (int): Hashes at the same offset for a clip start to be a candidate, clips with fewer hashes
+                than this can't be found with the index.
+            max_coverage (float): AudioPatternDetector correlates the whole section instead when the candidates
+                of a clip cover more than this share of it.
+            sample_rate (int): Sample rate of the clips and the audio.
+        """
+        if min_votes < 1:
+            raise ValueError(f"min_votes {min_votes} needs to be at least 1")
+        if sample_rate != TARGET_SAMPLE_RATE:
+            raise ValueError(f"sample_rate needs to be {TARGET_SAMPLE_RATE}")
+        self.min_votes = min_votes
+        self.max_coverage = max_coverage
+        self.sample_rate = sample_rate
+        # clip name -> (digest, hashes, anchor frames in hops / GRID_SHIFTS)
+        self.clips = {}
+        # all hashes sorted for lookup, built again after clips change
+        self._table = None
+
+    @classmethod
+    def from_clips(cls, audio_clips: [AudioClip], **kwargs):
+        index = cls(**kwargs)
+        for audio_clip in audio_clips:
+            index.add_clip(audio_clip)
+        return index
+
+    def __len__(self):
+        return len(self.clips)
+
+    def __contains__(self, clip_name):
+        return clip_name in self.clips
+
+    @property
+    def clip_names(self):
+        return list(self.clips)
+
+    def add_clip(self, audio_clip: AudioClip):
+        """
+        Add the clip, or replace the clip with the same name.
+
+        Returns:
+            int: Number of hashes of the clip.
+        """
+        if audio_clip.sample_rate != self.sample_rate:
+            raise ValueError(f"clip {audio_clip.name} needs to be {self.sample_rate} sample rate")
+        hashes = []
+        anchor_frames = []
+        for shift in range(GRID_SHIFTS):
+            shift_hashes, shift_anchor_frames = get_landmarks(audio_clip.audio[shift * HOP_SIZE // GRID_SHIFTS:])
+            hashes.append(shift_hashes)
+            # in hops / GRID_SHIFTS from the beginning of the clip
+            anchor_frames.append(shift_anchor_frames * GRID_SHIFTS + shift)
+        hashes = np.concatenate(hashes)
+        self.clips[audio_clip.name] = (get_clip_digest(audio_clip.audio), hashes, np.concatenate(anchor_frames))
+        self._table = None
+        return len(hashes)
+
+    def remove_clip(self, clip_name):
+        if clip_name not in self.clips:
+            raise KeyError(f"clip {clip_name} is not in the index")
+        del self.clips[clip_name]
+        self._table = None
+
+    def is_indexed(self, audio_clip: AudioClip):
+        """
+        Whether lookup can find the clip, it needs to be added with the same audio and have at least min_votes hashes.
+        """
+        entry = self.clips.get(audio_clip.name)
+        if entry is None:
+            return False
+        digest, hashes, _ = entry
+        return digest == get_clip_digest(audio_clip.audio) and len(hashes) >= self.min_votes
+
+    def _get_table(self):
+        if self._table is None:
+            clip_names = list(self.clips)
+            hashes = [self.clips[clip_name][1] for clip_name in clip_names]
+            clip_ids = [np.full(len(clip_hashes), i, dtype=np.int64) for i, clip_hashes in enumerate(hashes)]
+            anchor_frames = [self.clips[clip_name][2] for clip_name in clip_names]
+            all_hashes = np.concatenate(hashes) if hashes else np.zeros(0, dtype=np.int64)
+            order = np.argsort(all_hashes, kind='stable')
+            self._table = (clip_names,
+                           all_hashes[order],
+                           np.concatenate(clip_ids)[order] if clip_ids else np.zeros(0, dtype=np.int64),
+                           np.concatenate(anchor_frames)[order] if anchor_frames else np.zeros(0, dtype=np.int64))
+        return self._table
+
+    def lookup(self, audio, clip_names=None):
+        """
+        Candidate starts of the clips in the audio.
+
+        Parameters:
+            audio (numpy array): Audio as a floating-point array, hashed once for all clips.
+            clip_names (list): Only look for these clips, defaults to every clip in the index.
+
+        Returns:
+            dict: Sorted sample indexes of audio where each clip can start, within OFFSET_TOLERANCE,
+                an empty array for clips without candidates. Starts can be negative for a clip that begins
+                before the audio.
+        """
+        if clip_names is None:
+            clip_names = self.clip_names
+        table_clip_names, table_hashes, table_clip_ids, table_frames = self._get_table()
+        clip_ids = {clip_name: i for i, clip_name in enumerate(table_clip_names)}
+        clip_starts = {clip_name: np.zeros(0, dtype=np.int64) for clip_name in clip_names}
+
+        hashes, frames = get_landmarks(audio)
+        # sorted queries find their place in the table a lot faster
+        order = np.argsort(hashes)
+        hashes = hashes[order]
+        frames = frames[order]
+        lows = np.searchsorted(table_hashes, hashes, side='left')
+        highs = np.searchsorted(table_hashes, hashes, side='right')
+        match_counts = highs - lows
+        if np.sum(match_counts) == 0:
+            return clip_starts
+        # every pair of an audio hash and a clip hash that are the same
+        audio_indexes = np.repeat(np.arange(len(hashes)), match_counts)
+        table_indexes = np.repeat(lows - np.cumsum(match_counts) + match_counts, match_counts) + np.arange(
+            len(audio_indexes))
+        matched_clip_ids = table_clip_ids[table_indexes]
+        offsets = frames[audio_indexes] * GRID_SHIFTS - table_frames[table_indexes]
+
+        # one key per clip and offset, with room for the neighboring offsets not to run into the next clip
+        min_offset = np.min(offsets) - 1
+        width = np.max(offsets) - min_offset + 2
+        keys, counts = np.unique(matched_clip_ids * width + (offsets - min_offset), return_counts=True)
+        # the frames of the audio are in between the shifted frames of the clip, so neighboring offsets vote together
+        votes = counts.copy()
+        for neighbor in (-1, 1):
+            positions = np.searchsorted(keys, keys + neighbor)
+            found = positions < len(keys)
+            found[found] = keys[positions[found]] == keys[found] + neighbor
+            votes[found] += counts[positions[found]]
+
+        keys = keys[votes >= self.min_votes]
+        for clip_name in clip_names:
+            clip_id = clip_ids.get(clip_name)
+            if clip_id is None:
+                continue
+            clip_keys = keys[keys // width == clip_id]
+            clip_starts[clip_name] = (clip_keys % width + min_offset) * HOP_SIZE // GRID_SHIFTS
+        return clip_starts
+
+    def save(self, path):
+        clip_names = list(self.clips)
+        arrays = {"version": np.asarray(INDEX_VERSION),
+                  "settings": np.asarray(self._get_settings()),
+                  "min_votes": np.asarray(self.min_votes),
+                  "max_coverage": np.asarray(self.max_coverage),
+                  "clip_names": np.asarray(clip_names, dtype=str),
+                  "clip_digests": np.asarray([self.clips[clip_name][0] for clip_name in clip_names], dtype=str),
+                  "hash_counts": np.asarray([len(self.clips[clip_name][1]) for clip_name in clip_names],
+                                            dtype=np.int64),
+                  "hashes": np.concatenate([self.clips[clip_name][1] for clip_name in clip_names] or
+                                           [np.zeros(0, dtype=np.int64)]),
+                  "anchor_frames": np.concatenate([self.clips[clip_name][2] for clip_name in clip_names] or
+                                                  [np.zeros(0, dtype=np.int64)]),
+                  }
+        # write to a temporary file first so that the index file is never partially written
+        with atomic_write_path(path) as tmp_path:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as npz:
+            arrays = {name: npz[name] for name in npz.files}
+        if int(arrays["version"]) != INDEX_VERSION or list(arrays["settings"]) != cls._get_settings():
+            raise ValueError(f"fingerprint index {path} was made with different settings, it needs to be built again")
+        index = cls(min_votes=int(arrays["min_votes"]), max_coverage=float(arrays["max_coverage"]))
+        boundaries = np.cumsum(arrays["hash_counts"])[:-1]
+        for clip_name, digest, hashes, anchor_frames in zip(arrays["clip_names"], arrays["clip_digests"],
+                                                            np.split(arrays["hashes"], boundaries),
+                                                            np.split(arrays["anchor_frames"], boundaries)):
+            index.clips[str(clip_name)] = (str(digest), hashes, anchor_frames)
+        return index
+
+    @staticmethod
+    def _get_settings():
+        return [TARGET_SAMPLE_RATE, FRAME_SIZE, HOP_SIZE, PEAK_NEIGHBORHOOD_FRAMES, PEAK_NEIGHBORHOOD_BINS,
+                MIN_PEAK_AMPLITUDE, FAN_OUT, MAX_PAIR_FRAMES, GRID_SHIFTS]
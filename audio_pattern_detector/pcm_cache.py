@@ -0,0 +1,50 @@
+import hashlib
+import os
+
+from audio_pattern_detector.audio_utils import write_16bit_pcm_file, TARGET_SAMPLE_RATE
+from audio_pattern_detector.cache_utils import evict_least_recently_used, atomic_write_path
+
+
+class PcmCache:
+    """
+    On disk cache of audio files decoded to raw 16 bit mono pcm at TARGET_SAMPLE_RATE.
+
+    Entries are keyed by the absolute path, modification time and size of the source file,
+    so a changed source file is decoded again. The cached files can be memory mapped with
+    AudioPatternDetector.find_clip_in_pcm_file, so scanning an archive again with new patterns
+    doesn't need ffmpeg. Using an entry marks it as recently used, and the least recently used
+    entries are removed when the total size is over max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=10 * 1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_key(self, audio_file):
+        stat = os.stat(audio_file)
+        source = f"{os.path.abspath(audio_file)}\0{stat.st_mtime_ns}\0{stat.st_size}\0{TARGET_SAMPLE_RATE}"
+        return hashlib.sha256(source.encode()).hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pcm")
+
+    def get_pcm_file(self, audio_file):
+        """
+        Path of the decoded pcm file for audio_file, decoding it with ffmpeg first if it is not cached.
+        """
+        pcm_path = self._get_path(self.get_key(audio_file))
+        try:
+            # modification time is used as the last access time for eviction
+            os.utime(pcm_path)
+            return pcm_path
+        except FileNotFoundError:
+            pass
+
+        # decode to a temporary file first so that other processes never read a partial entry,
+        # and a failed decode doesn't leave one behind
+        with atomic_write_path(pcm_path) as tmp_path:
+            write_16bit_pcm_file(audio_file, tmp_path, sr=TARGET_SAMPLE_RATE)
+
+        evict_least_recently_used(self.cache_dir, self.max_bytes, ".pcm", keep=pcm_path)
+        return pcm_path
@@ -0,0 +1,201 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 20 ms blocks every 10 ms, the hann window separates tones about 100 Hz apart
+BLOCK_SECONDS = 0.02
+HOP_SECONDS = 0.01
+# blocks quieter than this are never a tone, so that noise in silence doesn't count
+MIN_BLOCK_RMS = 1e-3
+
+
+def get_tone_frequency(clip, sample_rate):
+    # dominant frequency, same as the one is_pure_tone looks at
+    magnitude = np.abs(np.fft.rfft(clip))
+    return np.argmax(magnitude) * sample_rate / len(clip)
+
+
+class ToneTracker:
+    """
+    Finds pure tone clips like beeps in a stream in one linear pass, instead of cross-correlating them.
+
+    Every block of the stream is measured with a bank of single bin DFTs, one for the dominant frequency
+    of each clip, which gives the same value as a Goertzel filter but computed for all blocks and frequencies
+    of a chunk with one matrix product. A block is on for a clip when that frequency has at least
+    min_tone_ratio of the block energy and the block is louder than MIN_BLOCK_RMS. A run of on blocks is
+    a match when its duration is within duration_tolerance of the tone in the clip itself, and its envelope,
+    the level at the tone frequency over the run relative to its loudest block, is within max_envelope_error
+    of the clip's on average, so a tone that swells or wavers is not taken for a steady beep.
+    Like the verification of correlated clips, the overall level doesn't matter.
+
+    Chunks are pushed in order with process, state is kept in between, so a tone across chunks is found once.
+    flush reports a tone still going on at the end of the audio.
+    """
+
+    def __init__(self, tone_clips, sample_rate, start_sample=0, min_tone_ratio=0.3, duration_tolerance=0.25,
+                 max_envelope_error=0.25):
+        """
+        Parameters:
+            tone_clips (list): (clip_name, clip) of the pure tone clips.
+            sample_rate (int): Sample rate of the clips and the stream.
+            start_sample (int): Sample of the audio where the first chunk starts, for the reported times.
+            min_tone_ratio (float): Share of the block energy at the tone frequency for a block to be on.
+            duration_tolerance (float): Allowed difference of the tone duration as a ratio of the clip's.
+            max_envelope_error (float): Allowed mean absolute difference of the envelopes normalized to 1.
+        """
+        self.sample_rate = sample_rate
+        self.block_size = round(BLOCK_SECONDS * sample_rate)
+        self.hop_size = round(HOP_SECONDS * sample_rate)
+        self.min_tone_ratio = min_tone_ratio
+        self.max_envelope_error = max_envelope_error
+        self.clip_names = [clip_name for clip_name, _ in tone_clips]
+
+        window = np.hanning(self.block_size)
+        frequencies = np.array([get_tone_frequency(clip, sample_rate) for _, clip in tone_clips])
+        times = np.arange(self.block_size) / sample_rate
+        # one column per clip, windowed so that each bin only picks up its own tone
+        self.basis = window[:, np.newaxis] * np.exp(-2j * np.pi * times[:, np.newaxis] * frequencies)
+        self.window = window
+        # a pure sine at the frequency has a ratio of 1, see _get_tone_ratios
+        self.ratio_scale = 2 * np.sum(window ** 2) / np.sum(window) ** 2
+        self.min_block_energy = MIN_BLOCK_RMS ** 2 * np.sum(window ** 2)
+
+        # length in blocks, offset from the beginning of the clip and envelope of the tone in each clip
+        self.clip_tone_blocks = []
+        self.clip_tone_offsets = []
+        self.clip_envelopes = []
+        for i, (clip_name, clip) in enumerate(tone_clips):
+            # silence around it so that a tone filling the whole clip still has a start and an end
+            padding = np.zeros(self.block_size)
+            ratios, levels = self._get_tone_ratios(np.concatenate((padding, clip, padding)))
+            runs = self._get_runs(ratios[:, i])
+            if len(runs) == 0:
+                raise ValueError(f"no tone found in the pure tone clip {clip_name}")
+            start, end = max(runs, key=lambda run: run[1] - run[0])
+            self.clip_tone_blocks.append(end - start)
+            self.clip_tone_offsets.append((start * self.hop_size - self.block_size) / sample_rate)
+            self.clip_envelopes.append(levels[start:end, i] / np.max(levels[start:end, i]))
+        self.duration_tolerances = [max(2, round(tone_blocks * duration_tolerance))
+                                    for tone_blocks in self.clip_tone_blocks]
+
+        # samples not in a block yet, and the absolute index of the next block
+        self.pending = np.zeros(0)
+        self.next_block = 0
+        self.start_sample = start_sample
+        # block where the current run of each clip started, the sum of its ratios and its levels so far,
+        # None if it is off
+        self.run_starts = [None] * len(tone_clips)
+        self.run_ratio_sums = [0.0] * len(tone_clips)
+        self.run_levels = [[] for _ in tone_clips]
+
+    # share of the energy of every block at every clip frequency, and the level at that frequency,
+    # one row per block and one column per clip
+    def _get_tone_ratios(self, audio):
+        if len(audio) < self.block_size:
+            empty = np.zeros((0, len(self.clip_names)))
+            return empty, empty
+        blocks = sliding_window_view(audio, self.block_size)[::self.hop_size]
+        levels = np.abs(blocks @ self.basis)
+        energy = (blocks ** 2) @ (self.window ** 2)
+        ratios = levels ** 2 * self.ratio_scale / np.maximum(energy, self.min_block_energy)[:, np.newaxis]
+        ratios[energy < self.min_block_energy] = 0
+        return ratios, levels
+
+    # (start, end) blocks of the runs of on blocks, end is exclusive
+    def _get_runs(self, ratios):
+        on = ratios >= self.min_tone_ratio
+        edges = np.flatnonzero(np.diff(np.concatenate(([False], on, [False])).astype(np.int8)))
+        return list(zip(edges[::2], edges[1::2]))
+
+    def process(self, chunk, report=True, stats=None):
+        """
+        Push the next chunk of the stream.
+
+        Parameters:
+            chunk (numpy array): Next samples of the stream as a floating-point array.
+            report (bool): False to only update the state, e.g. for the chunk before the first one to search.
+            stats (DetectionStats): Counts the tone runs as candidates, and the ones with the wrong duration
+                as failed.
+
+        Returns:
+            tuple: peak times in seconds from the beginning of the audio and their scores for each clip name,
+                the score is the average share of the energy at the tone frequency during the tone.
+        """
+        audio = np.concatenate((self.pending, chunk))
+        ratios, levels = self._get_tone_ratios(audio)
+        first_block = self.next_block
+        num_blocks = len(ratios)
+        self.next_block += num_blocks
+        self.pending = audio[num_blocks * self.hop_size:]
+
+        peak_times = {clip_name: [] for clip_name in self.clip_names}
+        peak_scores = {clip_name: [] for clip_name in self.clip_names}
+        for i, clip_name in enumerate(self.clip_names):
+            on = ratios[:, i] >= self.min_tone_ratio
+            # a run still going on from the previous chunk is continued, not started again
+            edges = np.flatnonzero(np.diff(np.concatenate(([self.run_starts[i] is not None], on)).astype(np.int8)))
+            position = 0
+            for edge in edges:
+                if self.run_starts[i] is None:
+                    self.run_starts[i] = first_block + edge
+                    self.run_ratio_sums[i] = 0.0
+                    self.run_levels[i] = []
+                else:
+                    self.run_ratio_sums[i] += np.sum(ratios[position:edge, i])
+                    self.run_levels[i].append(levels[position:edge, i])
+                    if report:
+                        self._report_run(i, first_block + edge, peak_times, peak_scores, stats)
+                    self.run_starts[i] = None
+                position = edge
+            if self.run_starts[i] is not None:
+                self.run_ratio_sums[i] += np.sum(ratios[position:, i])
+                self.run_levels[i].append(levels[position:, i])
+
+        return peak_times, peak_scores
+
+    def flush(self, stats=None):
+        """
+        End of the stream, the samples that don't fill a block yet are measured as a block padded with silence,
+        and the tones still going on end there.
+
+        Returns:
+            tuple: peak times and scores for each clip name like process.
+        """
+        padding = np.zeros(self.block_size - len(self.pending)) if len(self.pending) else np.zeros(0)
+        peak_times, peak_scores = self.process(padding, stats=stats)
+        for i in range(len(self.clip_names)):
+            if self.run_starts[i] is not None:
+                self._report_run(i, self.next_block, peak_times, peak_scores, stats)
+                self.run_starts[i] = None
+        self.pending = np.zeros(0)
+        return peak_times, peak_scores
+
+    # run_end: absolute index of the first block after the run
+    def _report_run(self, i, run_end, peak_times, peak_scores, stats):
+        clip_name = self.clip_names[i]
+        run_blocks = run_end - self.run_starts[i]
+        if stats is not None:
+            stats.add_candidates(clip_name, 1)
+        if abs(run_blocks - self.clip_tone_blocks[i]) > self.duration_tolerances[i]:
+            if stats is not None:
+                stats.add_failed(clip_name, "tone_duration", 1)
+            return
+        if self._get_envelope_error(i) > self.max_envelope_error:
+            if stats is not None:
+                stats.add_failed(clip_name, "tone_envelope", 1)
+            return
+        if stats is not None:
+            stats.add_passed(clip_name, 1)
+        run_seconds = (self.start_sample + self.run_starts[i] * self.hop_size) / self.sample_rate
+        peak_times[clip_name].append(max(0, run_seconds - self.clip_tone_offsets[i]))
+        peak_scores[clip_name].append(float(self.run_ratio_sums[i] / run_blocks))
+
+    # mean absolute difference of the envelopes of the current run and the clip's tone, both normalized to 1
+    # at their loudest block, the run is stretched to the length of the clip's
+    def _get_envelope_error(self, i):
+        run_envelope = np.concatenate(self.run_levels[i])
+        clip_envelope = self.clip_envelopes[i]
+        if np.max(run_envelope) <= 0:
+            return np.inf
+        run_envelope = np.interp(np.linspace(0, 1, len(clip_envelope)), np.linspace(0, 1, len(run_envelope)),
+                                 run_envelope / np.max(run_envelope))
+        return float(np.mean(np.abs(run_envelope - clip_envelope)))
@@ -0,0 +1,69 @@
+import argparse
+import json
+import time
+
+import numpy as np
+from scipy.signal import correlate
+
+from audio_pattern_detector.audio_utils import TARGET_SAMPLE_RATE
+from audio_pattern_detector.correlation_utils import get_fft_size, get_clip_spectrum, correlate_with_clip_spectrum, \
+    get_clip_spectra, correlate_with_clip_spectra
+
+
+# compare correlating every chunk with scipy correlate against reusing the precomputed clip spectra,
+# one clip at a time and all clips batched together
+# python -m benchmarks.benchmark_correlation --hours 3 --clip-counts 1 5 10 20
+def benchmark(hours, seconds_per_chunk, clip_seconds, clip_count):
+    sr = TARGET_SAMPLE_RATE
+    rng = np.random.default_rng(0)
+    clips = [rng.standard_normal(int(clip_seconds * sr)).astype(np.float32) for _ in range(clip_count)]
+    clip_lengths = [len(clip) for clip in clips]
+    sliding_window = int(np.ceil(clip_seconds))
+    section = rng.standard_normal((seconds_per_chunk + sliding_window) * sr)
+    num_chunks = int(hours * 3600 / seconds_per_chunk)
+
+    start = time.perf_counter()
+    for _ in range(num_chunks):
+        for clip in clips:
+            correlate(section, clip, mode='full', method='fft')
+    scipy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fft_size = get_fft_size(len(section), max(clip_lengths))
+    clip_spectrum_list = [get_clip_spectrum(clip, fft_size) for clip in clips]
+    for _ in range(num_chunks):
+        for clip_spectrum, clip_length in zip(clip_spectrum_list, clip_lengths):
+            correlate_with_clip_spectrum(section, clip_spectrum, clip_length, fft_size)
+    precomputed_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    clip_spectra = get_clip_spectra(clips, fft_size)
+    for _ in range(num_chunks):
+        correlate_with_clip_spectra(section, clip_spectra, clip_lengths, fft_size)
+    batched_seconds = time.perf_counter() - start
+
+    return {"hours": hours,
+            "chunks": num_chunks,
+            "clip_seconds": clip_seconds,
+            "clip_count": clip_count,
+            "scipy_correlate_seconds": scipy_seconds,
+            "precomputed_spectrum_seconds": precomputed_seconds,
+            "batched_spectra_seconds": batched_seconds,
+            "speedup_precomputed": scipy_seconds / precomputed_seconds,
+            "speedup_batched": scipy_seconds / batched_seconds,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours', metavar='hours', type=float, default=3, help='hours of audio to simulate')
+    parser.add_argument('--seconds-per-chunk', metavar='seconds', type=int, default=60, help='seconds per chunk')
+    parser.add_argument('--clip-seconds', metavar='seconds', type=float, default=5, help='clip length in seconds')
+    parser.add_argument('--clip-counts', metavar='count', type=int, nargs='+', default=[1], help='number of clips')
+    args = parser.parse_args()
+    for clip_count in args.clip_counts:
+        print(json.dumps(benchmark(args.hours, args.seconds_per_chunk, args.clip_seconds, clip_count)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from audio_pattern_detector.audio_clip import AudioStream, MemmapAudioSource
+from audio_pattern_detector.audio_pattern_detector import AudioPatternDetector
+from audio_pattern_detector.audio_utils import TARGET_SAMPLE_RATE
+from audio_pattern_detector.cascade_search import CascadeSettings
+from audio_pattern_detector.fingerprint_index import FingerprintIndex
+from benchmarks.synthetic_audio import SyntheticAudioStream, make_clips, VARIANTS
+
+# peak times within tolerance seconds of an expected one are counted as found
+def get_accuracy(peak_times, expected_peak_times, tolerance=0.1):
+    expected_count = sum(len(times) for times in expected_peak_times.values())
+    found_count = sum(len(times) for times in peak_times.values())
+    matched = 0
+    for clip_name, expected_times in expected_peak_times.items():
+        for expected_time in expected_times:
+            if any(abs(peak_time - expected_time) <= tolerance for peak_time in peak_times.get(clip_name, [])):
+                matched += 1
+    return {"expected": expected_count,
+            "found": found_count,
+            "recall": matched / expected_count if expected_count else 1.0,
+            "precision": matched / found_count if found_count else 1.0,
+            }
+
+
+SEARCH_MODES = ["full", "cascade", "fingerprint"]
+
+
+def run_detection(variant, hours, clip_count, seconds_per_chunk, collect_stats, search_mode="full",
+                  track_tones=False, dtype="float32", normalized_correlation=False):
+    clips = make_clips(variant, clip_count)
+    synthetic_stream = SyntheticAudioStream(variant, clips, hours * 3600)
+    expected_peak_times = synthetic_stream.get_expected_peak_times()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # write it out first so that generating the audio is not part of the timings
+        pcm_file = os.path.join(tmpdir, "synthetic.pcm")
+        with open(pcm_file, 'wb') as f:
+            shutil.copyfileobj(synthetic_stream, f)
+        return _run_detection_on_file(pcm_file, clips, expected_peak_times, variant, hours, seconds_per_chunk,
+                                      collect_stats, search_mode, track_tones, dtype, normalized_correlation)
+
+
+def _run_detection_on_file(pcm_file, clips, expected_peak_times, variant, hours, seconds_per_chunk, collect_stats,
+                           search_mode="full", track_tones=False, dtype="float32", normalized_correlation=False):
+    detector = AudioPatternDetector(audio_clips=clips, seconds_per_chunk=seconds_per_chunk,
+                                    collect_stats=collect_stats,
+                                    cascade=CascadeSettings() if search_mode == "cascade" else None,
+                                    track_tones=track_tones,
+                                    fingerprint_index=FingerprintIndex.from_clips(clips)
+                                    if search_mode == "fingerprint" else None,
+                                    dtype=dtype,
+                                    normalized_correlation=normalized_correlation)
+
+    start = time.perf_counter()
+    with open(pcm_file, 'rb') as f:
+        audio_stream = AudioStream(name=f"synthetic_{variant}", audio_stream=f, sample_rate=TARGET_SAMPLE_RATE)
+        peak_times, total_time, *rest = detector.find_clip_in_audio(audio_stream)
+    elapsed = time.perf_counter() - start
+
+    result = {"variant": variant,
+              "hours": hours,
+              "clip_count": len(clips),
+              "seconds_per_chunk": seconds_per_chunk,
+              "search_mode": search_mode,
+              "track_tones": track_tones,
+              "dtype": dtype,
+              "normalized_correlation": normalized_correlation,
+              "audio_seconds": total_time,
+              "wall_seconds": elapsed,
+              "realtime_factor": total_time / elapsed,
+              # kilobytes on linux
+              "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              "accuracy": get_accuracy(peak_times, expected_peak_times),
+              }
+
+    if rest:
+        result.update(rest[0].to_dict())
+
+    return result
+
+
+def _get_detections(pcm_file, clips, dtype):
+    detector = AudioPatternDetector(audio_clips=clips, dtype=dtype)
+    start = time.perf_counter()
+    detections = list(detector.iter_detections(MemmapAudioSource.from_pcm_file(pcm_file)))
+    return detections, time.perf_counter() - start
+
+
+# float32 detections compared with float64 ones on the same audio, a detection of the same clip within
+# tolerance seconds is the same one
+def compare_dtypes(variant, hours, clip_count, tolerance=0.01):
+    clips = make_clips(variant, clip_count)
+    synthetic_stream = SyntheticAudioStream(variant, clips, hours * 3600)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pcm_file = os.path.join(tmpdir, "synthetic.pcm")
+        with open(pcm_file, 'wb') as f:
+            shutil.copyfileobj(synthetic_stream, f)
+        float64_detections, float64_seconds = _get_detections(pcm_file, clips, "float64")
+        float32_detections, float32_seconds = _get_detections(pcm_file, clips, "float32")
+
+    matched = 0
+    time_differences = []
+    score_differences = []
+    for clip_name, peak_time, score in float64_detections:
+        same = [(abs(peak_time - other_time), abs(score - other_score))
+                for other_name, other_time, other_score in float32_detections
+                if other_name == clip_name and abs(peak_time - other_time) <= tolerance]
+        if same:
+            matched += 1
+            time_difference, score_difference = min(same)
+            time_differences.append(time_difference)
+            score_differences.append(score_difference)
+
+    return {"variant": variant,
+            "hours": hours,
+            "clip_count": len(clips),
+            "float64_detections": len(float64_detections),
+            "float32_detections": len(float32_detections),
+            "matched": matched,
+            "max_time_difference": max(time_differences, default=0.0),
+            "max_score_difference": max(score_differences, default=0.0),
+            "float64_seconds": float64_seconds,
+            "float32_seconds": float32_seconds,
+            }
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# every configuration runs in a fresh process so that peak rss is not shared between them
+# python -m benchmarks.benchmark_detection --hours 3 --clip-counts 1 5 10 --seconds-per-chunk 60 --output ./tmp/bench.jsonl
+# compare the coarse to fine search with the full search on the same audio:
+# python -m benchmarks.benchmark_detection --variants speech loudness --clip-counts 1 5 --search-modes full cascade
+# and the fingerprint index pre-screen with many clips:
+# python -m benchmarks.benchmark_detection --variants speech loudness --clip-counts 10 50 --search-modes full fingerprint
+# and the tone tracker with the cross-correlation for beeps:
+# python -m benchmarks.benchmark_detection --variants tone --clip-counts 1 5 --track-tones --no-track-tones
+# and single with double precision:
+# python -m benchmarks.benchmark_detection --clip-counts 1 5 --dtypes float32 float64
+# or compare the float32 detections and scores with the float64 ones directly:
+# python -m benchmarks.benchmark_detection --clip-counts 1 5 --compare-dtypes
+# and the normalized cross-correlation with the loudness normalized sections:
+# python -m benchmarks.benchmark_detection --clip-counts 1 5 --normalized-correlation --no-normalized-correlation
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours', metavar='hours', type=float, default=1, help='hours of synthetic audio')
+    parser.add_argument('--variants', metavar='variant', type=str, nargs='+', default=VARIANTS, choices=VARIANTS,
+                        help='synthetic audio variants')
+    parser.add_argument('--clip-counts', metavar='count', type=int, nargs='+', default=[1, 5], help='number of clips')
+    parser.add_argument('--seconds-per-chunk', metavar='seconds', type=int, nargs='+', default=[60],
+                        help='seconds per chunk')
+    parser.add_argument('--search-modes', metavar='mode', type=str, nargs='+', default=["full"], choices=SEARCH_MODES,
+                        help='full rate correlation of every section, coarse to fine search with the default settings, '
+                             'or only around the candidates of a fingerprint index of the clips')
+    parser.add_argument('--track-tones', dest='track_tones', action='append_const', const=True,
+                        help='find pure tone clips with the tone tracker')
+    parser.add_argument('--no-track-tones', dest='track_tones', action='append_const', const=False,
+                        help='find pure tone clips with cross-correlation, the default, can be given with --track-tones to compare')
+    parser.add_argument('--dtypes', metavar='dtype', type=str, nargs='+', default=["float32"],
+                        choices=["float32", "float64"], help='precision of the audio sections and correlations')
+    parser.add_argument('--normalized-correlation', dest='normalized_correlation', action='append_const',
+                        const=True, help='score peaks with the normalized cross-correlation, without loudness '
+                                         'normalization of the sections')
+    parser.add_argument('--no-normalized-correlation', dest='normalized_correlation', action='append_const',
+                        const=False, help='loudness normalize the sections, the default, can be given with '
+                                          '--normalized-correlation to compare')
+    parser.add_argument('--compare-dtypes', metavar='compare dtypes', action=argparse.BooleanOptionalAction,
+                        default=False, help='only compare float32 detections with float64 ones for every variant '
+                                            'and clip count')
+    parser.add_argument('--stages', metavar='stages', action=argparse.BooleanOptionalAction, default=True,
+                        help='collect time per stage and verification counters')
+    parser.add_argument('--output', metavar='output', type=str, required=False,
+                        help='also append the json lines to this file')
+    args = parser.parse_args()
+
+    commit = get_commit()
+    if args.compare_dtypes:
+        for variant in args.variants:
+            for clip_count in args.clip_counts:
+                result = compare_dtypes(variant, args.hours, clip_count)
+                result["commit"] = commit
+                print(json.dumps(result))
+        return
+
+    for variant in args.variants:
+        for clip_count in args.clip_counts:
+            for seconds_per_chunk in args.seconds_per_chunk:
+                for search_mode in args.search_modes:
+                    for track_tones in args.track_tones or [False]:
+                        for dtype in args.dtypes:
+                            for normalized_correlation in args.normalized_correlation or [False]:
+                                with ProcessPoolExecutor(max_workers=1) as executor:
+                                    result = executor.submit(run_detection, variant, args.hours, clip_count,
+                                                             seconds_per_chunk, args.stages, search_mode,
+                                                             track_tones, dtype, normalized_correlation).result()
+                                result["commit"] = commit
+                                line = json.dumps(result)
+                                print(line)
+                                if args.output:
+                                    with open(args.output, 'a') as f:
+                                        print(line, file=f)
+
+
+if __name__ == '__main__':
+    main()
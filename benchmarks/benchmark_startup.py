@@ -0,0 +1,41 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+# measure interpreter startup plus importing the detector in a fresh process
+# python -m benchmarks.benchmark_startup --runs 10 --max-seconds 1.5
+def benchmark(runs, module):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+        timings.append(time.perf_counter() - start)
+    return {"module": module,
+            "runs": runs,
+            "median_seconds": statistics.median(timings),
+            "min_seconds": min(timings),
+            "max_seconds": max(timings),
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', metavar='runs', type=int, default=10, help='number of fresh processes')
+    parser.add_argument('--module', metavar='module', type=str, default='audio_pattern_detector.audio_pattern_detector',
+                        help='module to import')
+    parser.add_argument('--max-seconds', metavar='seconds', type=float, required=False,
+                        help='fail if the median startup time is above this')
+    args = parser.parse_args()
+    result = benchmark(args.runs, args.module)
+    print(json.dumps(result))
+    if args.max_seconds is not None and result["median_seconds"] > args.max_seconds:
+        print(f"median startup time {result['median_seconds']} is above {args.max_seconds} seconds", file=sys.stderr)
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import bisect
+import io
+
+import numpy as np
+
+from audio_pattern_detector.audio_clip import AudioClip
+from audio_pattern_detector.audio_utils import TARGET_SAMPLE_RATE
+
+VARIANTS = ["tone", "speech", "loudness"]
+
+
+def make_tone_clip(name, frequency, seconds=0.25):
+    sr = TARGET_SAMPLE_RATE
+    t = np.arange(int(seconds * sr)) / sr
+    # short fade in and out like a real beep
+    fade = np.minimum(1, np.minimum(t, seconds - t) / 0.01)
+    audio = 0.5 * np.sin(2 * np.pi * frequency * t) * fade
+    return AudioClip(name=name, audio=audio.astype(np.float32), sample_rate=sr)
+
+
+def make_speech_like(num_samples, rng):
+    sr = TARGET_SAMPLE_RATE
+    # low passed noise with a syllable rate envelope
+    audio = np.convolve(rng.standard_normal(num_samples), np.ones(8) / 8, mode='same')
+    phase = rng.uniform(0, 2 * np.pi)
+    envelope = 0.2 + 0.8 * np.sin(np.arange(num_samples) / sr * 2 * np.pi * 2 + phase) ** 2
+    return audio * envelope
+
+
+def make_speech_clip(name, seconds, seed):
+    rng = np.random.default_rng(seed)
+    audio = make_speech_like(int(seconds * TARGET_SAMPLE_RATE), rng) * 0.5
+    return AudioClip(name=name, audio=audio.astype(np.float32), sample_rate=TARGET_SAMPLE_RATE)
+
+
+def make_clips(variant, clip_count):
+    if variant == "tone":
+        return [make_tone_clip(f"tone_{i}", 500 + 50 * i) for i in range(clip_count)]
+    # speech like clips between 1.5 and 5 seconds
+    return [make_speech_clip(f"speech_{i}", 1.5 + (i * 0.7) % 3.5, seed=100 + i) for i in range(clip_count)]
+
+
+# every clip is inserted every interval seconds, clips are spread evenly so they don't overlap
+def make_insertions(clips, total_seconds, interval=600, seed=0):
+    rng = np.random.default_rng(seed)
+    insertions = []
+    for i, clip in enumerate(clips):
+        seconds = 30 + i * interval / len(clips)
+        while seconds + clip.clip_length_seconds() < total_seconds:
+            # not aligned to chunk boundaries
+            start = int((seconds + rng.uniform(0, 1)) * TARGET_SAMPLE_RATE)
+            gain = rng.uniform(0.5, 1.5)
+            insertions.append((start, clip, gain))
+            seconds += interval
+    insertions.sort(key=lambda insertion: insertion[0])
+    return insertions
+
+
+class SyntheticAudioStream(io.RawIOBase):
+    """
+    Raw 16 bit mono pcm at TARGET_SAMPLE_RATE generated on the fly, so hours of audio don't need to be in memory.
+
+    Audio is made in blocks of one second from the seed and block index,
+    so the output is the same regardless of how it is read.
+    """
+
+    def __init__(self, variant, clips, total_seconds, seed=0):
+        if variant not in VARIANTS:
+            raise ValueError(f"unknown variant {variant}, needs to be one of {VARIANTS}")
+        self.variant = variant
+        self.total_samples = int(total_seconds * TARGET_SAMPLE_RATE)
+        self.insertions = make_insertions(clips, total_seconds, seed=seed)
+        self.insertion_starts = [start for start, _, _ in self.insertions]
+        self.max_clip_length = max(len(clip.audio) for clip in clips)
+        self.seed = seed
+        self.position = 0
+        self.block = b""
+
+    # expected peak times for each clip name, in seconds
+    def get_expected_peak_times(self):
+        expected = {}
+        for start, clip, _ in self.insertions:
+            expected.setdefault(clip.name, []).append(start / TARGET_SAMPLE_RATE)
+        return expected
+
+    def readable(self):
+        return True
+
+    def _make_block(self, block_index):
+        sr = TARGET_SAMPLE_RATE
+        block_start = block_index * sr
+        block_end = min(block_start + sr, self.total_samples)
+        rng = np.random.default_rng([self.seed, block_index])
+        audio = make_speech_like(block_end - block_start, rng) * 0.1
+
+        if self.variant == "loudness":
+            # background slowly going up and down by about 20 dB every 10 minutes
+            audio *= 10 ** (np.sin(2 * np.pi * block_index / 600) / 2)
+
+        first = bisect.bisect_left(self.insertion_starts, block_start - self.max_clip_length)
+        last = bisect.bisect_left(self.insertion_starts, block_end)
+        for start, clip, gain in self.insertions[first:last]:
+            clip_start = max(block_start, start)
+            clip_end = min(block_end, start + len(clip.audio))
+            if clip_start < clip_end:
+                audio[clip_start - block_start:clip_end - block_start] += (
+                        clip.audio[clip_start - start:clip_end - start] * gain)
+
+        return (np.clip(audio, -1, 1) * 32767).astype('<i2').tobytes()
+
+    def readinto(self, b):
+        if not self.block:
+            if self.position >= self.total_samples:
+                return 0
+            self.block = self._make_block(self.position // TARGET_SAMPLE_RATE)
+            self.position = min(self.position + TARGET_SAMPLE_RATE, self.total_samples)
+        size = min(len(b), len(self.block))
+        b[:size] = self.block[:size]
+        self.block = self.block[size:]
+        return size
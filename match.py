@@ -3,13 +3,19 @@ import glob
 import json
 import os
 import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
-from audio_pattern_detector.audio_clip import AudioClip, AudioStream
+from audio_pattern_detector.audio_clip import AudioClip, AudioStream, MemmapAudioSource
 from audio_pattern_detector.audio_pattern_detector import AudioPatternDetector
+from audio_pattern_detector.clip_artifact_cache import ClipArtifactCache
+from audio_pattern_detector.pcm_cache import PcmCache
+from audio_pattern_detector.clip_library import get_clip_entries_from_folder, get_clip_entries_from_manifest, \
+    load_clip_library
 from andrew_utils import seconds_to_time
 
-from audio_pattern_detector.audio_utils import ffmpeg_get_16bit_pcm, TARGET_SAMPLE_RATE
+from audio_pattern_detector.audio_utils import ffmpeg_get_16bit_pcm, write_16bit_pcm_file, TARGET_SAMPLE_RATE
 
 
 # # only for testing
@@ -55,63 +61,265 @@ from audio_pattern_detector.audio_utils import ffmpeg_get_16bit_pcm, TARGET_SAMP
 
 #     return peak_times_final
 
-def match_pattern(audio_file, pattern_file, debug_mode=False):
-    if not os.path.exists(audio_file):
-        raise ValueError(f"Audio {audio_file} does not exist")
+# jobs > 1 decodes the whole file first and splits it into chunks for multiple processes,
+# audio_file can also be raw 16 bit mono pcm at TARGET_SAMPLE_RATE with .pcm extension
+# collect_stats: also return DetectionStats as the third item
+# clip_artifact_cache: ClipArtifactCache to skip preparing the pattern again if it was used before
+# pcm_cache: PcmCache to reuse the decoded audio from previous runs instead of running ffmpeg again
+# max_matches_per_clip, max_seconds: stop early after the first matches or the beginning of the audio,
+#   see AudioPatternDetector
+# start_seconds, end_seconds: only search this part of the audio, ffmpeg seeks to it instead of decoding
+#   the whole file, peak times are still from the beginning of the audio
+def match_pattern(audio_file, pattern_file, debug_mode=False, jobs=1, collect_stats=False, clip_artifact_cache=None,
+                  pcm_cache=None, max_matches_per_clip=None, max_seconds=None, start_seconds=None, end_seconds=None):
     if not os.path.exists(pattern_file):
         raise ValueError(f"Pattern {pattern_file} does not exist")
 
     pattern_clip = AudioClip.from_audio_file(pattern_file)
+    peak_times, *rest = match_patterns(audio_file, [pattern_clip], debug_mode=debug_mode, jobs=jobs,
+                                       collect_stats=collect_stats, clip_artifact_cache=clip_artifact_cache,
+                                       pcm_cache=pcm_cache, max_matches_per_clip=max_matches_per_clip,
+                                       max_seconds=max_seconds, start_seconds=start_seconds,
+                                       end_seconds=end_seconds)
+    return peak_times[pattern_clip.name], *rest
+
+
+# all clips are found with one detector, so the audio is only decoded and scanned once,
+# peak times are keyed by clip name
+def match_patterns(audio_file, audio_clips, debug_mode=False, jobs=1, collect_stats=False, clip_artifact_cache=None,
+                   pcm_cache=None, max_matches_per_clip=None, max_seconds=None, start_seconds=None,
+                   end_seconds=None):
+    if not os.path.exists(audio_file):
+        raise ValueError(f"Audio {audio_file} does not exist")
+
+    detector = AudioPatternDetector(debug_mode=debug_mode,audio_clips=audio_clips,collect_stats=collect_stats,
+                                    clip_artifact_cache=clip_artifact_cache,
+                                    max_matches_per_clip=max_matches_per_clip, max_seconds=max_seconds)
+    if Path(audio_file).suffix.lower() == '.pcm':
+        result = detector.find_clip_in_pcm_file(audio_file, jobs=jobs, start_seconds=start_seconds,
+                                                end_seconds=end_seconds)
+    elif pcm_cache is not None:
+        result = detector.find_clip_in_pcm_file(pcm_cache.get_pcm_file(audio_file), jobs=jobs,
+                                                start_seconds=start_seconds, end_seconds=end_seconds)
+    elif jobs > 1:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pcm_file = os.path.join(tmpdir, f'{Path(audio_file).stem}.pcm')
+            print(f"Decoding audio file {audio_file}...",file=sys.stderr)
+            # only the part to search is decoded, so the file starts at start_seconds
+            write_16bit_pcm_file(audio_file, pcm_file, sr=TARGET_SAMPLE_RATE, start_seconds=start_seconds,
+                                 end_seconds=end_seconds)
+            peak_times, *rest = detector.find_clip_in_pcm_file(pcm_file, jobs=jobs)
+            result = (_shift_peak_times(peak_times, start_seconds), *rest)
+    else:
+        result = find_pattern_in_audio_file(audio_file, detector, start_seconds=start_seconds,
+                                            end_seconds=end_seconds)
+    return result
+
+
+def _shift_peak_times(peak_times, seconds):
+    if not seconds:
+        return peak_times
+    return {clip_name: [peak_time + seconds for peak_time in clip_peak_times]
+            for clip_name, clip_peak_times in peak_times.items()}
+
+
+# detector can be reused for multiple audio files, the clips are only prepared once
+def find_pattern_in_audio_file(audio_file, detector, pcm_cache=None, start_seconds=None, end_seconds=None):
     sr = TARGET_SAMPLE_RATE
-    with ffmpeg_get_16bit_pcm(audio_file, target_sample_rate=sr, ac=1) as stdout:
+    if pcm_cache is not None:
+        print(f"Finding pattern in audio file {Path(audio_file).stem}...",file=sys.stderr)
+        # decoded only the first time, memory mapped after that
+        return detector.find_clip_in_pcm_file(pcm_cache.get_pcm_file(audio_file), jobs=1,
+                                              start_seconds=start_seconds, end_seconds=end_seconds)
+    if Path(audio_file).suffix.lower() == '.wav':
+        try:
+            # already in the target format, read it with a memory map instead of ffmpeg
+            memmap_source = MemmapAudioSource.from_wav_file(audio_file)
+        except ValueError:
+            memmap_source = None
+        if memmap_source is not None:
+            print(f"Finding pattern in audio file {memmap_source.name}...",file=sys.stderr)
+            return detector.find_clip_in_audio(memmap_source, start_seconds=start_seconds, end_seconds=end_seconds)
+    with ffmpeg_get_16bit_pcm(audio_file, target_sample_rate=sr, ac=1, start_seconds=start_seconds,
+                              end_seconds=end_seconds) as stdout:
         audio_name = Path(audio_file).stem
         print(f"Finding pattern in audio file {audio_name}...",file=sys.stderr)
         #exit(1)
         full_streaming_audio = AudioStream(name=audio_name, audio_stream=stdout, sample_rate=sr)
         # Find clip occurrences in the full audio
-        peak_times, total_time = (AudioPatternDetector(debug_mode=debug_mode,audio_clips=[pattern_clip])
-                      .find_clip_in_audio(full_streaming_audio))
-    return peak_times[pattern_clip.name], total_time
+        # peak times and total time, plus stats if the detector collects them
+        result = detector.find_clip_in_audio(full_streaming_audio, start_seconds=start_seconds,
+                                             end_seconds=end_seconds)
+    return result
+
+
+# one detector per worker process, built once by the pool initializer
+_worker_detector = None
+_worker_pcm_cache = None
+
+
+def _init_worker(audio_clips, collect_stats=False, clip_artifact_cache=None, pcm_cache=None,
+                 max_matches_per_clip=None, max_seconds=None):
+    global _worker_detector, _worker_pcm_cache
+    _worker_detector = AudioPatternDetector(debug_mode=False,audio_clips=audio_clips,collect_stats=collect_stats,
+                                            clip_artifact_cache=clip_artifact_cache,
+                                            max_matches_per_clip=max_matches_per_clip, max_seconds=max_seconds)
+    _worker_pcm_cache = pcm_cache
+
+
+# peak times are keyed by clip name, stats is None unless the worker detector collects them
+def _match_in_worker(audio_file, start_seconds=None, end_seconds=None):
+    peak_times, total_time, *rest = find_pattern_in_audio_file(audio_file, _worker_detector, _worker_pcm_cache,
+                                                               start_seconds, end_seconds)
+    stats = rest[0] if rest else None
+    return audio_file, peak_times, total_time, stats
+
+
+def _iter_folder_results(audio_files, audio_clips, jobs, ordered, collect_stats=False, clip_artifact_cache=None,
+                         pcm_cache=None, max_matches_per_clip=None, max_seconds=None, start_seconds=None,
+                         end_seconds=None):
+    if jobs <= 1:
+        _init_worker(audio_clips, collect_stats, clip_artifact_cache, pcm_cache, max_matches_per_clip, max_seconds)
+        for audio_file in audio_files:
+            print(f"Processing {audio_file}...",file=sys.stderr)
+            yield _match_in_worker(audio_file, start_seconds, end_seconds)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(audio_clips, collect_stats, clip_artifact_cache, pcm_cache,
+                                       max_matches_per_clip, max_seconds)) as executor:
+        futures = {executor.submit(_match_in_worker, audio_file, start_seconds, end_seconds): index
+                   for index, audio_file in enumerate(audio_files)}
+        # yield in completion order, or hold back results that finish early to keep the input order
+        pending = {}
+        next_index = 0
+        for future in as_completed(futures):
+            if not ordered:
+                yield future.result()
+                continue
+            pending[futures[future]] = future.result()
+            while next_index in pending:
+                yield pending.pop(next_index)
+                next_index += 1
 
 
 def main():
     #set_debug_mode(True)
     parser = argparse.ArgumentParser()
-    parser.add_argument('--pattern-file', metavar='pattern file', required=True, type=str, help='pattern file')
+    pattern_group = parser.add_mutually_exclusive_group(required=True)
+    pattern_group.add_argument('--pattern-file', metavar='pattern file', type=str, help='pattern file')
+    pattern_group.add_argument('--pattern-folder', metavar='pattern folder', type=str,
+                               help='find all wav patterns in the folder at once, peak times are keyed by pattern name')
+    pattern_group.add_argument('--pattern-manifest', metavar='pattern manifest', type=str,
+                               help='json list of pattern files, or objects with path and name, to find at once')
     parser.add_argument('--audio-file', metavar='audio file', type=str, required=False, help='audio file to find pattern')
     parser.add_argument('--audio-folder', metavar='audio folder', type=str, required=False, help='audio folder to find pattern in files')
     parser.add_argument('--debug', metavar='debug', action=argparse.BooleanOptionalAction, help='debug mode (audio file only)', default=True)
+    parser.add_argument('--jobs', metavar='jobs', type=int, default=1,
+                        help='number of worker processes, one file per worker for audio folder, chunks of the same file for audio file')
+    parser.add_argument('--ordered', metavar='ordered', action=argparse.BooleanOptionalAction, default=False,
+                        help='write results in file name order instead of completion order (audio folder only)')
+    parser.add_argument('--stats', metavar='stats', action=argparse.BooleanOptionalAction, default=False,
+                        help='print time per stage and verification counters as json')
+    parser.add_argument('--clip-cache-dir', metavar='clip cache dir', type=str, required=False,
+                        help='keep prepared patterns in this folder so that they are not prepared again next time')
+    parser.add_argument('--clip-cache-max-mb', metavar='clip cache max mb', type=int, default=1024,
+                        help='remove the least recently used prepared patterns when the clip cache is larger than this')
+    parser.add_argument('--pcm-cache-dir', metavar='pcm cache dir', type=str, required=False,
+                        help='keep decoded audio in this folder so that scanning the same files again skips ffmpeg')
+    parser.add_argument('--pcm-cache-max-mb', metavar='pcm cache max mb', type=int, default=10240,
+                        help='remove the least recently used decoded audio when the pcm cache is larger than this')
+    parser.add_argument('--max-matches', metavar='max matches', type=int, required=False,
+                        help='stop after this many matches of every pattern, 1 to only find the first match')
+    parser.add_argument('--max-seconds', metavar='max seconds', type=float, required=False,
+                        help='only find matches within the first seconds of the audio and stop decoding after that')
+    parser.add_argument('--start-seconds', metavar='start seconds', type=float, required=False,
+                        help='only search the audio from here, ffmpeg seeks to it instead of decoding from the start')
+    parser.add_argument('--end-seconds', metavar='end seconds', type=float, required=False,
+                        help='only search the audio until here')
     #parser.add_argument('--threshold', metavar='pattern match method', type=float, help='pattern match method',
     #                    default=0.4)
     args = parser.parse_args()
 
+    clip_artifact_cache = None
+    if args.clip_cache_dir:
+        clip_artifact_cache = ClipArtifactCache(args.clip_cache_dir, max_bytes=args.clip_cache_max_mb * 1024 * 1024)
+
+    pcm_cache = None
+    if args.pcm_cache_dir:
+        pcm_cache = PcmCache(args.pcm_cache_dir, max_bytes=args.pcm_cache_max_mb * 1024 * 1024)
+
+    if args.pattern_file:
+        if not os.path.exists(args.pattern_file):
+            raise ValueError(f"Pattern {args.pattern_file} does not exist")
+        audio_clips = [AudioClip.from_audio_file(args.pattern_file)]
+        pattern_source = args.pattern_file
+    else:
+        if args.pattern_folder:
+            clip_entries = get_clip_entries_from_folder(args.pattern_folder)
+            pattern_source = os.path.normpath(args.pattern_folder)
+        else:
+            clip_entries = get_clip_entries_from_manifest(args.pattern_manifest)
+            pattern_source = args.pattern_manifest
+        # all of them are loaded and checked before any audio is processed
+        audio_clips = load_clip_library(clip_entries)
+        print(f"Loaded {len(audio_clips)} patterns from {pattern_source}",file=sys.stderr)
+
+    # with a single pattern file the output only has its peak times like before
+    single_pattern = args.pattern_file is not None
+
     if args.audio_folder:
         #basename(args.pattern_file)
-        output_file_prefix=Path(args.pattern_file).stem
+        output_file_prefix=Path(pattern_source).stem
         output_file_prefix=f'{os.path.basename(args.audio_folder)}_{output_file_prefix}'
         output_file=f'./tmp/{output_file_prefix}.jsonl'
         with open(output_file, 'w') as f:
             f.truncate(0)
         print(f"Finding pattern in audio files in folder {args.audio_folder}...",file=sys.stderr)
         #peak_time = {}
-        for audio_file in glob.glob(f'{args.audio_folder}/*.m4a'):
-            print(f"Processing {audio_file}...",file=sys.stderr)
-            peak_times, total_time = match_pattern(audio_file, args.pattern_file, debug_mode=False)
+        audio_files = sorted(glob.glob(f'{args.audio_folder}/*.m4a'))
+        for audio_file, peak_times, total_time, stats in _iter_folder_results(audio_files, audio_clips,
+                                                                              jobs=args.jobs, ordered=args.ordered,
+                                                                              collect_stats=args.stats,
+                                                                              clip_artifact_cache=clip_artifact_cache,
+                                                                              pcm_cache=pcm_cache,
+                                                                              max_matches_per_clip=args.max_matches,
+                                                                              max_seconds=args.max_seconds,
+                                                                              start_seconds=args.start_seconds,
+                                                                              end_seconds=args.end_seconds):
+            print(f"Processed {audio_file}",file=sys.stderr)
             print(peak_times,file=sys.stderr)
             print(f"Total time processed: {seconds_to_time(seconds=total_time)}",file=sys.stderr)
-            if len(peak_times) > 0:
-                peak_times_second = [seconds_to_time(seconds=offset) for offset in peak_times]
-                print(f"Clip occurs with the file {audio_file} at the following times (in seconds): {peak_times_second}",file=sys.stderr)
+            if stats is not None:
+                print(json.dumps({'audio_file': audio_file, 'stats': stats.to_dict()}),file=sys.stderr)
+            peak_times_second = {}
+            for clip_name, clip_peak_times in peak_times.items():
+                if len(clip_peak_times) > 0:
+                    peak_times_second[clip_name] = [seconds_to_time(seconds=offset) for offset in clip_peak_times]
+                    print(f"Clip {clip_name} occurs with the file {audio_file} at the following times (in seconds): {peak_times_second[clip_name]}",file=sys.stderr)
+            if len(peak_times_second) > 0:
+                if single_pattern:
+                    peak_times_second, = peak_times_second.values()
                 #all_files[audio_file] = peak_times_second
                 with open(output_file, 'a') as f:
                     print(json.dumps({'audio_file': audio_file, 'peak_times': peak_times_second},ensure_ascii=False), file=f)
     elif args.audio_file:
-        peak_times,total_time=match_pattern(args.audio_file, args.pattern_file, debug_mode=args.debug)
+        peak_times,total_time,*rest=match_patterns(args.audio_file, audio_clips, debug_mode=args.debug,
+                                                   jobs=args.jobs, collect_stats=args.stats,
+                                                   clip_artifact_cache=clip_artifact_cache,
+                                                   pcm_cache=pcm_cache,
+                                                   max_matches_per_clip=args.max_matches,
+                                                   max_seconds=args.max_seconds,
+                                                   start_seconds=args.start_seconds,
+                                                   end_seconds=args.end_seconds)
         print(peak_times,file=sys.stderr)
         print(f"Total time processed: {seconds_to_time(seconds=total_time)}",file=sys.stderr)
+        if rest:
+            print(json.dumps(rest[0].to_dict()),file=sys.stderr)
 
-        for offset in peak_times:
-            print(f"Clip occurs at the following times (in seconds): {seconds_to_time(seconds=offset)}",file=sys.stderr)
+        for clip_name, clip_peak_times in peak_times.items():
+            for offset in clip_peak_times:
+                print(f"Clip {clip_name} occurs at the following times (in seconds): {seconds_to_time(seconds=offset)}",file=sys.stderr)
     else:
         print("Please provide either --audio-file or --audio-folder",file=sys.stderr)
         exit(1)
@@ -0,0 +1,52 @@
+import argparse
+import asyncio
+import json
+import sys
+
+from andrew_utils import seconds_to_time
+
+from audio_pattern_detector.audio_clip import AudioClip
+from audio_pattern_detector.audio_pattern_detector import AudioPatternDetector
+from audio_pattern_detector.audio_utils import ffmpeg_get_16bit_pcm_async, TARGET_SAMPLE_RATE
+from audio_pattern_detector.clip_library import get_clip_entries_from_folder, load_clip_library
+
+
+async def monitor_stream(detector, stream_url):
+    async with ffmpeg_get_16bit_pcm_async(stream_url, target_sample_rate=TARGET_SAMPLE_RATE, ac=1) as stdout:
+        async for clip_name, peak_time, score in detector.detect_stream(stdout):
+            # one json line per detection as soon as it is found
+            print(json.dumps({'stream': stream_url, 'clip_name': clip_name,
+                              'peak_time': seconds_to_time(seconds=peak_time),
+                              'score': round(score, 4)}, ensure_ascii=False), flush=True)
+
+
+async def monitor_streams(detector, stream_urls):
+    # the detector is shared, every stream keeps its own state
+    results = await asyncio.gather(*[monitor_stream(detector, stream_url) for stream_url in stream_urls],
+                                   return_exceptions=True)
+    for stream_url, result in zip(stream_urls, results):
+        if isinstance(result, Exception):
+            print(f"Stream {stream_url} failed: {result}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    pattern_group = parser.add_mutually_exclusive_group(required=True)
+    pattern_group.add_argument('--pattern-file', metavar='pattern file', type=str, help='pattern file')
+    pattern_group.add_argument('--pattern-folder', metavar='pattern folder', type=str,
+                               help='find all wav patterns in the folder')
+    parser.add_argument('--stream-url', metavar='stream url', type=str, nargs='+', required=True,
+                        help='live streams or files that ffmpeg can read, all monitored at the same time')
+    args = parser.parse_args()
+
+    if args.pattern_file:
+        audio_clips = [AudioClip.from_audio_file(args.pattern_file)]
+    else:
+        audio_clips = load_clip_library(get_clip_entries_from_folder(args.pattern_folder))
+
+    detector = AudioPatternDetector(audio_clips=audio_clips)
+    asyncio.run(monitor_streams(detector, args.stream_url))
+
+
+if __name__ == '__main__':
+    main()
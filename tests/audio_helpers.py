@@ -0,0 +1,42 @@
+import io
+
+import numpy as np
+
+from audio_pattern_detector.audio_clip import AudioClip, AudioStream
+from audio_pattern_detector.audio_utils import TARGET_SAMPLE_RATE
+
+# synthetic audio shared by the tests, imported as a module because pytest puts the tests folder on sys.path
+
+
+# speech like clip, low passed noise with a syllable rate envelope
+def make_clip(name, seconds, seed):
+    rng = np.random.default_rng(seed)
+    num_samples = int(seconds * TARGET_SAMPLE_RATE)
+    audio = np.convolve(rng.standard_normal(num_samples), np.ones(8) / 8, mode='same')
+    envelope = 0.5 + 0.5 * np.sin(np.arange(num_samples) / TARGET_SAMPLE_RATE * 2 * np.pi * 3) ** 2
+    return AudioClip(name=name, audio=(audio * envelope * 0.3).astype(np.float32), sample_rate=TARGET_SAMPLE_RATE)
+
+
+# noise with the signals added at the start samples
+def make_audio(signals, starts, total_seconds, gain=1.0):
+    audio = np.random.default_rng(0).standard_normal(int(total_seconds * TARGET_SAMPLE_RATE)) * 0.05
+    for signal, start in zip(signals, starts):
+        audio[start:start + len(signal)] += signal * gain
+    return audio
+
+
+# noise with the clips inserted at insert_seconds, returned as raw 16 bit pcm bytes
+def make_pcm(clips, insert_seconds, total_seconds):
+    return to_pcm(make_audio([clip.audio for clip in clips],
+                             [int(seconds * TARGET_SAMPLE_RATE) for seconds in insert_seconds], total_seconds))
+
+
+# raw 16 bit pcm bytes of float audio
+def to_pcm(audio):
+    return (np.clip(audio, -1, 1) * 32767).astype('<i2').tobytes()
+
+
+def find_in_pcm_bytes(detector, pcm):
+    audio_stream = AudioStream(name="test", audio_stream=io.BufferedReader(io.BytesIO(pcm)),
+                               sample_rate=TARGET_SAMPLE_RATE)
+    return detector.find_clip_in_audio(audio_stream)
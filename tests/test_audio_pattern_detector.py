@@ -0,0 +1,484 @@
+import asyncio
+import io
+import sys
+
+import numpy as np
+import pytest
+from scipy.signal import correlate
+
+from audio_pattern_detector import audio_utils
+from audio_pattern_detector.audio_clip import AudioClip, AudioStream, MemmapAudioSource
+from audio_pattern_detector.audio_pattern_detector import AudioPatternDetector
+from audio_pattern_detector.audio_utils import ffmpeg_get_16bit_pcm, TARGET_SAMPLE_RATE
+from audio_pattern_detector.cascade_search import CascadeSettings, correlate_in_ranges, extend_ranges
+from audio_pattern_detector.clip_artifact_cache import ClipArtifactCache
+from audio_pattern_detector.fingerprint_index import FingerprintIndex
+
+from audio_helpers import make_clip, make_audio, make_pcm, to_pcm, find_in_pcm_bytes
+
+
+def test_find_clip_in_audio():
+    intro = make_clip("intro", 3.4, 1)
+    outro = make_clip("outro", 1.7, 2)
+    pcm = make_pcm([intro, outro, intro], [10, 59.5, 130], 200.5)
+    peak_times, total_time = find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro, outro]), pcm)
+    assert total_time == 200.5
+    np.testing.assert_allclose(peak_times["intro"], [10, 130], atol=0.01)
+    np.testing.assert_allclose(peak_times["outro"], [59.5], atol=0.01)
+
+
+def test_cascade_same_as_full_search():
+    intro = make_clip("intro", 3.4, 1)
+    outro = make_clip("outro", 1.7, 2)
+    sr = TARGET_SAMPLE_RATE
+    pcms = [
+        make_pcm([intro, outro, intro, outro], [10, 59.5, 130, 239], 300.5),
+        # a softer copy overlapping the one at 130 s, its decimated peak is higher than the louder one
+        # off the decimation grid, which the full rate search still finds
+        to_pcm(make_audio([intro.audio, outro.audio, intro.audio, intro.audio * 0.9, outro.audio],
+                          [10 * sr, int(59.5 * sr), 130 * sr + 2, int(131.82 * sr), 239 * sr], 300.5)),
+    ]
+
+    for pcm in pcms:
+        expected_peak_times, total_time = find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro, outro]), pcm)
+        np.testing.assert_allclose(expected_peak_times["intro"], [10, 130], atol=0.01)
+        # max_coverage 0 always falls back to the full correlation
+        for cascade in [CascadeSettings(), CascadeSettings(decimation=2), CascadeSettings(max_coverage=0)]:
+            peak_times, cascade_total_time = find_in_pcm_bytes(
+                AudioPatternDetector(audio_clips=[intro, outro], cascade=cascade), pcm)
+            assert cascade_total_time == total_time
+            for clip_name, clip_peak_times in expected_peak_times.items():
+                np.testing.assert_allclose(peak_times[clip_name], clip_peak_times, atol=1e-6)
+
+
+def test_search_ranges_normalized_within_ranges():
+    intro = make_clip("intro", 3.4, 1)
+    detector = AudioPatternDetector(audio_clips=[intro], dtype=np.float64)
+    clip_datas, _ = detector._prepare_clips()
+    clip = clip_datas["intro"]["clip"]
+    clip_length = len(clip)
+    sr = TARGET_SAMPLE_RATE
+    rng = np.random.default_rng(0)
+    audio_section = rng.standard_normal(60 * sr) * 0.05
+    audio_section[10 * sr:10 * sr + clip_length] += clip
+    # twice as loud copy outside of the search ranges
+    audio_section[40 * sr:40 * sr + clip_length] += clip * 2
+
+    def find(correlation, search_ranges):
+        return detector._correlation_method(clip_datas["intro"], detector._new_clip_cache(), correlation,
+                                            audio_section, sr, 0, search_ranges=search_ranges)
+
+    peak_times, peak_scores = find(correlate(audio_section, clip, mode='full', method='fft'), None)
+    np.testing.assert_allclose(peak_times, [10 + clip_length / sr, 40 + clip_length / sr], atol=0.01)
+
+    peak = 10 * sr + clip_length - 1
+    search_ranges = [(peak - 10, peak + 11)]
+    correlation = correlate_in_ranges(audio_section, clip,
+                                      extend_ranges(search_ranges, clip_length, len(audio_section) + clip_length - 1))
+    ranges_peak_times, ranges_peak_scores = find(correlation, search_ranges)
+    # same peak, normalized by the largest correlation within the ranges instead of the louder copy
+    np.testing.assert_allclose(ranges_peak_times, peak_times[:1], atol=1e-6)
+    assert peak_scores[0] == pytest.approx(0.5, abs=0.05)
+    assert ranges_peak_scores[0] == pytest.approx(1, abs=0.05)
+
+
+def test_float32_same_as_float64():
+    intro = make_clip("intro", 3.4, 1)
+    outro = make_clip("outro", 1.7, 2)
+    pcm = make_pcm([intro, outro, intro, outro], [10, 59.5, 130, 239], 300.5)
+
+    def get_detections(dtype):
+        detector = AudioPatternDetector(audio_clips=[intro, outro], dtype=dtype)
+        audio_stream = AudioStream(name="test", audio_stream=io.BufferedReader(io.BytesIO(pcm)),
+                                   sample_rate=TARGET_SAMPLE_RATE)
+        return list(detector.iter_detections(audio_stream))
+
+    expected = get_detections(np.float64)
+    detections = get_detections(np.float32)
+    assert [clip_name for clip_name, _, _ in detections] == [clip_name for clip_name, _, _ in expected]
+    np.testing.assert_allclose([peak_time for _, peak_time, _ in detections],
+                               [peak_time for _, peak_time, _ in expected], atol=1e-6)
+    np.testing.assert_allclose([score for _, _, score in detections], [score for _, _, score in expected],
+                               atol=1e-4)
+
+    with pytest.raises(ValueError):
+        AudioPatternDetector(audio_clips=[intro], dtype=np.int16)
+
+
+def test_normalized_correlation_same_as_loudness_normalization():
+    intro = make_clip("intro", 3.4, 1)
+    outro = make_clip("outro", 1.7, 2)
+    pcm = make_pcm([intro, outro, intro, outro], [10, 59.5, 130, 239], 300.5)
+    # a much quieter and a louder part, which the loudness normalization of every section evens out
+    audio = np.frombuffer(pcm, dtype='<i2').astype(np.float64)
+    audio[100 * TARGET_SAMPLE_RATE:200 * TARGET_SAMPLE_RATE] *= 0.05
+    audio[200 * TARGET_SAMPLE_RATE:] *= 2
+    pcm = (np.clip(audio, -32768, 32767)).astype('<i2').tobytes()
+
+    expected_peak_times, total_time = find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro, outro]), pcm)
+    for cascade in [None, CascadeSettings()]:
+        detector = AudioPatternDetector(audio_clips=[intro, outro], normalized_correlation=True, cascade=cascade,
+                                        collect_stats=True)
+        peak_times, normalized_total_time, stats = find_in_pcm_bytes(detector, pcm)
+        assert normalized_total_time == total_time
+        for clip_name, clip_peak_times in expected_peak_times.items():
+            np.testing.assert_allclose(peak_times[clip_name], clip_peak_times, atol=1e-6)
+        assert "loudness" not in stats.stage_seconds
+        assert stats.stage_seconds["energy"] > 0
+
+    # scores only depend on the noise over the clip, not on the volume of the section
+    detector = AudioPatternDetector(audio_clips=[intro, outro], normalized_correlation=True)
+    audio_stream = AudioStream(name="test", audio_stream=io.BufferedReader(io.BytesIO(pcm)),
+                               sample_rate=TARGET_SAMPLE_RATE)
+    scores = [score for _, _, score in detector.iter_detections(audio_stream)]
+    assert len(scores) == 4
+    assert np.ptp(scores) < 0.01
+
+
+def test_fingerprint_index_same_as_full_search():
+    intro = make_clip("intro", 3.4, 1)
+    outro = make_clip("outro", 1.7, 2)
+    jingle = make_clip("jingle", 2.5, 3)
+    pcm = make_pcm([intro, outro, intro, jingle, outro], [10, 59.5, 130, 179.9, 239], 300.5)
+
+    expected_peak_times, total_time = find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro, outro, jingle]),
+                                                        pcm)
+    # jingle is not in the index and is correlated with every section,
+    # max_coverage 0 always falls back to the full correlation
+    for fingerprint_index in [FingerprintIndex.from_clips([intro, outro]),
+                              FingerprintIndex.from_clips([intro, outro], max_coverage=0)]:
+        peak_times, fingerprint_total_time, stats = find_in_pcm_bytes(
+            AudioPatternDetector(audio_clips=[intro, outro, jingle], fingerprint_index=fingerprint_index,
+                                 collect_stats=True), pcm)
+        assert fingerprint_total_time == total_time
+        for clip_name, clip_peak_times in expected_peak_times.items():
+            np.testing.assert_allclose(peak_times[clip_name], clip_peak_times, atol=1e-6)
+        assert stats.stage_seconds["fingerprint"] > 0
+
+
+def test_fingerprint_index_with_changed_clip():
+    intro = make_clip("intro", 3.4, 1)
+    fingerprint_index = FingerprintIndex.from_clips([make_clip("intro", 3.4, 2)])
+    pcm = make_pcm([intro], [10], 120)
+    peak_times, _ = find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro], fingerprint_index=fingerprint_index),
+                                      pcm)
+    np.testing.assert_allclose(peak_times["intro"], [10], atol=0.01)
+
+
+def test_track_tones_same_as_correlation(tmp_path):
+    t = np.arange(int(0.25 * TARGET_SAMPLE_RATE)) / TARGET_SAMPLE_RATE
+    beep = AudioClip(name="beep", audio=(0.3 * np.sin(2 * np.pi * 1040 * t)).astype(np.float32),
+                     sample_rate=TARGET_SAMPLE_RATE)
+    intro = make_clip("intro", 3.4, 1)
+    pcm = make_pcm([beep, intro, beep, beep], [30, 70, 119.9, 200.5], 240.5)
+    pcm_file = tmp_path / "test.pcm"
+    pcm_file.write_bytes(pcm)
+
+    expected, _ = find_in_pcm_bytes(AudioPatternDetector(audio_clips=[beep, intro]), pcm)
+    peak_times, _, stats = find_in_pcm_bytes(AudioPatternDetector(audio_clips=[beep, intro], track_tones=True,
+                                                                  collect_stats=True), pcm)
+    np.testing.assert_allclose(peak_times["beep"], [30, 119.9, 200.5], atol=0.02)
+    assert peak_times["intro"] == expected["intro"]
+    assert stats.clips["beep"].passed == 3
+    assert stats.stage_seconds["track_tones"] > 0
+
+    # segments start with the previous chunk, so a tone across segments is found once
+    detector = AudioPatternDetector(audio_clips=[beep], track_tones=True)
+    sequential, _ = detector.find_clip_in_pcm_file(str(pcm_file), jobs=1)
+    np.testing.assert_allclose(sequential["beep"], [30, 119.9, 200.5], atol=0.02)
+    assert detector.find_clip_in_pcm_file(str(pcm_file), jobs=2)[0] == sequential
+
+
+def test_track_tones_at_end_of_audio(tmp_path):
+    t = np.arange(int(0.25 * TARGET_SAMPLE_RATE)) / TARGET_SAMPLE_RATE
+    beep = AudioClip(name="beep", audio=(0.3 * np.sin(2 * np.pi * 1040 * t)).astype(np.float32),
+                     sample_rate=TARGET_SAMPLE_RATE)
+    # the last beep ends with the audio, in the middle of a block
+    total_seconds = 150.2255
+    pcm = make_pcm([beep, beep], [30, total_seconds - 0.25], total_seconds)
+    pcm_file = tmp_path / "test.pcm"
+    pcm_file.write_bytes(pcm)
+    expected_peak_times = [30, total_seconds - 0.25]
+
+    detector = AudioPatternDetector(audio_clips=[beep], track_tones=True)
+    peak_times, _ = find_in_pcm_bytes(detector, pcm)
+    np.testing.assert_allclose(peak_times["beep"], expected_peak_times, atol=0.02)
+    audio_stream = AudioStream(name="test", audio_stream=io.BufferedReader(io.BytesIO(pcm)),
+                               sample_rate=TARGET_SAMPLE_RATE)
+    np.testing.assert_allclose([peak_time for _, peak_time, _ in detector.iter_detections(audio_stream)],
+                               expected_peak_times, atol=0.02)
+    # only the last segment ends with the audio
+    for jobs in [1, 2]:
+        np.testing.assert_allclose(detector.find_clip_in_pcm_file(str(pcm_file), jobs=jobs)[0]["beep"],
+                                   expected_peak_times, atol=0.02)
+
+
+def test_find_clip_in_pcm_file_same_as_sequential(tmp_path):
+    intro = make_clip("intro", 3.4, 1)
+    outro = make_clip("outro", 1.7, 2)
+    pcm = make_pcm([intro, outro, intro, outro], [10, 59.5, 130, 239], 300.5)
+    pcm_file = tmp_path / "test.pcm"
+    pcm_file.write_bytes(pcm)
+
+    expected = find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro, outro]), pcm)
+    result = AudioPatternDetector(audio_clips=[intro, outro]).find_clip_in_pcm_file(str(pcm_file), jobs=2)
+    assert result == expected
+
+
+def test_collect_stats(tmp_path):
+    intro = make_clip("intro", 3.4, 1)
+    pcm = make_pcm([intro, intro], [10, 130], 200.5)
+    pcm_file = tmp_path / "test.pcm"
+    pcm_file.write_bytes(pcm)
+
+    peak_times, total_time, stats = find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro], collect_stats=True),
+                                                      pcm)
+    np.testing.assert_allclose(peak_times["intro"], [10, 130], atol=0.01)
+    assert stats.bytes_processed == len(pcm)
+    assert stats.chunks_processed == 4
+    clip_stats = stats.clips["intro"]
+    assert clip_stats.passed == 2
+    assert clip_stats.candidates == clip_stats.passed + sum(clip_stats.failed.values())
+    for stage in ["read", "convert", "loudness", "correlate", "find_peaks", "verify_normal"]:
+        assert stats.stage_seconds[stage] > 0
+
+    # stats added up from the segments are the same apart from timings
+    _, _, parallel_stats = AudioPatternDetector(audio_clips=[intro], collect_stats=True).find_clip_in_pcm_file(
+        str(pcm_file), jobs=2)
+    assert parallel_stats.to_dict()["clips"] == stats.to_dict()["clips"]
+    assert parallel_stats.bytes_processed == stats.bytes_processed
+
+
+def test_detector_with_cache_same_as_without(tmp_path):
+    intro = make_clip("intro", 3.4, 1)
+    outro = make_clip("outro", 1.7, 2)
+    pcm = make_pcm([intro, outro, intro], [10, 59.5, 130], 200.5)
+
+    expected = find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro, outro]), pcm)
+
+    cache = ClipArtifactCache(str(tmp_path))
+    # first one prepares the clips and fills the cache, second one loads them
+    assert find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro, outro], clip_artifact_cache=cache),
+                             pcm) == expected
+    # clip artifacts and spectra for both clips
+    assert len(list(tmp_path.glob("*.npz"))) == 4
+    assert find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro, outro], clip_artifact_cache=cache),
+                             pcm) == expected
+
+    # truncated entries on disk are prepared again instead of failing the run
+    for path in tmp_path.glob("*.npz"):
+        path.write_bytes(path.read_bytes()[:100])
+    assert find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro, outro], clip_artifact_cache=cache),
+                             pcm) == expected
+    assert find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro, outro], clip_artifact_cache=cache),
+                             pcm) == expected
+
+
+def test_find_clip_in_memmap_source_same_as_stream(tmp_path):
+    intro = make_clip("intro", 3.4, 1)
+    outro = make_clip("outro", 1.7, 2)
+    pcm = make_pcm([intro, outro, intro], [10, 59.5, 130], 200.5)
+    pcm_file = tmp_path / "test.pcm"
+    pcm_file.write_bytes(pcm)
+
+    expected = find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro, outro]), pcm)
+    result = AudioPatternDetector(audio_clips=[intro, outro]).find_clip_in_audio(
+        MemmapAudioSource.from_pcm_file(str(pcm_file)))
+    assert result == expected
+
+
+def test_iter_detections_same_as_find_clip_in_audio():
+    intro = make_clip("intro", 3.4, 1)
+    outro = make_clip("outro", 1.7, 2)
+    pcm = make_pcm([intro, outro, intro], [10, 59.5, 130], 200.5)
+    peak_times, _ = find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro, outro]), pcm)
+
+    audio_stream = AudioStream(name="test", audio_stream=io.BufferedReader(io.BytesIO(pcm)),
+                               sample_rate=TARGET_SAMPLE_RATE)
+    detections = list(AudioPatternDetector(audio_clips=[intro, outro]).iter_detections(audio_stream))
+    assert [clip_name for clip_name, _, _ in detections] == ["intro", "outro", "intro"]
+    for clip_name in ["intro", "outro"]:
+        assert [peak_time for name, peak_time, _ in detections if name == clip_name] == peak_times[clip_name]
+    for _, _, score in detections:
+        assert 0.25 <= score <= 1
+
+
+def test_iter_detections_stops_reading_when_not_iterated():
+    intro = make_clip("intro", 3.4, 1)
+    pcm = make_pcm([intro, intro], [10, 130], 200.5)
+    stdout = io.BufferedReader(io.BytesIO(pcm))
+    audio_stream = AudioStream(name="test", audio_stream=stdout, sample_rate=TARGET_SAMPLE_RATE)
+
+    clip_name, peak_time, _ = next(AudioPatternDetector(audio_clips=[intro]).iter_detections(audio_stream))
+    assert clip_name == "intro"
+    np.testing.assert_allclose(peak_time, 10, atol=0.01)
+    # only the first chunk was read
+    assert stdout.tell() == 60 * TARGET_SAMPLE_RATE * 2
+
+
+def test_max_matches_per_clip_stops_reading():
+    intro = make_clip("intro", 3.4, 1)
+    outro = make_clip("outro", 1.7, 2)
+    pcm = make_pcm([intro, outro, intro, outro], [10, 59.5, 130, 239], 300.5)
+    stdout = io.BufferedReader(io.BytesIO(pcm))
+    audio_stream = AudioStream(name="test", audio_stream=stdout, sample_rate=TARGET_SAMPLE_RATE)
+
+    detector = AudioPatternDetector(audio_clips=[intro, outro], max_matches_per_clip=1)
+    peak_times, total_time = detector.find_clip_in_audio(audio_stream)
+    np.testing.assert_allclose(peak_times["intro"], [10], atol=0.01)
+    np.testing.assert_allclose(peak_times["outro"], [59.5], atol=0.01)
+    # outro across the first two chunks is found in the second one
+    assert total_time == 120
+    assert stdout.tell() == 120 * TARGET_SAMPLE_RATE * 2
+
+
+def test_max_seconds_stops_reading():
+    intro = make_clip("intro", 3.4, 1)
+    # the last one starts within max_seconds but ends after it
+    pcm = make_pcm([intro, intro, intro], [10, 130, 178], 300.5)
+    stdout = io.BufferedReader(io.BytesIO(pcm))
+    audio_stream = AudioStream(name="test", audio_stream=stdout, sample_rate=TARGET_SAMPLE_RATE)
+
+    peak_times, total_time = AudioPatternDetector(audio_clips=[intro], max_seconds=179).find_clip_in_audio(
+        audio_stream)
+    np.testing.assert_allclose(peak_times["intro"], [10, 130, 178], atol=0.01)
+    assert total_time == 240
+
+
+def test_limits_in_pcm_file_same_as_sequential(tmp_path):
+    intro = make_clip("intro", 3.4, 1)
+    pcm = make_pcm([intro, intro, intro, intro], [10, 70, 130, 239], 300.5)
+    pcm_file = tmp_path / "test.pcm"
+    pcm_file.write_bytes(pcm)
+
+    for options in [{"max_matches_per_clip": 2}, {"max_seconds": 100}]:
+        expected, _ = find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro], **options), pcm)
+        assert len(expected["intro"]) == 2
+        peak_times, _ = AudioPatternDetector(audio_clips=[intro], **options).find_clip_in_pcm_file(str(pcm_file),
+                                                                                                  jobs=2)
+        assert peak_times == expected
+
+
+def test_max_matches_per_clip_in_pcm_file_cancels_segments(tmp_path):
+    intro = make_clip("intro", 3.4, 1)
+    pcm = make_pcm([intro, intro], [10, 1000], 1200)
+    pcm_file = tmp_path / "test.pcm"
+    pcm_file.write_bytes(pcm)
+
+    detector = AudioPatternDetector(audio_clips=[intro], max_matches_per_clip=1)
+    expected = find_in_pcm_bytes(detector, pcm)
+    assert expected == ({"intro": [pytest.approx(10, abs=0.01)]}, 60)
+    # the first segment has the match, the segments after it are not added up
+    assert detector.find_clip_in_pcm_file(str(pcm_file), jobs=2) == expected
+
+
+def test_invalid_limits():
+    intro = make_clip("intro", 3.4, 1)
+    with pytest.raises(ValueError):
+        AudioPatternDetector(audio_clips=[intro], max_matches_per_clip=0)
+    with pytest.raises(ValueError):
+        AudioPatternDetector(audio_clips=[intro], max_seconds=0)
+
+
+def test_ffmpeg_stopped_after_first_match(tmp_path, monkeypatch):
+    intro = make_clip("intro", 3.4, 1)
+    pcm_file = tmp_path / "test.pcm"
+    pcm_file.write_bytes(make_pcm([intro], [10], 60))
+    # stands in for ffmpeg decoding a very long file, writes the same minute forever
+    script = ("import sys\n"
+              f"data = open({str(pcm_file)!r}, 'rb').read()\n"
+              "while True:\n"
+              "    sys.stdout.buffer.write(data)\n")
+    monkeypatch.setattr(audio_utils, "_get_ffmpeg_16bit_pcm_command",
+                        lambda *args, **kwargs: [sys.executable, "-c", script])
+
+    detector = AudioPatternDetector(audio_clips=[intro], max_matches_per_clip=1)
+    with ffmpeg_get_16bit_pcm("endless.m4a", target_sample_rate=TARGET_SAMPLE_RATE, ac=1) as stdout:
+        audio_stream = AudioStream(name="test", audio_stream=stdout, sample_rate=TARGET_SAMPLE_RATE)
+        peak_times, _ = detector.find_clip_in_audio(audio_stream)
+    np.testing.assert_allclose(peak_times["intro"], [10], atol=0.01)
+
+
+def test_time_range_same_for_memmap_stream_and_pcm_file(tmp_path):
+    intro = make_clip("intro", 3.4, 1)
+    pcm = make_pcm([intro, intro, intro, intro], [10, 130, 190, 250], 300.5)
+    pcm_file = tmp_path / "test.pcm"
+    pcm_file.write_bytes(pcm)
+    detector = AudioPatternDetector(audio_clips=[intro])
+
+    peak_times, total_time = detector.find_clip_in_audio(MemmapAudioSource.from_pcm_file(str(pcm_file)),
+                                                         start_seconds=100.5, end_seconds=200)
+    # still from the beginning of the audio
+    np.testing.assert_allclose(peak_times["intro"], [130, 190], atol=0.01)
+    assert total_time == 99.5
+
+    # like ffmpeg seeking to start_seconds, the stream only has the audio from there
+    start = int(100.5 * TARGET_SAMPLE_RATE) * 2
+    audio_stream = AudioStream(name="test", audio_stream=io.BufferedReader(io.BytesIO(pcm[start:])),
+                               sample_rate=TARGET_SAMPLE_RATE)
+    assert detector.find_clip_in_audio(audio_stream, start_seconds=100.5, end_seconds=200) == (peak_times, total_time)
+
+    assert detector.find_clip_in_pcm_file(str(pcm_file), jobs=1, start_seconds=100.5,
+                                          end_seconds=200) == (peak_times, total_time)
+    assert detector.find_clip_in_pcm_file(str(pcm_file), jobs=2, start_seconds=100.5,
+                                          end_seconds=200) == (peak_times, total_time)
+
+
+def test_invalid_time_range():
+    intro = make_clip("intro", 3.4, 1)
+    detector = AudioPatternDetector(audio_clips=[intro])
+    audio_stream = AudioStream(name="test", audio_stream=io.BufferedReader(io.BytesIO(b"")),
+                               sample_rate=TARGET_SAMPLE_RATE)
+    with pytest.raises(ValueError):
+        detector.find_clip_in_audio(audio_stream, start_seconds=-1)
+    with pytest.raises(ValueError):
+        detector.find_clip_in_audio(audio_stream, start_seconds=100, end_seconds=50)
+
+
+def test_ffmpeg_seeks_input():
+    command = audio_utils._get_ffmpeg_16bit_pcm_command("show.m4a", target_sample_rate=TARGET_SAMPLE_RATE, ac=1,
+                                                         start_seconds=600, end_seconds=1200.5)
+    # before -i so that ffmpeg seeks the input instead of decoding and dropping the audio before it
+    assert command[:6] == ["ffmpeg", "-ss", "600", "-to", "1200.5", "-i"]
+
+
+async def detect_in_pcm_bytes(detector, pcm, feed_size=12345):
+    reader = asyncio.StreamReader()
+
+    async def feed():
+        # arrives in pieces like a live stream
+        for start in range(0, len(pcm), feed_size):
+            reader.feed_data(pcm[start:start + feed_size])
+            await asyncio.sleep(0)
+        reader.feed_eof()
+
+    feed_task = asyncio.create_task(feed())
+    detections = [detection async for detection in detector.detect_stream(reader)]
+    await feed_task
+    return detections
+
+
+def test_detect_stream_same_as_find_clip_in_audio():
+    intro = make_clip("intro", 3.4, 1)
+    outro = make_clip("outro", 1.7, 2)
+    pcm = make_pcm([intro, outro, intro], [10, 59.5, 130], 200.5)
+    peak_times, _ = find_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro, outro]), pcm)
+
+    detections = asyncio.run(detect_in_pcm_bytes(AudioPatternDetector(audio_clips=[intro, outro]), pcm))
+    assert [clip_name for clip_name, _, _ in detections] == ["intro", "outro", "intro"]
+    for clip_name in ["intro", "outro"]:
+        assert [peak_time for name, peak_time, _ in detections if name == clip_name] == peak_times[clip_name]
+
+
+def test_detect_stream_many_streams_one_detector():
+    intro = make_clip("intro", 3.4, 1)
+    detector = AudioPatternDetector(audio_clips=[intro])
+    pcms = [make_pcm([intro], [seconds], 150) for seconds in [10, 70, 130]]
+
+    async def detect_all():
+        return await asyncio.gather(*[detect_in_pcm_bytes(detector, pcm) for pcm in pcms])
+
+    for detections, seconds in zip(asyncio.run(detect_all()), [10, 70, 130]):
+        assert len(detections) == 1
+        assert detections[0][0] == "intro"
+        np.testing.assert_allclose(detections[0][1], seconds, atol=0.01)
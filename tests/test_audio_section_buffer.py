@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from audio_pattern_detector.audio_section_buffer import AudioSectionBuffer
+
+
+def test_latest_is_end_of_stream():
+    section_buffer = AudioSectionBuffer(8)
+    stream = np.arange(1, 21, dtype=np.float64)
+    chunks = [stream[0:6], stream[6:12], stream[12:18], stream[18:20]]
+    seen = 0
+    for chunk in chunks:
+        section_buffer.append(chunk)
+        seen += len(chunk)
+        available = min(seen, 8)
+        assert section_buffer.num_samples == available
+        np.testing.assert_array_equal(section_buffer.latest(available), stream[seen - available:seen])
+
+
+def test_latest_more_than_available():
+    section_buffer = AudioSectionBuffer(8)
+    section_buffer.append(np.ones(3))
+    with pytest.raises(ValueError):
+        section_buffer.latest(4)
+
+
+def test_scale_keeps_original_samples():
+    section_buffer = AudioSectionBuffer(4)
+    section_buffer.append(np.array([1.0, 2.0, 3.0]))
+    scaled = section_buffer.scale(section_buffer.latest(3), 2.0)
+    np.testing.assert_array_equal(scaled, [2.0, 4.0, 6.0])
+    np.testing.assert_array_equal(section_buffer.latest(3), [1.0, 2.0, 3.0])
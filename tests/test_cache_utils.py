@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+from audio_pattern_detector.cache_utils import atomic_write_path
+
+
+def test_atomic_write_path_replaces(tmp_path):
+    path = tmp_path / "entry.bin"
+    path.write_bytes(b"old")
+    with atomic_write_path(str(path)) as tmp:
+        with open(tmp, "wb") as f:
+            f.write(b"new")
+        # not visible until the block finishes
+        assert path.read_bytes() == b"old"
+    assert path.read_bytes() == b"new"
+    assert os.listdir(tmp_path) == ["entry.bin"]
+
+
+def test_atomic_write_path_removes_temporary_file_on_error(tmp_path):
+    path = tmp_path / "entry.bin"
+    with pytest.raises(RuntimeError):
+        with atomic_write_path(str(path)) as tmp:
+            with open(tmp, "wb") as f:
+                f.write(b"partial")
+            raise RuntimeError("failed")
+    assert os.listdir(tmp_path) == []
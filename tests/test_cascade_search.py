@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from scipy.signal import correlate
+
+from audio_pattern_detector.cascade_search import CascadeSettings, decimate, get_candidate_ranges, merge_ranges, \
+    is_in_ranges, correlate_in_ranges
+
+
+def test_decimate():
+    audio = np.arange(10, dtype=np.float32)
+    np.testing.assert_allclose(decimate(audio, 4), [1.5, 5.5])
+
+
+def test_merge_ranges():
+    assert merge_ranges([(10, 20), (0, 5), (15, 30), (40, 40), (30, 35)]) == [(0, 5), (10, 35)]
+
+
+def test_is_in_ranges():
+    mask = is_in_ranges([0, 5, 9, 10, 25, 35], [(5, 10), (20, 30)])
+    np.testing.assert_array_equal(mask, [False, True, True, False, True, False])
+    assert not is_in_ranges([1], []).any()
+
+
+@pytest.mark.parametrize("ranges", [[(0, 50)], [(100, 300), (900, 1099)], [(500, 600)]])
+def test_correlate_in_ranges_same_as_full(ranges):
+    rng = np.random.default_rng(0)
+    audio = rng.standard_normal(1000)
+    clip = rng.standard_normal(100)
+    expected = correlate(audio, clip, mode='full')
+    correlation = correlate_in_ranges(audio, clip, ranges)
+    assert len(correlation) == len(expected)
+    mask = is_in_ranges(np.arange(len(correlation)), ranges)
+    np.testing.assert_allclose(correlation[mask], expected[mask], atol=1e-9)
+    assert not correlation[~mask].any()
+
+
+def test_candidate_ranges_have_the_full_rate_peak():
+    rng = np.random.default_rng(1)
+    factor = 4
+    clip = np.convolve(rng.standard_normal(2000), np.ones(8) / 8, mode='same')
+    audio = rng.standard_normal(20000) * 0.05
+    for start in [3001, 12346]:
+        audio[start:start + len(clip)] += clip
+    correlation_length = len(audio) + len(clip) - 1
+
+    coarse_clip = decimate(clip, factor)
+    coarse_correlation = np.abs(correlate(decimate(audio, factor), coarse_clip, mode='full'))
+    coarse_peaks = np.sort(np.argsort(coarse_correlation)[-2:])
+    ranges = get_candidate_ranges(coarse_peaks, factor, len(coarse_clip), len(clip), 2 * factor, correlation_length)
+
+    # full mode index of the clip ending at the last inserted sample
+    assert is_in_ranges([3001 + len(clip) - 1, 12346 + len(clip) - 1], ranges).all()
+
+
+def test_invalid_settings():
+    with pytest.raises(ValueError):
+        CascadeSettings(decimation=1)
+    with pytest.raises(ValueError):
+        CascadeSettings(threshold=0)
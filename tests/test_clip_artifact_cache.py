@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+
+from audio_pattern_detector.clip_artifact_cache import ClipArtifactCache
+
+
+def test_put_and_get(tmp_path):
+    cache = ClipArtifactCache(str(tmp_path))
+    key = cache.get_key("clip", np.arange(5, dtype=np.float32), 8000)
+    assert cache.get(key) is None
+    cache.put(key, {"clip": np.arange(5, dtype=np.float32), "flag": np.asarray(True)})
+    arrays = cache.get(key)
+    np.testing.assert_array_equal(arrays["clip"], np.arange(5, dtype=np.float32))
+    assert arrays["clip"].dtype == np.float32
+    assert bool(arrays["flag"])
+
+
+def test_key_depends_on_content_and_dtype():
+    key = ClipArtifactCache.get_key("clip", np.zeros(4, dtype=np.float32), 8000)
+    assert key == ClipArtifactCache.get_key("clip", np.zeros(4, dtype=np.float32), 8000)
+    assert key != ClipArtifactCache.get_key("clip", np.zeros(4, dtype=np.float64), 8000)
+    assert key != ClipArtifactCache.get_key("clip", np.ones(4, dtype=np.float32), 8000)
+    assert key != ClipArtifactCache.get_key("clip", np.zeros(4, dtype=np.float32), 16000)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ClipArtifactCache(str(tmp_path), max_bytes=15000)
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, {"data": np.zeros(500)})
+        os.utime(tmp_path / f"{key}.npz", (i, i))
+    # reading a marks it as used after b and c
+    assert cache.get("a") is not None
+    # 4 entries of about 4 kb don't fit in 15 kb
+    cache.put("d", {"data": np.zeros(500)})
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a.npz", "c.npz", "d.npz"]
+
+
+
+def test_corrupted_or_incomplete_entry_is_a_miss(tmp_path):
+    cache = ClipArtifactCache(str(tmp_path))
+    cache.put("a", {"clip": np.zeros(500), "flag": np.asarray(True)})
+    path = tmp_path / "a.npz"
+    # cut short like a write that didn't finish
+    path.write_bytes(path.read_bytes()[:100])
+    assert cache.get("a") is None
+    path.write_bytes(b"not a zip file")
+    assert cache.get("a") is None
+
+    # written by a version without flag
+    cache.put("b", {"clip": np.zeros(500)})
+    assert cache.get("b", required=("clip", "flag")) is None
+    assert cache.get("b", required=("clip",)) is not None
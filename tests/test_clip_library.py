@@ -0,0 +1,59 @@
+import json
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from audio_pattern_detector.clip_library import get_clip_entries_from_folder, get_clip_entries_from_manifest, \
+    load_clip_library
+
+
+def write_clip(path, seconds=1, sample_rate=8000):
+    audio = np.sin(np.arange(int(seconds * sample_rate)) / sample_rate * 2 * np.pi * 440) * 0.5
+    sf.write(path, audio, sample_rate, subtype='PCM_16')
+    return str(path)
+
+
+def test_load_folder(tmp_path):
+    write_clip(tmp_path / "outro.wav")
+    write_clip(tmp_path / "intro.wav", seconds=2)
+    (tmp_path / "notes.txt").write_text("not a clip")
+
+    clips = load_clip_library(get_clip_entries_from_folder(str(tmp_path)))
+    assert [clip.name for clip in clips] == ["intro", "outro"]
+    assert len(clips[0].audio) == 16000
+    assert all(clip.sample_rate == 8000 for clip in clips)
+
+
+def test_load_manifest_with_names(tmp_path):
+    (tmp_path / "clips").mkdir()
+    write_clip(tmp_path / "clips" / "intro.wav")
+    write_clip(tmp_path / "clips" / "beep.wav")
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps(["clips/intro.wav", {"path": "clips/beep.wav", "name": "news_beep"}]))
+
+    clips = load_clip_library(get_clip_entries_from_manifest(str(manifest)))
+    assert [clip.name for clip in clips] == ["intro", "news_beep"]
+
+
+def test_all_problems_reported_up_front(tmp_path):
+    (tmp_path / "a").mkdir()
+    entries = [("intro", write_clip(tmp_path / "intro.wav")),
+               ("intro", write_clip(tmp_path / "a" / "intro.wav")),
+               ("missing", str(tmp_path / "missing.wav"))]
+    with pytest.raises(ValueError) as excinfo:
+        load_clip_library(entries)
+    assert "intro needs to be unique" in str(excinfo.value)
+    assert "missing.wav does not exist" in str(excinfo.value)
+
+
+def test_wrong_sample_rate(tmp_path):
+    entries = [("intro", write_clip(tmp_path / "intro.wav")),
+               ("outro", write_clip(tmp_path / "outro.wav", sample_rate=16000))]
+    with pytest.raises(ValueError, match="outro"):
+        load_clip_library(entries)
+
+
+def test_empty_library(tmp_path):
+    with pytest.raises(ValueError):
+        load_clip_library(get_clip_entries_from_folder(str(tmp_path)))
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from scipy.signal import correlate
+
+from audio_pattern_detector.correlation_utils import get_fft_size, get_clip_spectrum, correlate_with_clip_spectrum, \
+    get_clip_spectra, correlate_with_clip_spectra, get_energy_sums, get_normalized_correlation
+
+
+def test_correlate_with_clip_spectrum_same_as_scipy():
+    rng = np.random.default_rng(1)
+    clip = rng.standard_normal(300)
+    fft_size = get_fft_size(2000, len(clip))
+    clip_spectrum = get_clip_spectrum(clip, fft_size)
+    # reused for sections of different lengths like first and last chunk
+    for section_length in [2000, 1500, 301]:
+        audio_section = rng.standard_normal(section_length)
+        expected = correlate(audio_section, clip, mode='full', method='fft')
+        result = correlate_with_clip_spectrum(audio_section, clip_spectrum, len(clip), fft_size)
+        assert len(result) == len(expected)
+        np.testing.assert_allclose(result, expected, atol=1e-9)
+
+
+def test_correlate_with_clip_spectrum_section_too_long():
+    clip = np.ones(10)
+    fft_size = get_fft_size(100, len(clip))
+    clip_spectrum = get_clip_spectrum(clip, fft_size)
+    with pytest.raises(ValueError):
+        correlate_with_clip_spectrum(np.ones(fft_size), clip_spectrum, len(clip), fft_size)
+
+
+def test_correlate_with_clip_spectra_same_as_scipy():
+    rng = np.random.default_rng(2)
+    clips = [rng.standard_normal(length) for length in [300, 120, 250]]
+    fft_size = get_fft_size(2000, max(len(clip) for clip in clips))
+    clip_spectra = get_clip_spectra(clips, fft_size)
+    audio_section = rng.standard_normal(1800)
+    results = correlate_with_clip_spectra(audio_section, clip_spectra, [len(clip) for clip in clips], fft_size)
+    assert len(results) == len(clips)
+    for clip, result in zip(clips, results):
+        expected = correlate(audio_section, clip, mode='full', method='fft')
+        assert len(result) == len(expected)
+        np.testing.assert_allclose(result, expected, atol=1e-9)
+
+
+def test_correlate_with_clip_spectra_float32():
+    rng = np.random.default_rng(3)
+    clips = [rng.standard_normal(length) for length in [300, 120]]
+    fft_size = get_fft_size(2000, 300)
+    audio_section = rng.standard_normal(1800)
+    expected = correlate_with_clip_spectra(audio_section, get_clip_spectra(clips, fft_size), [300, 120], fft_size)
+
+    clip_spectra = get_clip_spectra(clips, fft_size, np.float32)
+    assert clip_spectra.dtype == np.complex64
+    results = correlate_with_clip_spectra(audio_section.astype(np.float32), clip_spectra, [300, 120], fft_size)
+    for result, expected_result in zip(results, expected):
+        # stays in single precision, within float32 rounding of the largest value
+        assert result.dtype == np.float32
+        np.testing.assert_allclose(result, expected_result, atol=1e-5 * np.max(np.abs(expected_result)))
+
+
+def test_normalized_correlation_same_as_brute_force():
+    rng = np.random.default_rng(4)
+    clip = rng.standard_normal(300)
+    audio_section = rng.standard_normal(2000)
+    # silence, and the clip at a different volume
+    audio_section[500:1000] = 0
+    audio_section[1200:1500] = clip * 0.01
+    correlation = correlate(audio_section, clip, mode='full', method='fft')
+    normalized = get_normalized_correlation(correlation, get_energy_sums(audio_section), np.dot(clip, clip),
+                                            len(clip) * 1e-8)
+    assert len(normalized) == len(correlation)
+
+    expected = np.zeros(len(correlation))
+    for end in range(len(clip) - 1, len(audio_section)):
+        window = audio_section[end - len(clip) + 1:end + 1]
+        if np.dot(window, window) >= len(clip) * 1e-8:
+            expected[end] = abs(np.dot(window, clip)) / np.sqrt(np.dot(window, window) * np.dot(clip, clip))
+    np.testing.assert_allclose(normalized, expected, atol=1e-9)
+    assert np.argmax(normalized) == 1499
+    assert normalized[1499] == pytest.approx(1)
+    # the clip is not completely within the section
+    assert not np.any(normalized[:len(clip) - 1])
+    assert not np.any(normalized[len(audio_section):])
+    assert not np.any(normalized[800:1000])
+
+
+def test_normalized_correlation_section_shorter_than_clip():
+    clip = np.ones(300)
+    audio_section = np.ones(200)
+    correlation = correlate(audio_section, clip, mode='full', method='fft').astype(np.float32)
+    normalized = get_normalized_correlation(correlation, get_energy_sums(audio_section), 300, 300 * 1e-8)
+    assert normalized.dtype == np.float32
+    assert not np.any(normalized)
@@ -0,0 +1,28 @@
+import numpy as np
+from sklearn.metrics import mean_squared_error
+
+from audio_pattern_detector.detection_utils import area_of_overlap_ratio, area_of_overlap_ratio_batch, \
+    partitioned_mean_squared_error
+
+
+def test_area_of_overlap_ratio_batch_same_as_single():
+    rng = np.random.default_rng(0)
+    control = rng.random(101)
+    variables = rng.random((3, 101))
+    result = area_of_overlap_ratio_batch(control, variables)
+    for i, variable in enumerate(variables):
+        expected = area_of_overlap_ratio(control, variable)
+        for key, value in expected.items():
+            np.testing.assert_allclose(np.broadcast_to(result[key], (3,))[i], value)
+
+
+def test_partitioned_mean_squared_error_same_as_sklearn():
+    rng = np.random.default_rng(1)
+    control = rng.random(1003)
+    variables = rng.random((2, 1003))
+    result = partitioned_mean_squared_error(control, variables, 10)
+    assert result.shape == (2, 10)
+    for i, variable in enumerate(variables):
+        for j in range(10):
+            expected = mean_squared_error(control[j * 100:(j + 1) * 100], variable[j * 100:(j + 1) * 100])
+            np.testing.assert_allclose(result[i, j], expected)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from audio_pattern_detector.audio_utils import downsample_preserve_maxima, downsample_preserve_maxima_batch
+
+
+# the original loop implementation
+def downsample_preserve_maxima_loop(curve, num_samples):
+    n_points = len(curve)
+    step_size = n_points / num_samples
+    compressed_curve = []
+    for i in range(num_samples):
+        start_index = int(i * step_size)
+        end_index = int((i + 1) * step_size)
+        if start_index >= n_points:
+            break
+        window = curve[start_index:end_index]
+        if len(window) == 0:
+            continue
+        compressed_curve.append(np.max(window))
+    if len(compressed_curve) < num_samples and len(curve) > 0:
+        compressed_curve.append(curve[-1])
+    return np.array(compressed_curve)
+
+
+def test_downsample_same_as_loop():
+    rng = np.random.default_rng(0)
+    for n_points in [101, 150, 3661, 3662, 4655]:
+        curve = rng.standard_normal(n_points)
+        np.testing.assert_array_equal(downsample_preserve_maxima(curve, 101),
+                                      downsample_preserve_maxima_loop(curve, 101))
+
+
+def test_downsample_shorter_than_num_samples():
+    curve = np.array([1, 5, 2, 4])
+    np.testing.assert_array_equal(downsample_preserve_maxima(curve, 5), [1, 5, 2, 4, 4])
+
+
+def test_downsample_too_short():
+    with pytest.raises(ValueError):
+        downsample_preserve_maxima(np.array([1, 2, 3]), 5)
+
+
+def test_downsample_batch():
+    rng = np.random.default_rng(1)
+    curves = rng.standard_normal((4, 3661))
+    result = downsample_preserve_maxima_batch(curves, 101)
+    assert result.shape == (4, 101)
+    for curve, row in zip(curves, result):
+        np.testing.assert_array_equal(row, downsample_preserve_maxima_loop(curve, 101))
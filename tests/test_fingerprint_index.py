@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from audio_pattern_detector.audio_clip import AudioClip
+from audio_pattern_detector.audio_utils import TARGET_SAMPLE_RATE
+from audio_pattern_detector.fingerprint_index import FingerprintIndex, OFFSET_TOLERANCE
+
+from audio_helpers import make_clip, make_audio
+
+sr = TARGET_SAMPLE_RATE
+
+
+def assert_starts(clip_starts, expected_starts):
+    assert len(clip_starts) > 0
+    for start in clip_starts:
+        assert min(abs(start - expected) for expected in expected_starts) <= OFFSET_TOLERANCE
+    for expected in expected_starts:
+        assert min(abs(start - expected) for start in clip_starts) <= OFFSET_TOLERANCE
+
+
+@pytest.fixture
+def clips():
+    return [make_clip("intro", 3.4, 1), make_clip("outro", 1.7, 2), make_clip("jingle", 2.5, 3)]
+
+
+# not aligned to the frames, and at half the loudness
+@pytest.mark.parametrize("gain", [1.0, 0.5])
+def test_lookup(clips, gain):
+    intro, outro, jingle = clips
+    index = FingerprintIndex.from_clips(clips)
+    audio = make_audio([intro.audio, outro.audio, intro.audio], [10 * sr + 37, 30 * sr + 101, 45 * sr + 203], 60, gain)
+
+    clip_starts = index.lookup(audio)
+    assert_starts(clip_starts["intro"], [10 * sr + 37, 45 * sr + 203])
+    assert_starts(clip_starts["outro"], [30 * sr + 101])
+    assert len(clip_starts["jingle"]) == 0
+
+    # only the clips asked for
+    assert list(index.lookup(audio, ["outro"])) == ["outro"]
+
+
+def test_clip_starting_before_audio(clips):
+    intro = clips[0]
+    index = FingerprintIndex.from_clips(clips)
+    audio = make_audio([intro.audio], [10 * sr], 60)
+    assert_starts(index.lookup(audio[11 * sr:])["intro"], [-sr])
+
+
+def test_add_and_remove(clips):
+    intro, outro, jingle = clips
+    index = FingerprintIndex.from_clips([intro])
+    audio = make_audio([outro.audio], [20 * sr], 30)
+    assert index.lookup(audio, ["outro"])["outro"].size == 0
+
+    assert index.add_clip(outro) > index.min_votes
+    assert index.is_indexed(outro)
+    assert_starts(index.lookup(audio)["outro"], [20 * sr])
+
+    index.remove_clip("outro")
+    assert "outro" not in index
+    assert index.lookup(audio, ["outro"])["outro"].size == 0
+    with pytest.raises(KeyError):
+        index.remove_clip("outro")
+
+
+def test_is_indexed(clips):
+    intro, outro, jingle = clips
+    index = FingerprintIndex.from_clips([intro])
+    assert index.is_indexed(intro)
+    assert not index.is_indexed(outro)
+    # same name with other audio
+    assert not index.is_indexed(AudioClip(name="intro", audio=outro.audio, sample_rate=sr))
+    # silence has no spectral peaks
+    silence = AudioClip(name="silence", audio=np.zeros(sr, dtype=np.float32), sample_rate=sr)
+    assert index.add_clip(silence) == 0
+    assert "silence" in index
+    assert not index.is_indexed(silence)
+
+
+def test_save_and_load(tmp_path, clips):
+    index = FingerprintIndex.from_clips(clips, min_votes=20)
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+
+    loaded = FingerprintIndex.load(path)
+    assert loaded.clip_names == index.clip_names
+    assert loaded.min_votes == 20
+    assert all(loaded.is_indexed(clip) for clip in clips)
+    audio = make_audio([clips[1].audio, clips[2].audio], [5 * sr + 11, 40 * sr], 60)
+    for clip_name, clip_starts in index.lookup(audio).items():
+        np.testing.assert_array_equal(loaded.lookup(audio)[clip_name], clip_starts)
+
+    # incremental changes to a loaded index are saved again
+    loaded.remove_clip("intro")
+    loaded.save(path)
+    assert FingerprintIndex.load(path).clip_names == ["outro", "jingle"]
+
+
+def test_empty_index(tmp_path):
+    index = FingerprintIndex()
+    assert index.lookup(make_audio([], [], 10)) == {}
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+    assert len(FingerprintIndex.load(path)) == 0
+
+
+def test_load_other_version(tmp_path, clips):
+    path = str(tmp_path / "index.npz")
+    FingerprintIndex.from_clips(clips).save(path)
+    with np.load(path) as npz:
+        arrays = dict(npz)
+    arrays["version"] = np.asarray(0)
+    np.savez(path, **arrays)
+    with pytest.raises(ValueError):
+        FingerprintIndex.load(path)
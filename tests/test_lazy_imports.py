@@ -0,0 +1,13 @@
+import subprocess
+import sys
+from pathlib import Path
+
+
+# plotting and debug dumping should only be loaded when debug_mode is on
+def test_detector_does_not_import_debug_dependencies():
+    code = "import sys, audio_pattern_detector.audio_pattern_detector; print(' '.join(sorted(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=Path(__file__).parent.parent)
+    modules = set(result.stdout.split())
+    for module in ["matplotlib", "matplotlib.pyplot", "sklearn", "soundfile"]:
+        assert module not in modules, f"{module} is imported on startup"
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from audio_pattern_detector.audio_utils import TARGET_SAMPLE_RATE
+from match import _iter_folder_results, match_patterns
+
+from audio_helpers import make_clip, make_audio, make_pcm
+
+sr = TARGET_SAMPLE_RATE
+
+
+# 8000 Hz 16 bit mono wav files that are memory mapped without ffmpeg, the first one is much longer
+# so that it finishes after the others with two workers
+@pytest.fixture
+def audio_files(tmp_path):
+    intro = make_clip("intro", 3.4, 1)
+    audio_files = []
+    expected = {}
+    for i, (seconds, total_seconds) in enumerate([(100, 300), (10, 30), (20, 30), (5, 30), (15, 30)]):
+        audio_file = str(tmp_path / f"show_{i}.wav")
+        audio = make_audio([intro.audio], [seconds * sr], total_seconds)
+        sf.write(audio_file, np.clip(audio, -1, 1), sr, subtype='PCM_16')
+        audio_files.append(audio_file)
+        expected[audio_file] = seconds
+    return intro, audio_files, expected
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_iter_folder_results_with_workers(audio_files, ordered):
+    intro, audio_files, expected = audio_files
+    results = list(_iter_folder_results(audio_files, [intro], jobs=2, ordered=ordered))
+
+    reported_files = [audio_file for audio_file, _, _, _ in results]
+    # every file exactly once
+    assert sorted(reported_files) == sorted(audio_files)
+    if ordered:
+        assert reported_files == audio_files
+    for audio_file, peak_times, total_time, stats in results:
+        np.testing.assert_allclose(peak_times["intro"], [expected[audio_file]], atol=0.01)
+        assert stats is None
+
+
+def test_iter_folder_results_workers_same_as_sequential(audio_files):
+    intro, audio_files, _ = audio_files
+    sequential = list(_iter_folder_results(audio_files, [intro], jobs=1, ordered=True))
+    assert list(_iter_folder_results(audio_files, [intro], jobs=3, ordered=True)) == sequential
+
+
+def test_match_patterns_upper_case_pcm(tmp_path):
+    intro = make_clip("intro", 3.4, 1)
+    # read as raw pcm like a lower case .pcm file instead of being decoded by ffmpeg
+    pcm_file = tmp_path / "SHOW.PCM"
+    pcm_file.write_bytes(make_pcm([intro], [10], 30))
+    peak_times, total_time = match_patterns(str(pcm_file), [intro])
+    np.testing.assert_allclose(peak_times["intro"], [10], atol=0.01)
+    assert total_time == 30
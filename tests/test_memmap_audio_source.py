@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from audio_pattern_detector.audio_clip import MemmapAudioSource
+from audio_pattern_detector.audio_utils import convert_audio_arr_to_float, convert_audio_arr_to_float_into
+
+
+def test_convert_into_same_as_convert():
+    audio = np.array([-32768, -1, 0, 1, 12345, 32767], dtype="<i2")
+    out = np.full(10, np.nan, dtype=np.float32)
+    result = convert_audio_arr_to_float_into(audio, out)
+    assert result.base is out
+    np.testing.assert_array_equal(result, convert_audio_arr_to_float(audio))
+
+
+def test_from_pcm_file(tmp_path):
+    audio = np.arange(-500, 500, dtype="<i2")
+    pcm_file = tmp_path / "show.pcm"
+    pcm_file.write_bytes(audio.tobytes())
+    source = MemmapAudioSource.from_pcm_file(str(pcm_file))
+    assert source.name == "show"
+    np.testing.assert_array_equal(source.memmap(), audio)
+
+
+def test_empty_pcm_file(tmp_path):
+    pcm_file = tmp_path / "empty.pcm"
+    pcm_file.write_bytes(b"")
+    assert len(MemmapAudioSource.from_pcm_file(str(pcm_file)).memmap()) == 0
+
+
+def test_from_wav_file(tmp_path):
+    audio = np.arange(-500, 500, dtype="<i2")
+    wav_file = str(tmp_path / "show.wav")
+    sf.write(wav_file, audio, 8000, subtype='PCM_16')
+    source = MemmapAudioSource.from_wav_file(wav_file)
+    np.testing.assert_array_equal(source.memmap(), audio)
+    np.testing.assert_array_equal(convert_audio_arr_to_float(source.memmap()), sf.read(wav_file, dtype='float32')[0])
+
+
+@pytest.mark.parametrize("sample_rate,channels,subtype", [(16000, 1, 'PCM_16'), (8000, 2, 'PCM_16'),
+                                                          (8000, 1, 'FLOAT')])
+def test_from_wav_file_wrong_format(tmp_path, sample_rate, channels, subtype):
+    wav_file = str(tmp_path / "show.wav")
+    sf.write(wav_file, np.zeros((100, channels)), sample_rate, subtype=subtype)
+    with pytest.raises(ValueError):
+        MemmapAudioSource.from_wav_file(wav_file)
@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pytest
+
+from audio_pattern_detector import pcm_cache as pcm_cache_module
+from audio_pattern_detector.pcm_cache import PcmCache
+
+
+@pytest.fixture
+def decoded(monkeypatch):
+    # source files are decoded by copying them instead of running ffmpeg, returns the decoded paths
+    decoded_files = []
+
+    def write_16bit_pcm_file(file_path, output_path, sr=None):
+        decoded_files.append(file_path)
+        with open(file_path, 'rb') as src, open(output_path, 'wb') as dst:
+            dst.write(src.read())
+
+    monkeypatch.setattr(pcm_cache_module, "write_16bit_pcm_file", write_16bit_pcm_file)
+    return decoded_files
+
+
+def write_source(path, num_samples):
+    path.write_bytes(np.arange(num_samples, dtype='<i2').tobytes())
+    return str(path)
+
+
+def test_decodes_once(tmp_path, decoded):
+    source = write_source(tmp_path / "show.m4a", 100)
+    cache = PcmCache(str(tmp_path / "cache"))
+
+    pcm_file = cache.get_pcm_file(source)
+    assert cache.get_pcm_file(source) == pcm_file
+    assert decoded == [source]
+    np.testing.assert_array_equal(np.memmap(pcm_file, dtype='<i2', mode='r'), np.arange(100))
+
+
+def test_changed_source_decoded_again(tmp_path, decoded):
+    source = write_source(tmp_path / "show.m4a", 100)
+    cache = PcmCache(str(tmp_path / "cache"))
+
+    pcm_file = cache.get_pcm_file(source)
+    write_source(tmp_path / "show.m4a", 200)
+    os.utime(source, ns=(0, 123))
+    new_pcm_file = cache.get_pcm_file(source)
+    assert new_pcm_file != pcm_file
+    assert len(decoded) == 2
+    assert os.path.getsize(new_pcm_file) == 400
+
+
+def test_evicts_least_recently_used(tmp_path, decoded):
+    sources = [write_source(tmp_path / f"show{i}.m4a", 1000) for i in range(3)]
+    # room for two decoded files of 2000 bytes
+    cache = PcmCache(str(tmp_path / "cache"), max_bytes=4500)
+
+    first = cache.get_pcm_file(sources[0])
+    second = cache.get_pcm_file(sources[1])
+    os.utime(first, (1, 1))
+    os.utime(second, (2, 2))
+    # using the first one again makes the second one the least recently used
+    cache.get_pcm_file(sources[0])
+    third = cache.get_pcm_file(sources[2])
+
+    assert os.path.exists(first)
+    assert not os.path.exists(second)
+    assert os.path.exists(third)
+
+
+def test_keeps_entry_larger_than_cap(tmp_path, decoded):
+    cache = PcmCache(str(tmp_path / "cache"), max_bytes=100)
+    pcm_file = cache.get_pcm_file(write_source(tmp_path / "show.m4a", 1000))
+    assert os.path.exists(pcm_file)
+
+
+def test_failed_decode_leaves_nothing(tmp_path, monkeypatch):
+    def write_16bit_pcm_file(file_path, output_path, sr=None):
+        with open(output_path, 'wb') as f:
+            f.write(b"partial")
+        raise ValueError("ffmpeg command failed with return code 1")
+
+    monkeypatch.setattr(pcm_cache_module, "write_16bit_pcm_file", write_16bit_pcm_file)
+    cache = PcmCache(str(tmp_path / "cache"))
+    with pytest.raises(ValueError):
+        cache.get_pcm_file(write_source(tmp_path / "show.m4a", 100))
+    assert os.listdir(tmp_path / "cache") == []
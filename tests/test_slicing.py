@@ -1,6 +1,7 @@
 import numpy as np
 
-from audio_pattern_detector.audio_utils import slicing_with_zero_padding
+from audio_pattern_detector.audio_utils import slicing_with_zero_padding, get_zero_bordered_array, \
+    get_windows_with_zero_padding
 
 
 def test_slice_odd():
@@ -45,3 +46,11 @@ def test_slice_beg_short_odd():
 
 
 
+def test_windows_with_zero_padding_same_as_slicing():
+    arr = np.array([1, 2, 3, 4, 5], dtype=np.float64)
+    for width in [3, 4, 5, 9]:
+        buffer, array_view = get_zero_bordered_array(len(arr), width)
+        array_view[:] = arr
+        windows = get_windows_with_zero_padding(buffer, width)
+        for middle_index in range(len(arr)):
+            np.testing.assert_array_equal(windows[middle_index], slicing_with_zero_padding(arr, width, middle_index))
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from audio_pattern_detector.audio_utils import TARGET_SAMPLE_RATE
+from audio_pattern_detector.tone_tracker import ToneTracker, get_tone_frequency
+
+from audio_helpers import make_audio
+
+sr = TARGET_SAMPLE_RATE
+
+
+def make_tone(frequency, seconds, amplitude=0.5):
+    t = np.arange(int(seconds * sr)) / sr
+    return amplitude * np.sin(2 * np.pi * frequency * t)
+
+
+def track(tracker, audio, chunk_seconds=60):
+    peak_times = {clip_name: [] for clip_name in tracker.clip_names}
+    for start in range(0, len(audio), chunk_seconds * sr):
+        chunk_peak_times, chunk_peak_scores = tracker.process(audio[start:start + chunk_seconds * sr])
+        for clip_name, clip_peak_times in chunk_peak_times.items():
+            peak_times[clip_name].extend(clip_peak_times)
+            assert all(0.3 <= score <= 1.1 for score in chunk_peak_scores[clip_name])
+    return peak_times
+
+
+def test_get_tone_frequency():
+    assert get_tone_frequency(make_tone(1040, 0.25), sr) == pytest.approx(1040, abs=sr / (0.25 * sr))
+
+
+def test_finds_tones_across_chunks():
+    beep = make_tone(1000, 0.25)
+    audio = make_audio([beep, beep, beep * 0.3], [10 * sr, int(59.9 * sr), int(90.5 * sr)], 120)
+    peak_times = track(ToneTracker([("beep", beep)], sr), audio)
+    np.testing.assert_allclose(peak_times["beep"], [10, 59.9, 90.5], atol=0.02)
+
+
+def test_bank_of_frequencies():
+    low = make_tone(500, 0.25)
+    high = make_tone(1000, 0.5)
+    audio = make_audio([low, high, low, high], [5 * sr, 20 * sr, int(35.5 * sr), 50 * sr], 60)
+    peak_times = track(ToneTracker([("low", low), ("high", high)], sr), audio)
+    np.testing.assert_allclose(peak_times["low"], [5, 35.5], atol=0.02)
+    np.testing.assert_allclose(peak_times["high"], [20, 50], atol=0.02)
+
+
+def test_wrong_duration_is_not_a_match():
+    beep = make_tone(1000, 0.25)
+    audio = make_audio([make_tone(1000, 1), make_tone(1000, 0.05), beep], [5 * sr, 20 * sr, 35 * sr], 60)
+    peak_times = track(ToneTracker([("beep", beep)], sr), audio)
+    np.testing.assert_allclose(peak_times["beep"], [35], atol=0.02)
+
+
+def test_wrong_envelope_is_not_a_match():
+    beep = make_tone(1000, 0.25)
+    t = np.arange(len(beep)) / sr
+    # same frequency and duration, but wavering or swelling instead of steady
+    tremolo = beep * (0.6 + 0.4 * np.sign(np.sin(2 * np.pi * 8 * t)))
+    swell = beep * np.linspace(0.1, 1, len(beep))
+    audio = make_audio([tremolo, swell, beep * 0.3], [5 * sr, 20 * sr, 35 * sr], 60)
+    peak_times = track(ToneTracker([("beep", beep)], sr), audio)
+    np.testing.assert_allclose(peak_times["beep"], [35], atol=0.02)
+
+
+@pytest.mark.parametrize("end_offset", [0, 37, 160])
+def test_flush_finds_tone_at_end(end_offset):
+    beep = make_tone(1000, 0.25)
+    # the tone ends with the audio or a few samples before, in the last block or the samples after it
+    audio = make_audio([beep], [50 * sr - len(beep) - end_offset], 50)
+    tracker = ToneTracker([("beep", beep)], sr)
+    peak_times = track(tracker, audio)
+    if end_offset == 0:
+        # no block after it
+        assert peak_times["beep"] == []
+    # found once, before or by flush
+    peak_times["beep"].extend(tracker.flush()[0]["beep"])
+    np.testing.assert_allclose(peak_times["beep"], [50 - 0.25 - end_offset / sr], atol=0.02)
+
+
+def test_flush_without_tone_at_end():
+    beep = make_tone(1000, 0.25)
+    tracker = ToneTracker([("beep", beep)], sr)
+    peak_times = track(tracker, make_audio([beep], [10 * sr], 30))
+    np.testing.assert_allclose(peak_times["beep"], [10], atol=0.02)
+    assert tracker.flush()[0] == {"beep": []}
+
+
+def test_start_sample():
+    beep = make_tone(1000, 0.25)
+    tracker = ToneTracker([("beep", beep)], sr, start_sample=120 * sr)
+    peak_times = track(tracker, make_audio([beep], [10 * sr], 30))
+    np.testing.assert_allclose(peak_times["beep"], [130], atol=0.02)
+
+
+def test_clip_without_tone():
+    with pytest.raises(ValueError):
+        ToneTracker([("silence", np.zeros(sr))], sr)